@@ -1,141 +1,2364 @@
-from datetime import datetime
-import math
-from typing import Dict, Tuple
-import dateutil.parser
-import glob
+import bisect
+import codecs
+import contextlib
 import json
+import math
 import os
-
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from array import array
+from concurrent.futures import Executor
+from datetime import date, datetime, timedelta, timezone
+from typing import (
+    BinaryIO,
+    Dict,
+    FrozenSet,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 _result_transactions = ["ResultCreateRequest", "ResultUpdateRequest"]
 _step_transactions = ["StepCreateRequest", "StepUpdateRequest"]
 
+# The store and forward service writes requests in the system ANSI code page, which
+# only exists as a codec on Windows.
+try:
+    _TRANSACTION_ENCODING = codecs.lookup("ansi").name
+except LookupError:
+    _TRANSACTION_ENCODING = "latin-1"
+
+# How many lines are parsed between checks of the time budget of a scan.
+_BUDGET_CHECK_LINES = 256
+
+# Buffers are read in chunks of this size, so memory use does not depend on their size.
+_CHUNK_SIZE = 1024 * 1024
+
+# Every request ends with its "timestamp" and "type" properties. Matching them at the end
+# of the line avoids decoding the whole request, and nested objects can't be mistaken
+# for the request itself because the match must be followed by the closing brace.
+_TRANSACTION_SUFFIX = re.compile(
+    rb'[{,]\s*"timestamp"\s*:\s*"([^"\\]*)"\s*,\s*"type"\s*:\s*"([^"\\]*)"\s*}\s*$'
+)
+_TRANSACTION_SUFFIX_WINDOW = 256
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+# The exact format the store and forward service writes timestamps in, which is parsed
+# by slicing its fixed-width fields.
+_SERVICE_TIMESTAMP = re.compile(r"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{6}Z\Z", re.ASCII)
+_SERVICE_TIMESTAMP_HOUR_KEYS: Dict[str, int] = {}
+_SERVICE_TIMESTAMP_HOUR_KEYS_LIMIT = 4096
+
+# Other extended ISO 8601 timestamps are parsed from their fields with a regular
+# expression, and any other format is parsed by dateutil.
+_CANONICAL_TIMESTAMP = re.compile(
+    r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d+))?(?:Z|([+-])(\d\d):(\d\d))?\Z", re.ASCII
+)
+
+# Buffers are only scanned in parallel when at least this many bytes need to be parsed,
+# below that the cost of starting the scans in the worker processes dominates.
+_PARALLEL_SCAN_MIN_BYTES = 4 * 1024 * 1024
+
+# The properties of a quarantined request, or of its "properties" object, that may hold
+# the reason it was quarantined, in the order they are looked up.
+_QUARANTINE_REASON_PROPERTIES = ("error", "errorMessage", "reason")
+_QUARANTINE_REASON_MARKERS = (b'"error', b'"reason"')
+# Reasons are truncated to this many characters so that they can't exhaust memory.
+_QUARANTINE_REASON_LENGTH = 200
+
+# The upper bounds in bytes of the default size histogram buckets of the pending files.
+PENDING_FILE_SIZE_BUCKETS = (
+    64 * 1024,
+    1024 * 1024,
+    16 * 1024 * 1024,
+    256 * 1024 * 1024,
+    1024 * 1024 * 1024,
+)
+
+# How long after a change the modification time of a directory may still be unchanged,
+# in seconds. FAT file systems store modification times with a resolution of 2 seconds.
+_DIRECTORY_MTIME_RESOLUTION = 2
+
+# How recently a listed file must have been modified, in seconds, to be stat-ed again when
+# its listing is reused, because it may still be written to.
+_RECENT_WRITE_SECONDS = 10
+
+# Separates the type of a request from the values of the request properties it is
+# grouped by in the keys of the indexed timestamps.
+_GROUP_SEPARATOR = "\x1f"
+
+# Number of bytes before the resume offset that are remembered and compared on
+# the next scan to detect a buffer that was rewritten in place.
+_RESUME_GUARD_SIZE = 64
+
+# A saved index starts with this line, followed by a line with a JSON header describing
+# the buffers and the raw timestamp keys of all buffers. Files with another version are
+# ignored, so changing the layout only costs one full scan.
+_INDEX_FILE_MAGIC = b"SystemLinkStoreAndForwardIndex\n"
+_INDEX_FILE_VERSION = 1
+
+
+class FileInfo(NamedTuple):
+    """The identity, size and modification time of a file."""
+
+    path: str
+    size: int
+    mtime: int
+    inode: int
+
+    @classmethod
+    def from_stat(cls, path: str, stat: os.stat_result) -> "FileInfo":
+        """
+        Create the file information from a ``stat`` result.
+
+        :param path: The path of the file.
+        :param stat: The result of ``os.stat`` or ``os.DirEntry.stat`` for the file.
+        :return: The file information.
+        """
+        return cls(path, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+class DirectoryListing:
+    """The files with a given extension in a directory."""
+
+    def __init__(
+        self,
+        directory: str,
+        exists: bool,
+        files: List[FileInfo],
+        directoryStat: Optional[Tuple[int, int]] = None,
+        scanTime: float = 0.0,
+    ):
+        """
+        Create a listing.
+
+        :param directory: The directory that was listed.
+        :param exists: Whether the directory exists.
+        :param files: The files in the directory.
+        :param directoryStat: The inode and modification time of the directory when it was listed.
+        :param scanTime: The time.time() the directory was listed at.
+        """
+        self.directory = directory
+        self.exists = exists
+        self.files = files
+        # The inode and modification time of the directory when it was listed, and the
+        # time.time() it was listed at, if the listing may be reused while they match.
+        self.directoryStat = directoryStat
+        self.scanTime = scanTime
+        self._fingerprint: Optional[FrozenSet[FileInfo]] = None
+        self._fileAnalysis: Optional[Tuple[List[int], PendingFileAnalysis]] = None
+
+    @property
+    def fingerprint(self) -> FrozenSet[FileInfo]:
+        """
+        The identity, size and modification time of every file in the listing.
+
+        Two listings of a directory have the same fingerprint if no file was added,
+        removed, replaced or written to between them.
+        """
+        if self._fingerprint is None:
+            self._fingerprint = frozenset(self.files)
+        return self._fingerprint
+
+    @property
+    def paths(self) -> List[str]:
+        """The paths of the files."""
+        return [f.path for f in self.files]
+
+    @property
+    def size_kib(self) -> int:
+        """The total size of the files in KiB, rounded up."""
+        return int(math.ceil(sum(f.size for f in self.files) / 1024))
+
+    @classmethod
+    def scan(
+        cls, directory: Optional[str], extension: str, previous: Optional["DirectoryListing"] = None
+    ) -> "DirectoryListing":
+        """
+        List the files with an extension in a directory with a single ``os.scandir`` pass.
+
+        :param directory: The directory to list, or ``None`` for a missing directory.
+        :param extension: The extension of the files to list, such as ``".jsonl"``.
+        :param previous: An earlier listing of the directory to reuse if no file was added
+          to or removed from the directory since, as told by its modification time. Files
+          modified shortly before the earlier listing may still be written to, which
+          doesn't change the directory, so they are stat-ed again.
+        :return: The listing of the directory.
+        """
+        files: List[FileInfo] = []
+        if directory is None:
+            return cls(directory, False, files)
+        scanTime = time.time()
+        try:
+            stat = os.stat(directory)
+        except (FileNotFoundError, NotADirectoryError):
+            return cls(directory, False, files)
+        directoryStat = (stat.st_ino, stat.st_mtime_ns)
+        if (
+            previous is not None
+            and previous.directory == directory
+            and previous.directoryStat == directoryStat
+            # A change in the same tick of the clock as the previous listing, or within the
+            # resolution of the file system, may not have changed the modification time.
+            and stat.st_mtime_ns < (previous.scanTime - _DIRECTORY_MTIME_RESOLUTION) * 1e9
+        ):
+            recentKey = (previous.scanTime - _RECENT_WRITE_SECONDS) * 1e9
+            if all(f.mtime < recentKey for f in previous.files):
+                return previous
+            files = [f if f.mtime < recentKey else _restat(f) for f in previous.files]
+            files = [f for f in files if f is not None]
+            if files == previous.files:
+                # The files were stat-ed now, so they are only stat-ed again while recent.
+                previous.scanTime = scanTime
+                return previous
+            return cls(directory, True, files, directoryStat, scanTime)
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if _has_extension(entry, extension):
+                        files.append(FileInfo.from_stat(entry.path, entry.stat()))
+        except (FileNotFoundError, NotADirectoryError):
+            return cls(directory, False, [])
+        return cls(directory, True, files, directoryStat, scanTime)
+
+
+class StoreSnapshot:
+    """
+    A listing of the store and forward directories taken once and shared by all inspections.
+
+    Taking a snapshot lists the testmon store directory, its quarantine directory and the
+    file store directory with one ``os.scandir`` pass each. The ``stat`` results cached
+    by ``os.scandir`` are reused so files are not stat-ed again by each ``calculate_*``
+    function.
+    """
+
+    def __init__(
+        self,
+        storeDirectory: str,
+        buffers: DirectoryListing,
+        quarantine: DirectoryListing,
+        files: DirectoryListing,
+        cacheFile: Optional[FileInfo],
+    ):
+        """
+        Create a snapshot from listings that were already taken.
+
+        :param storeDirectory: The data directory store and forward requests are stored in.
+        :param buffers: The listing of the testmon store buffers.
+        :param quarantine: The listing of the quarantine directory.
+        :param files: The listing of the file store directory.
+        :param cacheFile: The file of the persisted buffer index, if there is one.
+        """
+        self.storeDirectory = storeDirectory
+        self.buffers = buffers
+        self.quarantine = quarantine
+        self.files = files
+        self.cacheFile = cacheFile
+
+    @property
+    def fingerprint(self) -> Hashable:
+        """The fingerprint of the store directories, see :attr:`DirectoryListing.fingerprint`."""
+        return (
+            self.buffers.fingerprint,
+            self.quarantine.fingerprint,
+            self.files.fingerprint,
+            self.cacheFile,
+        )
+
+    @classmethod
+    def take(
+        cls,
+        storeDirectory: str,
+        fileStoreDirectory: Optional[str] = None,
+        previous: Optional["StoreSnapshot"] = None,
+    ) -> "StoreSnapshot":
+        """
+        Take a snapshot of the store and forward directories.
+
+        :param storeDirectory: The data directory store and forward requests are stored in.
+        :param fileStoreDirectory: The data directory store and forward files are stored in,
+          if pending files should be included in the snapshot.
+        :param previous: An earlier snapshot of the same directories. Its listing of the
+          file store directory is reused if no file was added or removed since, so that
+          the directory isn't read again, and with its analysis if no file changed.
+        :return: The snapshot.
+        """
+        bufferFiles: List[FileInfo] = []
+        cacheFile = None
+        quarantineDirectory = None
+        exists = True
+        try:
+            with os.scandir(storeDirectory) as entries:
+                for entry in entries:
+                    if _has_extension(entry, ".jsonl"):
+                        bufferFiles.append(FileInfo.from_stat(entry.path, entry.stat()))
+                    elif entry.name == "__CACHE__" and entry.is_file():
+                        cacheFile = FileInfo.from_stat(entry.path, entry.stat())
+                    elif entry.name == "quarantine" and entry.is_dir():
+                        quarantineDirectory = entry.path
+        except (FileNotFoundError, NotADirectoryError):
+            exists = False
+
+        if quarantineDirectory is not None:
+            quarantine = DirectoryListing.scan(quarantineDirectory, ".jsonl")
+        else:
+            quarantine = DirectoryListing(os.path.join(storeDirectory, "quarantine"), False, [])
+        return cls(
+            storeDirectory,
+            DirectoryListing(storeDirectory, exists, bufferFiles),
+            quarantine,
+            DirectoryListing.scan(
+                fileStoreDirectory, ".file", previous.files if previous is not None else None
+            ),
+            cacheFile,
+        )
+
+
+class StoreWatcher:
+    """
+    Takes snapshots of the store directories, reusing the previous one when nothing changed.
+
+    When the optional ``watchdog`` package is installed, the directories are watched for
+    changes and a tick without changes does no I/O at all. Otherwise, or when the
+    directories can't be watched, they are listed every time and the previous snapshot is
+    reused if the new listing has the same fingerprint. Either way, inspections of an
+    unchanged snapshot return their cached results.
+    """
+
+    def __init__(
+        self,
+        storeDirectory: str,
+        fileStoreDirectory: Optional[str] = None,
+        watch: bool = True,
+        maxUnchangedSeconds: float = 300,
+    ):
+        """
+        Initialize the watcher.
+
+        :param storeDirectory: The data directory store and forward requests are stored in.
+        :param fileStoreDirectory: The data directory store and forward files are stored in.
+        :param watch: Whether to watch the directories for changes when possible.
+        :param maxUnchangedSeconds: How long a snapshot is reused without listing the
+          directories, in case a change notification was missed.
+        """
+        self.storeDirectory = storeDirectory
+        self.fileStoreDirectory = fileStoreDirectory
+        self.maxUnchangedSeconds = maxUnchangedSeconds
+        self._watch = watch
+        self._observer = None
+        self._changed = threading.Event()
+        self._snapshot: Optional[StoreSnapshot] = None
+        self._snapshotTime = 0.0
+
+    @property
+    def watching(self) -> bool:
+        """Whether change notifications are used instead of listing the directories."""
+        return self._observer is not None
+
+    def snapshot(self) -> StoreSnapshot:
+        """
+        Get a snapshot of the store directories.
+
+        :return: The previous snapshot if nothing changed since it was taken, otherwise a
+          new snapshot.
+        """
+        if self._watch and self._observer is None:
+            self._start_observer()
+
+        now = time.monotonic()
+        if (
+            self._observer is not None
+            and self._snapshot is not None
+            and not self._changed.is_set()
+            and now - self._snapshotTime < self.maxUnchangedSeconds
+        ):
+            return self._snapshot
+
+        self._changed.clear()
+        snapshot = StoreSnapshot.take(self.storeDirectory, self.fileStoreDirectory, self._snapshot)
+        if self._snapshot is None or snapshot.fingerprint != self._snapshot.fingerprint:
+            self._snapshot = snapshot
+        self._snapshotTime = now
+        return self._snapshot
+
+    def stop(self):
+        """Stop watching the directories."""
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+
+    def _start_observer(self):
+        try:
+            from watchdog.events import (
+                EVENT_TYPE_CREATED,
+                EVENT_TYPE_DELETED,
+                EVENT_TYPE_MODIFIED,
+                EVENT_TYPE_MOVED,
+                FileSystemEventHandler,
+            )
+            from watchdog.observers import Observer
+        except ImportError:
+            self._watch = False
+            return
+
+        changed = self._changed
+        # Reading the buffers raises opened and closed events, which don't change the store.
+        changes = {EVENT_TYPE_CREATED, EVENT_TYPE_DELETED, EVENT_TYPE_MODIFIED, EVENT_TYPE_MOVED}
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.event_type in changes:
+                    changed.set()
+
+        directories = [
+            d for d in (self.storeDirectory, self.fileStoreDirectory) if d and os.path.isdir(d)
+        ]
+        if len(directories) < len([d for d in (self.storeDirectory, self.fileStoreDirectory) if d]):
+            # Try again once the directories exist, and list them until then.
+            return
+        observer = Observer()
+        try:
+            for directory in directories:
+                observer.schedule(_Handler(), directory, recursive=directory == self.storeDirectory)
+            observer.daemon = True
+            observer.start()
+        except Exception:
+            self._watch = False
+            return
+        self._changed.set()
+        self._observer = observer
+
+
+class PendingFileAnalysis(NamedTuple):
+    """The sizes and ages of the files pending upload."""
+
+    # The number of pending files.
+    files: int
+    # The total size of the pending files in bytes.
+    totalBytes: int
+    # The largest pending file, or None if there are none.
+    largest: Optional[FileInfo]
+    # The pending file modified the longest time ago, or None if there are none.
+    oldest: Optional[FileInfo]
+    # The number of files by size. Bucket ``i`` counts the files no larger than
+    # ``sizeBuckets[i]`` bytes and larger than the previous bucket; the last bucket
+    # counts larger files.
+    sizeHistogram: List[int]
+
+
+class TransactionClassifier:
+    """
+    Sorts request types into the categories pending requests are counted by.
+
+    Override :meth:`category` for rules other than lists of types.
+    """
+
+    def __init__(self, categories: Optional[Dict[str, Iterable[str]]] = None):
+        """
+        Create a classifier from lists of types.
+
+        :param categories: The request types in each category. A type listed in more than
+          one category is counted in the first. Defaults to ``results`` and ``steps``.
+        """
+        if categories is None:
+            categories = {"results": _result_transactions, "steps": _step_transactions}
+        self.categories = {category: list(types) for (category, types) in categories.items()}
+        self._categoryOfType: Dict[str, str] = {}
+        for category, types in self.categories.items():
+            for transactionType in types:
+                self._categoryOfType.setdefault(transactionType, category)
+
+    def category(self, transactionType: str) -> Optional[str]:
+        """
+        Get the category of a request type.
+
+        :param transactionType: The ``type`` of a request, such as ``ResultCreateRequest``.
+        :return: The category, or ``None`` if requests of the type aren't categorized.
+        """
+        return self._categoryOfType.get(transactionType)
+
+
+class PendingEstimate(NamedTuple):
+    """The pending result and step requests, estimated for buffers too large to count."""
+
+    results: int
+    steps: int
+    # The half widths of approximate 95% confidence intervals of the estimates, 0 if the
+    # requests were counted exactly.
+    resultsError: float
+    stepsError: float
+    # Whether every buffer was counted exactly.
+    exact: bool
+
+
+class PendingEstimator:
+    """Settings for estimating pending requests by sampling, and when they last counted exactly."""
+
+    def __init__(
+        self,
+        minimumBytes: int = 256 * 1024 * 1024,
+        samples: int = 32,
+        sampleBytes: int = 64 * 1024,
+        reconcileInterval: float = 3600,
+        seed: Optional[int] = None,
+    ):
+        """
+        Create an estimator.
+
+        :param minimumBytes: The unindexed bytes of a buffer above which it is sampled
+          instead of counted. Buffers up to twice the bytes of all samples are always
+          counted.
+        :param samples: The number of windows sampled from each buffer.
+        :param sampleBytes: The size of each sampled window in bytes.
+        :param reconcileInterval: The number of seconds between exact counts.
+        :param seed: Seeds the choice of the sampled windows, to make estimates repeatable.
+        """
+        self.minimumBytes = minimumBytes
+        self.samples = samples
+        self.sampleBytes = sampleBytes
+        self.reconcileInterval = reconcileInterval
+        self._random = random.Random(seed)
+        # The time.monotonic() time of the next exact count of each store directory.
+        self._nextReconcile: Dict[str, float] = {}
+        # The last estimate of each store directory whose counted buffers were all scanned.
+        self._lastEstimates: Dict[str, "PendingEstimate"] = {}
+
+
+class BufferBreakdown(NamedTuple):
+    """The size of a transaction buffer and its pending requests by type."""
+
+    size: int
+    byType: Dict[str, int]
+
+
+class PendingBreakdown(NamedTuple):
+    """Pending requests by type, category, buffer and group."""
+
+    # Every request type found in the buffers, including types with no pending requests.
+    byType: Dict[str, int]
+    # Every category of the classifier.
+    byCategory: Dict[str, int]
+    # Every buffer by path.
+    byBuffer: Dict[str, BufferBreakdown]
+    # The pending requests by type for each combination of values of the properties the
+    # index groups by, in the order of its ``groupBy``. Empty if the index doesn't group.
+    byGroup: Dict[Tuple[str, ...], Dict[str, int]]
+
+
+class _PendingCounts(NamedTuple):
+    byType: Dict[str, int]
+    byBuffer: Dict[str, BufferBreakdown]
+    byGroup: Dict[Tuple[str, ...], Dict[str, int]]
+
+
+class SpaceSaving:
+    """
+    Approximate counts of the most frequent items using a fixed number of counters.
 
-def calculate_pending_files(storeDirectory: str) -> int:
+    Implements the Space-Saving algorithm of Metwally, Agrawal and El Abbadi: when all
+    counters are in use, a new item replaces the item with the lowest count and inherits
+    its count as the maximum overestimate. Every item occurring more often than
+    ``total / capacity`` is guaranteed to be counted.
+    """
+
+    def __init__(self, capacity: int):
+        """
+        Create an empty counter.
+
+        :param capacity: The number of items counted at once.
+        """
+        self.capacity = max(1, capacity)
+        self._counts: Dict[Hashable, int] = {}
+        self._errors: Dict[Hashable, int] = {}
+
+    def add(self, item: Hashable, count: int = 1):
+        """
+        Count occurrences of an item.
+
+        :param item: The item to count.
+        :param count: The number of occurrences.
+        """
+        if item in self._counts:
+            self._counts[item] += count
+        elif len(self._counts) < self.capacity:
+            self._counts[item] = count
+            self._errors[item] = 0
+        else:
+            evicted = min(self._counts, key=self._counts.__getitem__)
+            minimum = self._counts.pop(evicted)
+            del self._errors[evicted]
+            self._counts[item] = minimum + count
+            self._errors[item] = minimum
+
+    def top(self, n: Optional[int] = None) -> List[Tuple[Hashable, int, int]]:
+        """
+        Get the most frequent items.
+
+        :param n: The number of items to return. Defaults to all counted items.
+        :return: Tuples of each item, its estimated count and the maximum amount the count
+          is overestimated by, most frequent first.
+        """
+        items = sorted(self._counts.items(), key=lambda i: i[1], reverse=True)[:n]
+        return [(item, count, self._errors[item]) for (item, count) in items]
+
+
+class QuarantineAnalysis(NamedTuple):
+    """Quarantined requests by failure class and age."""
+
+    # The number of quarantined requests analyzed.
+    requests: int
+    # The most frequent failure classes, as tuples of the ``(type, reason)`` of the class,
+    # its estimated count and the maximum amount the count is overestimated by. The reason
+    # is empty for requests that don't record one.
+    topClasses: List[Tuple[Tuple[str, str], int, int]]
+    # The number of requests by age. Bucket ``i`` counts the requests younger than
+    # ``ageBuckets[i]`` seconds and older than the previous bucket; the last bucket counts
+    # older requests and requests without a valid timestamp.
+    ageHistogram: List[int]
+    # Failure classes that weren't seen by an earlier analysis with the same analyzer.
+    # Empty for the first analysis.
+    newClasses: List[Tuple[str, str]]
+
+
+class QuarantineAnalyzer:
+    """
+    Aggregates quarantined requests by failure class and age in bounded memory.
+
+    Keeps the failure classes seen by earlier analyses to report the ones that are new,
+    forgetting the least recently seen classes beyond ``maxKnownClasses``. The requests
+    are counted in bins of their absolute time up to the oldest age bucket, so the ages
+    can be updated without reading the buffers again.
+    """
+
+    def __init__(
+        self,
+        topK: int = 10,
+        ageBuckets: Sequence[float] = (3600, 6 * 3600, 86400, 7 * 86400, 30 * 86400),
+        maxKnownClasses: int = 1024,
+        maxNewClasses: int = 10,
+        ageResolution: int = 12,
+    ):
+        """
+        Create an analyzer.
+
+        :param topK: The number of failure classes to count. Classes more frequent than
+          ``1 / topK`` of the requests are always reported.
+        :param ageBuckets: The upper bounds of the age histogram buckets in seconds, in
+          increasing order.
+        :param maxKnownClasses: The most failure classes remembered between analyses.
+        :param maxNewClasses: The most new failure classes reported per analysis.
+        :param ageResolution: The number of bins the first age bucket is split into. Ages
+          are accurate to half a bin, and there are at most as many bins as fit into the
+          last age bucket.
+        """
+        self.topK = topK
+        self.ageBuckets = list(ageBuckets)
+        self.maxKnownClasses = maxKnownClasses
+        self.maxNewClasses = maxNewClasses
+        self.ageResolution = ageResolution
+        self._knownClasses: Dict[Tuple[str, str], None] = {}
+        self._analyzed = False
+        self._last: Optional[Tuple[Hashable, QuarantineAnalysis]] = None
+        # The requests of the last analysis by bin of their timestamp, and the requests
+        # older than the last age bucket or without a valid timestamp.
+        self._bins: Dict[int, int] = {}
+        self._older = 0
+
+    def analyze(
+        self, quarantine: DirectoryListing, now: Optional[float] = None
+    ) -> QuarantineAnalysis:
+        """
+        Analyze the buffers of a quarantine directory.
+
+        :param quarantine: The listing of the quarantine directory.
+        :param now: The current time in seconds since the epoch. Defaults to ``time.time()``.
+        :return: The analysis. If no buffer changed since the previous analysis, its classes
+          are reused without new classes and only the ages are recalculated.
+        """
+        if now is None:
+            now = time.time()
+        nowKey = int(now * 1e6)
+        if self._last is not None and self._last[0] == quarantine.fingerprint:
+            analysis = self._last[1]._replace(newClasses=[])
+        else:
+            analysis = self._read(quarantine, nowKey)
+            self._last = (quarantine.fingerprint, analysis)
+        return analysis._replace(ageHistogram=self._age_histogram(nowKey))
+
+    def _read(self, quarantine: DirectoryListing, nowKey: int) -> QuarantineAnalysis:
+        # Counts the failure classes and bins the timestamps for the ages, which are left
+        # to the caller.
+        classes = SpaceSaving(self.topK)
+        binKey = self._bin_key()
+        nowBin = nowKey // binKey
+        # At most this many bins are within the last age bucket. Collapsing only when twice
+        # as many are used keeps the cost of collapsing the older ones per request constant.
+        maxBins = 2 * (int(self.ageBuckets[-1] * 1e6) // binKey + 2) if self.ageBuckets else 0
+        self._bins = {}
+        self._older = 0
+        newClasses: List[Tuple[str, str]] = []
+        requests = 0
+        for path in quarantine.paths:
+            try:
+                with open(path, "rb") as transactionBuffer:
+                    for line, _ in _read_lines(transactionBuffer, 0):
+                        transaction = _parse_transaction(line)
+                        if transaction is None:
+                            continue
+                        requests += 1
+                        failureClass = (transaction[0], _quarantine_reason(line))
+                        classes.add(failureClass)
+                        try:
+                            # Requests from the future are aged as if they were just added.
+                            timeBin = min(_parse_timestamp_key(transaction[1]) // binKey, nowBin)
+                            self._bins[timeBin] = self._bins.get(timeBin, 0) + 1
+                        except ValueError:
+                            self._older += 1
+                        if (
+                            self._remember(failureClass)
+                            and self._analyzed
+                            and len(newClasses) < self.maxNewClasses
+                        ):
+                            newClasses.append(failureClass)
+                        if len(self._bins) > maxBins:
+                            self._collapse_older_bins(nowKey)
+            except FileNotFoundError:
+                continue
+
+        self._analyzed = True
+        return QuarantineAnalysis(requests, classes.top(), [], newClasses)
+
+    def _bin_key(self) -> int:
+        # The width of the bins in microseconds.
+        return (
+            max(1, int(self.ageBuckets[0] * 1e6 / max(1, self.ageResolution)))
+            if self.ageBuckets
+            else 1
+        )
+
+    def _bin_age_key(self, timeBin: int, nowKey: int) -> int:
+        # The age of the middle of a bin in microseconds.
+        binKey = self._bin_key()
+        return nowKey - timeBin * binKey - binKey // 2
+
+    def _collapse_older_bins(self, nowKey: int):
+        # Requests only get older, so the bins past the last age bucket are counted once.
+        oldestKey = int(self.ageBuckets[-1] * 1e6) if self.ageBuckets else 0
+        for timeBin in [b for b in self._bins if self._bin_age_key(b, nowKey) >= oldestKey]:
+            self._older += self._bins.pop(timeBin)
+
+    def _age_histogram(self, nowKey: int) -> List[int]:
+        self._collapse_older_bins(nowKey)
+        bucketKeys = [int(age * 1e6) for age in self.ageBuckets]
+        histogram = [0] * (len(bucketKeys) + 1)
+        for timeBin, count in self._bins.items():
+            histogram[bisect.bisect_right(bucketKeys, self._bin_age_key(timeBin, nowKey))] += count
+        histogram[-1] += self._older
+        return histogram
+
+    def _remember(self, failureClass: Tuple[str, str]) -> bool:
+        # Returns True if the class wasn't known. Known classes are kept in the order they
+        # were last seen, so the least recently seen class is forgotten first.
+        known = self._knownClasses.pop(failureClass, False) is None
+        self._knownClasses[failureClass] = None
+        if len(self._knownClasses) > self.maxKnownClasses:
+            del self._knownClasses[next(iter(self._knownClasses))]
+        return not known
+
+
+class _ScanResult(NamedTuple):
+    """The requests parsed from the lines appended to a transaction buffer."""
+
+    offset: int
+    guard: bytes
+    timestamps: Dict[str, array]
+    # False if the scan stopped before the end of the buffer because its budget ran out.
+    complete: bool = True
+
+
+class _BufferScanState:
+    """
+    The incremental scan state of a single transaction buffer.
+
+    Records are never re-read once they have been scanned. Instead, the timestamp of
+    every scanned record is kept as a sorted checkpoint list per transaction type, so
+    the pending count for any ``lastProcessedTimestamp`` is a binary search.
+    """
+
+    __slots__ = ("inode", "size", "mtime", "offset", "guard", "timestamps")
+
+    def __init__(self, inode: int, size: int, mtime: int):
+        self.inode = inode
+        self.size = size
+        self.mtime = mtime
+        self.offset = 0
+        self.guard = b""
+        self.timestamps: Dict[str, array] = {}
+
+    def add(self, transactionType: str, timestampKey: int):
+        checkpoints = self.timestamps.get(transactionType)
+        if checkpoints is None:
+            checkpoints = self.timestamps[transactionType] = array("q")
+        if not checkpoints or checkpoints[-1] <= timestampKey:
+            checkpoints.append(timestampKey)
+        else:
+            bisect.insort(checkpoints, timestampKey)
+
+    def merge(self, scan: "_ScanResult"):
+        for transactionType, timestampKeys in scan.timestamps.items():
+            if not timestampKeys:
+                continue
+            # Requests are mostly appended in order, which sorted() handles in linear time.
+            timestampKeys = sorted(timestampKeys)
+            checkpoints = self.timestamps.get(transactionType)
+            if checkpoints is None:
+                self.timestamps[transactionType] = array("q", timestampKeys)
+            elif not checkpoints or checkpoints[-1] <= timestampKeys[0]:
+                checkpoints.extend(timestampKeys)
+            else:
+                checkpoints.extend(timestampKeys)
+                self.timestamps[transactionType] = array("q", sorted(checkpoints))
+        self.offset = scan.offset
+        self.guard = scan.guard
+
+    def first_after(self, timestampKey: int) -> Optional[int]:
+        first = None
+        for checkpoints in self.timestamps.values():
+            position = bisect.bisect_left(checkpoints, timestampKey)
+            if position < len(checkpoints) and (first is None or checkpoints[position] < first):
+                first = checkpoints[position]
+        return first
+
+    def count_after(self, timestampKey: int) -> Dict[str, int]:
+        return {
+            transactionType: len(checkpoints) - bisect.bisect_left(checkpoints, timestampKey)
+            for transactionType, checkpoints in self.timestamps.items()
+        }
+
+
+class ScanStatistics:
+    """How much work an index did to bring its buffers up to date."""
+
+    __slots__ = (
+        "filesScanned",
+        "bytesScanned",
+        "recordsParsed",
+        "recordsParsedByDirectory",
+        "resultsAndStepsParsedByDirectory",
+    )
+
+    def __init__(self):
+        """Create statistics of no work."""
+        self.filesScanned = 0
+        self.bytesScanned = 0
+        self.recordsParsed = 0
+        # The records parsed from the buffers in each directory, for indexes shared by stores.
+        self.recordsParsedByDirectory: Dict[str, int] = {}
+        # The result and step requests among them, which are the requests counted as pending.
+        self.resultsAndStepsParsedByDirectory: Dict[str, int] = {}
+
+    def add(
+        self, bytesScanned: int, recordsParsed: int, directory: str = "", resultsAndSteps: int = 0
+    ):
+        """
+        Count a scanned buffer.
+
+        :param bytesScanned: The bytes read from the buffer.
+        :param recordsParsed: The requests parsed from them.
+        :param directory: The directory of the buffer.
+        :param resultsAndSteps: The result and step requests among the parsed requests.
+        """
+        self.filesScanned += 1
+        self.bytesScanned += bytesScanned
+        self.recordsParsed += recordsParsed
+        self.recordsParsedByDirectory[directory] = (
+            self.recordsParsedByDirectory.get(directory, 0) + recordsParsed
+        )
+        self.resultsAndStepsParsedByDirectory[directory] = (
+            self.resultsAndStepsParsedByDirectory.get(directory, 0) + resultsAndSteps
+        )
+
+
+class ScanBudget:
+    """
+    Limits the bytes an index reads and the time it takes to scan its buffers per run.
+
+    A buffer whose scan runs out of budget keeps the requests parsed so far, and the
+    next run resumes where it stopped. Call :meth:`start` at the beginning of every run.
+    """
+
+    def __init__(self, maxBytes: int = 0, maxSeconds: float = 0):
+        """
+        Create a budget.
+
+        :param maxBytes: The most bytes to read per run, or 0 for no limit.
+        :param maxSeconds: The most seconds to spend scanning per run, or 0 for no limit.
+        """
+        self.maxBytes = maxBytes
+        self.maxSeconds = maxSeconds
+        # The number of runs, and of runs that ran out of bytes or time.
+        self.runs = 0
+        self.bytesHits = 0
+        self.timeHits = 0
+        # Whether the budget ran out in the current run.
+        self.exhausted = False
+        self._bytesRead = 0
+        self._deadline: Optional[float] = None
+
+    def start(self):
+        """Start a new run with the full budget."""
+        self.runs += 1
+        self.exhausted = False
+        self._bytesRead = 0
+        self._deadline = time.monotonic() + self.maxSeconds if self.maxSeconds else None
+
+    def remaining(self) -> Tuple[int, float]:
+        """
+        Get the budget left in the current run.
+
+        :return: A tuple of the bytes and seconds left, each 0 if not limited.
+        """
+        bytesLeft = max(1, self.maxBytes - self._bytesRead) if self.maxBytes else 0
+        secondsLeft = (
+            max(1e-6, self._deadline - time.monotonic()) if self._deadline is not None else 0
+        )
+        return (bytesLeft, secondsLeft)
+
+    def spend(self, bytesRead: int, complete: bool):
+        """
+        Account for a scan.
+
+        :param bytesRead: The bytes the scan read.
+        :param complete: Whether the scan reached the end of its buffer.
+        """
+        self._bytesRead += bytesRead
+        if self.exhausted:
+            return
+        timeUp = self._deadline is not None and time.monotonic() >= self._deadline
+        # A scan that stopped before the deadline stopped at its share of the bytes.
+        bytesUp = bool(self.maxBytes) and (
+            self._bytesRead >= self.maxBytes or (not complete and not timeUp)
+        )
+        if bytesUp:
+            self.exhausted = True
+            self.bytesHits += 1
+        elif timeUp:
+            self.exhausted = True
+            self.timeHits += 1
+
+
+class BufferIndex:
+    """
+    Persistent per-file scan state of the transaction buffers in a store directory.
+
+    Keeping an index between calls lets :func:`calculate_pending_requests` parse only
+    the lines appended to each buffer since the previous call. A buffer that was
+    truncated, replaced or rewritten in place is detected and rescanned from the start.
+    """
+
+    def __init__(self, groupBy: Sequence[str] = ()):
+        """
+        Create an empty index.
+
+        :param groupBy: The properties of the request data to group pending requests by,
+          such as ``workspace`` or ``programName``. Grouping decodes every request, so
+          scans are considerably slower with it.
+        """
+        self.groupBy = tuple(groupBy)
+        self.states: Dict[str, _BufferScanState] = {}
+        # The number of records of each quarantine buffer, with the size and modification
+        # time of the buffer when it was counted.
+        self.quarantineRecords: Dict[str, Tuple[int, int, int]] = {}
+        # The last pending request counts of each store directory, with the fingerprint of
+        # the buffers and cache file they were calculated from.
+        self._pendingRequests: Dict[str, Tuple[Hashable, _PendingCounts]] = {}
+        # The work done by the index since the statistics were last replaced.
+        self.statistics = ScanStatistics()
+        # Limits the scans of each run, if set.
+        self.budget: Optional[ScanBudget] = None
+        # Whether the last call to scan_all left buffers partially scanned because the
+        # budget ran out.
+        self.incomplete = False
+
+    def scan(self, transactionBuffer: FileInfo) -> _BufferScanState:
+        """
+        Bring the scan state of a transaction buffer up to date.
+
+        :param transactionBuffer: The transaction buffer to scan, as listed in a snapshot.
+        :return: The up to date scan state of the buffer.
+        """
+        return self.scan_all([transactionBuffer])[0]
+
+    def scan_all(
+        self, transactionBuffers: List[FileInfo], executor: Optional[Executor] = None
+    ) -> List[_BufferScanState]:
+        """
+        Bring the scan state of transaction buffers up to date.
+
+        :param transactionBuffers: The transaction buffers to scan, as listed in a snapshot.
+        :param executor: An executor from :func:`create_scan_executor` to parse the buffers
+          in parallel, or ``None`` to parse them on the calling thread.
+        :return: The up to date scan states of the buffers that still exist.
+        """
+        states: List[_BufferScanState] = []
+        changed: List[Tuple[FileInfo, _BufferScanState]] = []
+        for transactionBuffer in transactionBuffers:
+            state = self.states.get(transactionBuffer.path)
+            if (
+                state is not None
+                and state.size == transactionBuffer.size
+                and state.mtime == transactionBuffer.mtime
+            ):
+                states.append(state)
+                continue
+            if state is None or not _can_resume(state, transactionBuffer):
+                state = _BufferScanState(
+                    transactionBuffer.inode, transactionBuffer.size, transactionBuffer.mtime
+                )
+            changed.append((transactionBuffer, state))
+
+        self.incomplete = False
+        budget = self.budget
+        unscannedBytes = sum(t.size - s.offset for (t, s) in changed)
+        parallel = (
+            executor is not None and len(changed) > 1 and unscannedBytes >= _PARALLEL_SCAN_MIN_BYTES
+        )
+        if parallel:
+            if budget is not None and budget.exhausted:
+                scans, changed = ([], [])
+            else:
+                maxBytes, maxSeconds = budget.remaining() if budget is not None else (0, 0)
+                # Buffers are scanned at the same time, so they share the bytes but not the time.
+                maxBytes = max(1, maxBytes // len(changed)) if maxBytes else 0
+                futures = [
+                    executor.submit(
+                        _scan_transactions_in_worker,
+                        t.path,
+                        s.offset,
+                        s.guard,
+                        self.groupBy,
+                        maxBytes,
+                        maxSeconds,
+                    )
+                    for (t, s) in changed
+                ]
+                scans = [_future_scan_result(f) for f in futures]
+        else:
+            scans = []
+            for t, s in changed:
+                if budget is not None and budget.exhausted:
+                    break
+                maxBytes, maxSeconds = budget.remaining() if budget is not None else (0, 0)
+                scan = _try_scan_transactions(
+                    t.path, s.offset, s.guard, self.groupBy, maxBytes, maxSeconds
+                )
+                if budget is not None and scan:
+                    budget.spend(scan.offset - s.offset, scan.complete)
+                scans.append(scan)
+        if len(scans) < len(changed):
+            # The budget ran out before these buffers were scanned, and they are scanned by
+            # a later run. States that can be resumed are kept as they were, and the states
+            # of rewritten buffers, which would count requests that are gone, are dropped.
+            self.incomplete = True
+            for transactionBuffer, state in changed[len(scans) :]:
+                if state is not self.states.get(transactionBuffer.path):
+                    self.states.pop(transactionBuffer.path, None)
+                elif state.offset:
+                    states.append(state)
+
+        for (transactionBuffer, state), scan in zip(changed, scans):
+            if scan is False:
+                # The buffer was forwarded and deleted after the directory was listed.
+                self.states.pop(transactionBuffer.path, None)
+                continue
+            if scan is None:
+                # The bytes before the resume offset changed, so the buffer was rewritten.
+                state = _BufferScanState(
+                    transactionBuffer.inode, transactionBuffer.size, transactionBuffer.mtime
+                )
+                maxBytes, maxSeconds = budget.remaining() if budget is not None else (0, 0)
+                scan = _try_scan_transactions(
+                    transactionBuffer.path, 0, b"", self.groupBy, maxBytes, maxSeconds
+                )
+                if not scan:
+                    self.states.pop(transactionBuffer.path, None)
+                    continue
+                if budget is not None:
+                    budget.spend(scan.offset, scan.complete)
+            elif budget is not None and parallel:
+                budget.spend(scan.offset - state.offset, scan.complete)
+            self.statistics.add(
+                scan.offset - state.offset,
+                sum(len(t) for t in scan.timestamps.values()),
+                os.path.dirname(transactionBuffer.path),
+                _count_parsed_results_and_steps(scan),
+            )
+            state.merge(scan)
+            state.mtime = transactionBuffer.mtime
+            if scan.complete:
+                state.size = transactionBuffer.size
+            else:
+                # Only the scanned part is known, so the buffer isn't up to date until a
+                # later run scans the rest.
+                state.size = scan.offset
+                self.incomplete = True
+            self.states[transactionBuffer.path] = state
+            states.append(state)
+        return states
+
+    def count_records(self, transactionBuffer: FileInfo) -> int:
+        """
+        Count the records of a quarantine buffer, unless it didn't change since it was last counted.
+
+        :param transactionBuffer: The quarantine buffer, as listed in a snapshot.
+        :return: The number of records in the buffer.
+        """
+        counted = self.quarantineRecords.get(transactionBuffer.path)
+        if counted is not None and counted[:2] == (transactionBuffer.size, transactionBuffer.mtime):
+            return counted[2]
+        records = _count_records(transactionBuffer.path)
+        self.statistics.add(
+            transactionBuffer.size, records, os.path.dirname(transactionBuffer.path)
+        )
+        self.quarantineRecords[transactionBuffer.path] = (
+            transactionBuffer.size,
+            transactionBuffer.mtime,
+            records,
+        )
+        return records
+
+    def save(self, path: str):
+        """
+        Save the index to a file so that a new process can resume scanning where this one stopped.
+
+        The file is written next to its final path and renamed over it, so a crash while
+        saving leaves the previous file intact.
+
+        :param path: The file to save the index to. Its directory is created if needed.
+        """
+        buffers = []
+        keys = []
+        for bufferPath, state in self.states.items():
+            types = []
+            for transactionType, timestampKeys in state.timestamps.items():
+                types.append([transactionType, len(timestampKeys)])
+                keys.append(timestampKeys.tobytes())
+            buffers.append(
+                [
+                    bufferPath,
+                    state.inode,
+                    state.size,
+                    state.mtime,
+                    state.offset,
+                    state.guard.hex(),
+                    types,
+                ]
+            )
+        payload = b"".join(keys)
+        header = {
+            "version": _INDEX_FILE_VERSION,
+            "groupBy": list(self.groupBy),
+            "byteorder": sys.byteorder,
+            "itemsize": array("q").itemsize,
+            "crc32": zlib.crc32(payload),
+            "buffers": buffers,
+            "quarantine": [[p, *counted] for (p, counted) in self.quarantineRecords.items()],
+        }
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temporaryPath = tempfile.mkstemp(
+            prefix=os.path.basename(path), suffix=".tmp", dir=directory
+        )
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(_INDEX_FILE_MAGIC)
+                fp.write(json.dumps(header, separators=(",", ":")).encode("utf-8"))
+                fp.write(b"\n")
+                fp.write(payload)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(temporaryPath, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temporaryPath)
+            raise
+
+    @classmethod
+    def load(cls, path: str, groupBy: Sequence[str] = ()) -> "BufferIndex":
+        """
+        Load an index saved by :meth:`save`.
+
+        Buffers are not checked here. Each one is validated against its inode, size,
+        modification time and the bytes before its resume offset when it is next scanned,
+        and rescanned if it changed in a way that can't be resumed.
+
+        :param path: The file the index was saved to.
+        :param groupBy: The properties of the request data to group pending requests by.
+        :return: The saved index, or an empty index if the file doesn't exist, is damaged,
+            was saved in another format or grouped requests by other properties.
+        """
+        index = cls(groupBy)
+        try:
+            with open(path, "rb") as fp:
+                if fp.readline() != _INDEX_FILE_MAGIC:
+                    return index
+                header = json.loads(fp.readline())
+                payload = fp.read()
+            if (
+                header["version"] != _INDEX_FILE_VERSION
+                or tuple(header["groupBy"]) != index.groupBy
+                or header["itemsize"] != array("q").itemsize
+                or header["crc32"] != zlib.crc32(payload)
+            ):
+                return index
+            position = 0
+            for bufferPath, inode, size, mtime, offset, guard, types in header["buffers"]:
+                state = _BufferScanState(inode, size, mtime)
+                state.offset = offset
+                state.guard = bytes.fromhex(guard)
+                for transactionType, count in types:
+                    timestampKeys = array("q")
+                    end = position + count * timestampKeys.itemsize
+                    timestampKeys.frombytes(payload[position:end])
+                    if header["byteorder"] != sys.byteorder:
+                        timestampKeys.byteswap()
+                    state.timestamps[transactionType] = timestampKeys
+                    position = end
+                index.states[bufferPath] = state
+            for bufferPath, size, mtime, records in header["quarantine"]:
+                index.quarantineRecords[bufferPath] = (size, mtime, records)
+        except (OSError, ValueError, KeyError, TypeError):
+            return cls(groupBy)
+        return index
+
+    def prune(self, listing: DirectoryListing):
+        """
+        Forget the state of buffers that no longer exist in a directory.
+
+        :param listing: The listing of the directory with the buffers that still exist.
+        """
+        existing = set(listing.paths)
+        for states in (self.states, self.quarantineRecords):
+            for path in [
+                p for p in states if p not in existing and os.path.dirname(p) == listing.directory
+            ]:
+                del states[path]
+
+
+_default_index = BufferIndex()
+_default_quarantine_analyzer = QuarantineAnalyzer()
+_default_estimator = PendingEstimator()
+
+
+def calculate_pending_files(storeDirectory: Union[str, StoreSnapshot]) -> int:
     """
     Calculate the pending files to be forwarded in the store and forward directory.
 
-    :param storeDirectory: The data directory store and forward files are stored in.
+    :param storeDirectory: The data directory store and forward files are stored in, or
+      a snapshot that includes it.
     :return: The number of pending files to be uploaded
     """
-    if not os.path.isdir(storeDirectory):
-        return 0
+    if isinstance(storeDirectory, StoreSnapshot):
+        return len(storeDirectory.files.files)
+
+    return len(DirectoryListing.scan(storeDirectory, ".file").files)
+
+
+def calculate_pending_file_analysis(
+    storeDirectory: Union[str, StoreSnapshot],
+    sizeBuckets: Sequence[int] = PENDING_FILE_SIZE_BUCKETS,
+) -> PendingFileAnalysis:
+    """
+    Calculate the sizes and ages of the pending files to be forwarded.
+
+    The analysis only uses the sizes and modification times listed in the snapshot, and is
+    kept with the listing, so it is not repeated for a snapshot reused while nothing changed.
+
+    :param storeDirectory: The data directory store and forward files are stored in, or
+      a snapshot that includes it.
+    :param sizeBuckets: The upper bounds of the size histogram buckets in bytes, in
+      increasing order.
+    :return: The analysis.
+    """
+    if isinstance(storeDirectory, StoreSnapshot):
+        listing = storeDirectory.files
+    else:
+        listing = DirectoryListing.scan(storeDirectory, ".file")
+    sizeBuckets = list(sizeBuckets)
+    if listing._fileAnalysis is not None and listing._fileAnalysis[0] == sizeBuckets:
+        return listing._fileAnalysis[1]
 
-    return len(glob.glob(os.path.join(storeDirectory, "*.file")))
+    totalBytes = 0
+    largest: Optional[FileInfo] = None
+    oldest: Optional[FileInfo] = None
+    histogram = [0] * (len(sizeBuckets) + 1)
+    for f in listing.files:
+        totalBytes += f.size
+        if largest is None or f.size > largest.size:
+            largest = f
+        if oldest is None or f.mtime < oldest.mtime:
+            oldest = f
+        histogram[bisect.bisect_left(sizeBuckets, f.size)] += 1
+    analysis = PendingFileAnalysis(len(listing.files), totalBytes, largest, oldest, histogram)
+    listing._fileAnalysis = (sizeBuckets, analysis)
+    return analysis
 
 
-def calculate_pending_request_size(storeDirectory: str) -> Tuple[int, int]:
+def calculate_pending_request_size(storeDirectory: Union[str, StoreSnapshot]) -> Tuple[int, int]:
     """
     Calculate the size of the pending request directory, in files and KiBytes
 
-    :param storeDirectory: The data directory store and forward requests are stored in.
+    :param storeDirectory: The data directory store and forward requests are stored in, or
+      a snapshot of it.
     :return: A tuple with the first value the number of request buffer files and the
       second value the size of the request buffers files in KiB
     """
-    if not os.path.isdir(storeDirectory):
-        return (0, 0)
+    snapshot = _as_snapshot(storeDirectory)
+    return (len(snapshot.buffers.files), snapshot.buffers.size_kib)
 
-    transactionBufferPaths = glob.glob(os.path.join(storeDirectory, "*.jsonl"))
-    sizeInKiB = _sum_size_of_files_kib(transactionBufferPaths)
-    return (len(transactionBufferPaths), sizeInKiB)
 
-
-def calculate_pending_requests(storeDirectory: str) -> Tuple[int, int]:
+def calculate_pending_requests(
+    storeDirectory: Union[str, StoreSnapshot],
+    index: Optional[BufferIndex] = None,
+    executor: Optional[Executor] = None,
+) -> Optional[Tuple[int, int]]:
     """
     Calculate the pending requests to be forwarded in the store and forward directory.
 
-    :param storeDirectory: The data directory store and forward requests are stored in.
+    If the index has a :class:`ScanBudget` that runs out before every buffer is scanned,
+    the counts of the last complete scan are returned, or ``None`` if there was none, and
+    the next call resumes the scan.
+
+    :param storeDirectory: The data directory store and forward requests are stored in, or
+      a snapshot of it.
+    :param index: The index holding the scan state of the buffers between calls. Defaults
+      to an index shared by all calls in this process.
+    :param executor: An executor from :func:`create_scan_executor` to parse the buffers in
+      parallel. By default buffers are parsed on the calling thread.
     :return: A tuple with the first value the number of pending results requests and the
-      second value the number of pending steps requests
+      second value the number of pending steps requests, or ``None`` until a scan within
+      the budget completes.
     """
-    if not os.path.isdir(storeDirectory):
+    snapshot = _as_snapshot(storeDirectory)
+    if index is None:
+        index = _default_index
+    if snapshot.cacheFile is None:
         return (0, 0)
+    counts = _calculate_pending_counts(snapshot, index, executor)
+    if counts is None:
+        return None if index.incomplete else (0, 0)
+    pendingResults = sum(counts.byType.get(t, 0) for t in _result_transactions)
+    pendingSteps = sum(counts.byType.get(t, 0) for t in _step_transactions)
+    return (pendingResults, pendingSteps)
 
-    cacheFilePath = os.path.join(storeDirectory, "__CACHE__")
-    if not os.path.isfile(cacheFilePath):
-        return (0, 0)
 
-    lastProcessedTimestamp = _read_last_processed_timestamp(cacheFilePath)
-    pendingResults = 0
-    pendingSteps = 0
-    transactionBufferPaths = glob.glob(os.path.join(storeDirectory, "*.jsonl"))
-    for transactionBufferPath in transactionBufferPaths:
-        transactionCounts = _count_transactions_after(transactionBufferPath, lastProcessedTimestamp)
-        for t in _result_transactions:
-            pendingResults += transactionCounts.get(t, 0)
-        for t in _step_transactions:
-            pendingSteps += transactionCounts.get(t, 0)
+def scan_pending_requests(
+    snapshots: Sequence[StoreSnapshot], index: BufferIndex, executor: Optional[Executor] = None
+):
+    """
+    Bring the scan state of the transaction buffers of several stores up to date at once.
 
-    return (pendingResults, pendingSteps)
+    With an executor, the buffers of all the stores are parsed in parallel in one batch
+    instead of one store after the other, so stores with few changed buffers each still
+    keep the worker processes busy. :func:`calculate_pending_requests` then counts the
+    requests of each store from the index without parsing the buffers again.
 
+    :param snapshots: The snapshots of the store directories.
+    :param index: The index holding the scan state of the buffers of all the stores.
+    :param executor: An executor from :func:`create_scan_executor` to parse the buffers in
+      parallel. By default buffers are parsed on the calling thread.
+    """
+    transactionBuffers: List[FileInfo] = []
+    for snapshot in snapshots:
+        # Stores without a cache file have no pending requests, so their buffers aren't parsed.
+        if snapshot.cacheFile is not None:
+            index.prune(snapshot.buffers)
+            transactionBuffers.extend(snapshot.buffers.files)
+    index.scan_all(transactionBuffers, executor)
+
+
+def estimate_pending_requests(
+    storeDirectory: Union[str, StoreSnapshot],
+    index: Optional[BufferIndex] = None,
+    executor: Optional[Executor] = None,
+    estimator: Optional[PendingEstimator] = None,
+) -> Optional[PendingEstimate]:
+    """
+    Estimate the pending requests to be forwarded, sampling buffers too large to count every time.
+
+    Buffers with fewer unindexed bytes than the estimator's threshold are counted
+    exactly, as by :func:`calculate_pending_requests`. In larger ones, the requests after
+    the part already in the index are estimated from a fixed number of samples, so the
+    cost doesn't depend on their size. Every ``reconcileInterval`` seconds all buffers are
+    counted exactly instead, which also brings the index up to date so that the next
+    estimates only sample the requests appended since.
 
-def calculate_quaratine_size(storeDirectory: str) -> Tuple[int, int]:
+    :param storeDirectory: The data directory store and forward requests are stored in, or
+      a snapshot of it.
+    :param index: The index holding the scan state of the buffers between calls. Defaults
+      to an index shared by all calls in this process.
+    :param executor: An executor from :func:`create_scan_executor` to parse the buffers in
+      parallel. By default buffers are parsed on the calling thread.
+    :param estimator: The sampling settings and the time of the last exact count. Defaults
+      to an estimator shared by all calls in this process.
+    :return: The estimated pending requests. If the index has a :class:`ScanBudget` that
+      runs out before the counted buffers are scanned, the last estimate whose scan
+      completed, or ``None`` if there was none.
+    """
+    snapshot = _as_snapshot(storeDirectory)
+    if index is None:
+        index = _default_index
+    if estimator is None:
+        estimator = _default_estimator
+
+    now = time.monotonic()
+    nextReconcile = estimator._nextReconcile.get(snapshot.storeDirectory)
+    if nextReconcile is None:
+        # Estimate first; a huge backlog is most expensive to count the first time.
+        estimator._nextReconcile[snapshot.storeDirectory] = now + estimator.reconcileInterval
+    elif now >= nextReconcile:
+        counts = calculate_pending_requests(snapshot, index, executor)
+        if counts is not None:
+            estimator._nextReconcile[snapshot.storeDirectory] = now + estimator.reconcileInterval
+            estimate = PendingEstimate(counts[0], counts[1], 0.0, 0.0, True)
+            estimator._lastEstimates[snapshot.storeDirectory] = estimate
+            return estimate
+        # The budget ran out before the first exact count, so the requests are estimated
+        # until a later call completes it.
+
+    if snapshot.cacheFile is None:
+        return PendingEstimate(0, 0, 0.0, 0.0, True)
+    try:
+        lastProcessedTimestamp = _read_last_processed_timestamp(snapshot.cacheFile.path)
+    except FileNotFoundError:
+        return PendingEstimate(0, 0, 0.0, 0.0, True)
+
+    minimumBytes = max(
+        estimator.minimumBytes, 2 * max(2, estimator.samples) * estimator.sampleBytes
+    )
+    counted: List[FileInfo] = []
+    sampled: List[Tuple[FileInfo, Optional[_BufferScanState]]] = []
+    for transactionBuffer in snapshot.buffers.files:
+        state = index.states.get(transactionBuffer.path)
+        if (
+            state is not None
+            and not (
+                state.size == transactionBuffer.size and state.mtime == transactionBuffer.mtime
+            )
+            and not _can_resume(state, transactionBuffer)
+        ):
+            state = None
+        unindexedBytes = transactionBuffer.size - (state.offset if state is not None else 0)
+        if unindexedBytes >= minimumBytes:
+            sampled.append((transactionBuffer, state))
+        else:
+            counted.append(transactionBuffer)
+
+    index.prune(snapshot.buffers)
+    results, steps, resultsVariance, stepsVariance = (0.0, 0.0, 0.0, 0.0)
+    states = index.scan_all(counted, executor)
+    if index.incomplete:
+        # The budget ran out before the counted buffers were scanned, so the sum would
+        # only cover part of them. The scan resumes on the next call.
+        return estimator._lastEstimates.get(snapshot.storeDirectory)
+    for state in states:
+        bufferResults, bufferSteps = _count_results_and_steps(state, lastProcessedTimestamp)
+        results += bufferResults
+        steps += bufferSteps
+    for transactionBuffer, state in sampled:
+        start = 0
+        if state is not None:
+            # The indexed part is counted exactly, and only the rest is sampled. Checking
+            # the guard is left to the exact count, which rescans a rewritten buffer.
+            bufferResults, bufferSteps = _count_results_and_steps(state, lastProcessedTimestamp)
+            results += bufferResults
+            steps += bufferSteps
+            start = state.offset
+        try:
+            estimate = _sample_pending_transactions(
+                transactionBuffer.path, start, lastProcessedTimestamp, estimator
+            )
+        except FileNotFoundError:
+            continue
+        results += estimate[0]
+        steps += estimate[1]
+        resultsVariance += estimate[2] ** 2
+        stepsVariance += estimate[3] ** 2
+
+    estimate = PendingEstimate(
+        round(results),
+        round(steps),
+        math.sqrt(resultsVariance),
+        math.sqrt(stepsVariance),
+        not sampled,
+    )
+    estimator._lastEstimates[snapshot.storeDirectory] = estimate
+    return estimate
+
+
+def calculate_pending_breakdown(
+    storeDirectory: Union[str, StoreSnapshot],
+    index: Optional[BufferIndex] = None,
+    executor: Optional[Executor] = None,
+    classifier: Optional[TransactionClassifier] = None,
+) -> PendingBreakdown:
+    """
+    Calculate the pending requests by type, category, buffer and group.
+
+    Uses the same scan as :func:`calculate_pending_requests`, so calling both costs a
+    single pass over the appended requests.
+
+    :param storeDirectory: The data directory store and forward requests are stored in, or
+      a snapshot of it.
+    :param index: The index holding the scan state of the buffers between calls. Requests
+      are grouped by the properties the index groups by. Defaults to an index shared by
+      all calls in this process.
+    :param executor: An executor from :func:`create_scan_executor` to parse the buffers in
+      parallel. By default buffers are parsed on the calling thread.
+    :param classifier: Sorts request types into categories. Defaults to results and steps.
+    :return: The pending request counts.
+    """
+    if classifier is None:
+        classifier = TransactionClassifier()
+    byCategory = {category: 0 for category in classifier.categories}
+    counts = _calculate_pending_counts(_as_snapshot(storeDirectory), index, executor)
+    if counts is None:
+        return PendingBreakdown({}, byCategory, {}, {})
+    for transactionType, count in counts.byType.items():
+        category = classifier.category(transactionType)
+        if category is not None:
+            byCategory[category] = byCategory.get(category, 0) + count
+    return PendingBreakdown(
+        dict(counts.byType), byCategory, dict(counts.byBuffer), dict(counts.byGroup)
+    )
+
+
+def _calculate_pending_counts(
+    snapshot: StoreSnapshot, index: Optional[BufferIndex], executor: Optional[Executor]
+) -> Optional[_PendingCounts]:
+    if snapshot.cacheFile is None:
+        return None
+
+    if index is None:
+        index = _default_index
+
+    fingerprint = (snapshot.buffers.fingerprint, snapshot.cacheFile)
+    cached = index._pendingRequests.get(snapshot.storeDirectory)
+    if cached is not None and cached[0] == fingerprint:
+        # Neither the buffers nor the last processed timestamp changed.
+        return cached[1]
+
+    try:
+        lastProcessedTimestamp = _read_last_processed_timestamp(snapshot.cacheFile.path)
+    except FileNotFoundError:
+        return None
+    counts = _PendingCounts({}, {}, {})
+    index.prune(snapshot.buffers)
+    index.scan_all(snapshot.buffers.files, executor)
+    if index.incomplete:
+        # The budget ran out before every buffer was scanned. Until a later run completes
+        # the scan, the last complete counts are returned, and nothing before the first.
+        return cached[1] if cached is not None else None
+    for transactionBuffer in snapshot.buffers.files:
+        state = index.states.get(transactionBuffer.path)
+        if state is None:
+            continue
+        bufferCounts: Dict[str, int] = {}
+        for key, count in state.count_after(lastProcessedTimestamp).items():
+            transactionType, _, group = key.partition(_GROUP_SEPARATOR)
+            bufferCounts[transactionType] = bufferCounts.get(transactionType, 0) + count
+            counts.byType[transactionType] = counts.byType.get(transactionType, 0) + count
+            if index.groupBy and count:
+                groupCounts = counts.byGroup.setdefault(tuple(group.split(_GROUP_SEPARATOR)), {})
+                groupCounts[transactionType] = groupCounts.get(transactionType, 0) + count
+        counts.byBuffer[transactionBuffer.path] = BufferBreakdown(
+            transactionBuffer.size, bufferCounts
+        )
+
+    index._pendingRequests[snapshot.storeDirectory] = (fingerprint, counts)
+    return counts
+
+
+def calculate_oldest_pending_age(
+    storeDirectory: Union[str, StoreSnapshot],
+    index: Optional[BufferIndex] = None,
+    now: Optional[float] = None,
+) -> Optional[float]:
+    """
+    Calculate the age of the oldest request that wasn't forwarded yet.
+
+    Buffers the index is up to date for are looked up in the index. Other buffers are
+    not scanned. Instead, the first request after the last processed timestamp is found
+    by a binary search over the byte offsets of the buffer, relying on requests being
+    appended in timestamp order, and buffers last modified before the last processed
+    timestamp are skipped.
+
+    :param storeDirectory: The data directory store and forward requests are stored in, or
+      a snapshot of it.
+    :param index: The index holding the scan state of the buffers. Defaults to an index
+      shared by all calls in this process.
+    :param now: The current time in seconds since the epoch. Defaults to ``time.time()``.
+    :return: The age of the oldest pending request in seconds, or ``None`` if no requests
+      are pending.
+    """
+    snapshot = _as_snapshot(storeDirectory)
+    if snapshot.cacheFile is None:
+        return None
+
+    if index is None:
+        index = _default_index
+
+    try:
+        lastProcessedTimestamp = _read_last_processed_timestamp(snapshot.cacheFile.path)
+    except FileNotFoundError:
+        return None
+    oldest: Optional[int] = None
+    for transactionBuffer in snapshot.buffers.files:
+        state = index.states.get(transactionBuffer.path)
+        if (
+            state is not None
+            and state.size == transactionBuffer.size
+            and state.mtime == transactionBuffer.mtime
+        ):
+            timestampKey = state.first_after(lastProcessedTimestamp)
+        elif transactionBuffer.mtime // 1000 < lastProcessedTimestamp:
+            # Every request in the buffer was written before the last processed request.
+            continue
+        else:
+            try:
+                timestampKey = _search_first_timestamp_key(
+                    transactionBuffer.path, lastProcessedTimestamp
+                )
+            except FileNotFoundError:
+                continue
+        if timestampKey is not None and (oldest is None or timestampKey < oldest):
+            oldest = timestampKey
+
+    if oldest is None:
+        return None
+    if now is None:
+        now = time.time()
+    return max(0.0, now - oldest / 1e6)
+
+
+def calculate_quaratine_size(storeDirectory: Union[str, StoreSnapshot]) -> Tuple[int, int]:
     """
     Calculate the size of the quaratine directory, in files and KiBytes
 
-    :param storeDirectory: The data directory store and forward requests are stored in.
+    :param storeDirectory: The data directory store and forward requests are stored in, or
+      a snapshot of it.
     :return: A tuple with the first value the number of request buffer files and the
       second value the size of the request buffers files in KiB
     """
-    if not os.path.isdir(storeDirectory):
-        return (0, 0)
-
-    quaratineDirectory = os.path.join(storeDirectory, "quarantine")
-    if not os.path.isdir(quaratineDirectory):
-        return (0, 0)
-
-    transactionBufferPaths = glob.glob(os.path.join(quaratineDirectory, "*.jsonl"))
-    sizeInKiB = _sum_size_of_files_kib(transactionBufferPaths)
-    return (len(transactionBufferPaths), sizeInKiB)
+    snapshot = _as_snapshot(storeDirectory)
+    return (len(snapshot.quarantine.files), snapshot.quarantine.size_kib)
 
 
-def calculate_quaratine_requests(storeDirectory: str) -> int:
+def calculate_quaratine_requests(
+    storeDirectory: Union[str, StoreSnapshot], index: Optional[BufferIndex] = None
+) -> int:
     """
     Calculate the number of requests placed into quarantine.
 
-    :param storeDirectory: The data directory store and forward requests are stored in.
+    :param storeDirectory: The data directory store and forward requests are stored in, or
+      a snapshot of it.
+    :param index: The index remembering the number of requests in each quarantine buffer
+      between calls. Defaults to an index shared by all calls in this process.
     :return: The quantity of requests moved to quarantine.
     """
-    if not os.path.isdir(storeDirectory):
-        return 0
-
-    quaratineDirectory = os.path.join(storeDirectory, "quarantine")
-    if not os.path.isdir(quaratineDirectory):
-        return 0
+    snapshot = _as_snapshot(storeDirectory)
+    if index is None:
+        index = _default_index
 
     quarantined = 0
-    transactionBufferPaths = glob.glob(os.path.join(quaratineDirectory, "*.jsonl"))
-    for transactionBufferPath in transactionBufferPaths:
-        quarantined += len(list(_load_transactions(transactionBufferPath)))
+    for transactionBuffer in snapshot.quarantine.files:
+        try:
+            quarantined += index.count_records(transactionBuffer)
+        except FileNotFoundError:
+            pass
 
+    index.prune(snapshot.quarantine)
     return quarantined
 
 
-def _read_last_processed_timestamp(cacheFilePath: str) -> datetime:
-    with open(cacheFilePath, "r", encoding="ansi") as cacheFile:
+def calculate_quaratine_requests_by_type(
+    storeDirectory: Union[str, StoreSnapshot], types: Optional[List[str]] = None
+) -> Dict[str, int]:
+    """
+    Calculate the number of requests of each type placed into quarantine.
+
+    Requests are matched by their ``"type":"<type>"}`` suffix in the compact layout the
+    store and forward service writes, without decoding them.
+
+    :param storeDirectory: The data directory store and forward requests are stored in, or
+      a snapshot of it.
+    :param types: The request types to count. Defaults to the result and step requests.
+    :return: The quantity of requests moved to quarantine, by request type.
+    """
+    if types is None:
+        types = _result_transactions + _step_transactions
+    counts = {t: 0 for t in types}
+
+    patterns = [b'"type":"' + t.encode("ascii") + b'"}' for t in types]
+    snapshot = _as_snapshot(storeDirectory)
+    for transactionBufferPath in snapshot.quarantine.paths:
+        try:
+            bufferCounts, _ = _count_patterns(transactionBufferPath, patterns)
+        except FileNotFoundError:
+            continue
+        for t, count in zip(types, bufferCounts):
+            counts[t] += count
+
+    return counts
+
+
+def calculate_quarantine_analysis(
+    storeDirectory: Union[str, StoreSnapshot],
+    analyzer: Optional[QuarantineAnalyzer] = None,
+    now: Optional[float] = None,
+) -> QuarantineAnalysis:
+    """
+    Analyze the requests placed into quarantine by failure class and age.
+
+    The quarantine buffers are streamed line by line and aggregated in structures of a
+    fixed size, so memory use doesn't depend on the size of the quarantine. The buffers are
+    only read again when a quarantine buffer changed, otherwise just the ages are updated.
+
+    :param storeDirectory: The data directory store and forward requests are stored in, or
+      a snapshot of it.
+    :param analyzer: The analyzer with the aggregation settings and the failure classes seen
+      by earlier analyses. Defaults to an analyzer shared by all calls in this process.
+    :param now: The current time in seconds since the epoch, which request ages are
+      relative to. Defaults to ``time.time()``.
+    :return: The analysis.
+    """
+    if analyzer is None:
+        analyzer = _default_quarantine_analyzer
+    return analyzer.analyze(_as_snapshot(storeDirectory).quarantine, now)
+
+
+def create_scan_executor(maxWorkers: int) -> Executor:
+    """
+    Create a pool of worker processes to parse transaction buffers in parallel.
+
+    The worker processes lower their own priority so scans don't starve the test
+    sequencer of CPU time. The caller owns the executor and must shut it down.
+
+    Worker processes import this module by name to run a scan. When it was loaded from its
+    file rather than from a package, as the beacon does, the directory of the file is
+    added to the search path of each worker as it starts, leaving the search path of the
+    calling process alone. Python 3.6 can't initialize workers, so there workers started
+    by spawn, as on Windows, need the module to be importable from a package.
+
+    :param maxWorkers: The maximum number of worker processes.
+    :return: The executor to pass to :func:`calculate_pending_requests`.
+    """
+    # Imported here because multiprocessing is only needed when scans run in parallel.
+    from concurrent.futures import ProcessPoolExecutor
+
+    if "." in __name__ or sys.version_info < (3, 7):
+        return ProcessPoolExecutor(max_workers=maxWorkers)
+    import site
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return ProcessPoolExecutor(
+        max_workers=maxWorkers, initializer=site.addsitedir, initargs=(directory,)
+    )
+
+
+def _as_snapshot(storeDirectory: Union[str, StoreSnapshot]) -> StoreSnapshot:
+    if isinstance(storeDirectory, StoreSnapshot):
+        return storeDirectory
+    return StoreSnapshot.take(storeDirectory)
+
+
+def _restat(info: FileInfo) -> Optional[FileInfo]:
+    try:
+        return FileInfo.from_stat(info.path, os.stat(info.path))
+    except OSError:
+        return None
+
+
+def _has_extension(entry: os.DirEntry, extension: str) -> bool:
+    # Match the way glob("*<extension>") would: hidden files are skipped and names are
+    # compared case insensitively on Windows.
+    return (
+        not entry.name.startswith(".")
+        and os.path.normcase(entry.name).endswith(extension)
+        and entry.is_file()
+    )
+
+
+def _read_last_processed_timestamp(cacheFilePath: str) -> int:
+    with open(cacheFilePath, "r", encoding=_TRANSACTION_ENCODING) as cacheFile:
         cacheFileJson = json.load(cacheFile)
-        return dateutil.parser.isoparse(cacheFileJson["timestamp"])
+        return _parse_timestamp_key(cacheFileJson["timestamp"])
+
+
+def _can_resume(state: _BufferScanState, transactionBuffer: FileInfo) -> bool:
+    if state.inode and transactionBuffer.inode and state.inode != transactionBuffer.inode:
+        # The buffer was replaced by another file with the same name. Directory listings
+        # on Windows don't include the file ID, so this relies on the checks below there.
+        return False
+    if transactionBuffer.size < state.offset:
+        # The buffer was truncated.
+        return False
+    if transactionBuffer.size == state.size:
+        # Same size but a new modification time, the buffer was rewritten in place.
+        return False
+    return True
+
+
+def _scan_transactions(
+    transactionBufferPath: str,
+    offset: int,
+    guard: bytes,
+    groupBy: Tuple[str, ...] = (),
+    maxBytes: int = 0,
+    maxSeconds: float = 0,
+) -> Optional[_ScanResult]:
+    """
+    Parse the lines appended to a buffer since the last scan.
+
+    :param offset: The offset the last scan stopped at.
+    :param guard: The bytes before ``offset`` at the time of the last scan.
+    :param groupBy: The properties of the request data to append to the request type in
+      the keys of the returned timestamps.
+    :param maxBytes: Stop after the line that reaches this many bytes, or 0 for no limit.
+    :param maxSeconds: Stop after the line that takes this many seconds, or 0 for no limit.
+    :return: The parsed requests, or ``None`` if the bytes before ``offset`` changed since
+      the last scan, meaning the buffer must be rescanned from the start.
+    """
+    deadline = time.monotonic() + maxSeconds if maxSeconds else None
+    complete = True
+    lines = 0
+    timestamps: Dict[str, array] = {}
+    with open(transactionBufferPath, "rb") as transactionBuffer:
+        transactionBuffer.seek(offset - len(guard))
+        if transactionBuffer.read(len(guard)) != guard:
+            return None
+
+        scannedOffset = offset
+        for line, end in _read_lines(transactionBuffer, offset):
+            transaction = _parse_transaction(line)
+            if transaction is None and not line.endswith(b"\n"):
+                # A partially written last line; it is parsed again on the next scan.
+                break
+            if transaction is not None:
+                try:
+                    timestampKey = _parse_timestamp_key(transaction[1])
+                except ValueError:
+                    # A request with an invalid timestamp is never forwarded, so it is not counted.
+                    timestampKey = None
+                if timestampKey is not None:
+                    key = transaction[0]
+                    if groupBy:
+                        key = _GROUP_SEPARATOR.join([key, *_request_group(line, groupBy)])
+                    checkpoints = timestamps.get(key)
+                    if checkpoints is None:
+                        checkpoints = timestamps[key] = array("q")
+                    checkpoints.append(timestampKey)
+            scannedOffset = end
+            lines += 1
+            if (maxBytes and scannedOffset - offset >= maxBytes) or (
+                deadline is not None
+                and lines % _BUDGET_CHECK_LINES == 0
+                and time.monotonic() >= deadline
+            ):
+                complete = False
+                break
+
+        if scannedOffset != offset:
+            transactionBuffer.seek(max(0, scannedOffset - _RESUME_GUARD_SIZE))
+            guard = transactionBuffer.read(min(scannedOffset, _RESUME_GUARD_SIZE))
+    return _ScanResult(scannedOffset, guard, timestamps, complete)
 
 
-def _count_transactions_after(transactionBufferPath: str, lastProcessedTimestamp: datetime) -> Dict[str, int]:
-    transactions = _load_transactions(transactionBufferPath)
-    newTransactions = filter(lambda t: lastProcessedTimestamp <= dateutil.parser.isoparse(t["timestamp"]), transactions)
-    transactionCounts: Dict[str, int] = {}
-    for t in newTransactions:
-        transactionCounts[t["type"]] = transactionCounts.get(t["type"], 0) + 1
-    return transactionCounts
+def _search_first_timestamp_key(transactionBufferPath: str, timestampKey: int) -> Optional[int]:
+    """
+    Find the first request at or after a timestamp in a buffer sorted by timestamp.
+
+    :return: The timestamp key of the request, or ``None`` if all requests are older.
+    """
+    with open(transactionBufferPath, "rb") as transactionBuffer:
+        found = _search_first_timestamp(
+            transactionBuffer, timestampKey, 0, os.fstat(transactionBuffer.fileno()).st_size
+        )
+    return found[0] if found is not None else None
+
+
+def _search_first_timestamp(
+    transactionBuffer: BinaryIO, timestampKey: int, low: int, high: int
+) -> Optional[Tuple[int, int]]:
+    """
+    Find the first request at or after a timestamp between two offsets of a sorted buffer.
+
+    :param low: An offset at the start of a line.
+    :return: A tuple of the timestamp key of the request and the offset its line starts
+      at, or ``None`` if all requests are older.
+    """
+    first = None
+    while low < high:
+        middle = (low + high) // 2
+        found = _read_timestamp_key_at_or_after(transactionBuffer, middle, high)
+        if found is None:
+            high = middle
+        elif found[0] >= timestampKey:
+            first = found[:2]
+            high = middle
+        else:
+            low = found[2]
+    return first
+
+
+def _read_timestamp_key_at_or_after(
+    transactionBuffer: BinaryIO, offset: int, end: int
+) -> Optional[Tuple[int, int, int]]:
+    """
+    Parse the first complete request that starts at or after an offset and before an end.
+
+    :return: A tuple of the timestamp key of the request and the offsets its line starts
+      at and ends after, or ``None`` if there is no such request.
+    """
+    if offset > 0:
+        # Skip the rest of the line the offset is in, unless it is the start of a line.
+        transactionBuffer.seek(offset - 1)
+        transactionBuffer.readline()
+    else:
+        transactionBuffer.seek(0)
+    while transactionBuffer.tell() < end:
+        start = transactionBuffer.tell()
+        line = transactionBuffer.readline()
+        if not line.endswith(b"\n"):
+            return None
+        transaction = _parse_transaction(line)
+        if transaction is not None:
+            try:
+                return (_parse_timestamp_key(transaction[1]), start, transactionBuffer.tell())
+            except ValueError:
+                pass
+    return None
+
+
+def _count_results_and_steps(state: _BufferScanState, timestampKey: int) -> Tuple[int, int]:
+    results, steps = (0, 0)
+    for key, count in state.count_after(timestampKey).items():
+        transactionType = key.partition(_GROUP_SEPARATOR)[0]
+        if transactionType in _result_transactions:
+            results += count
+        elif transactionType in _step_transactions:
+            steps += count
+    return (results, steps)
+
+
+def _count_parsed_results_and_steps(scan: _ScanResult) -> int:
+    return sum(
+        len(timestampKeys)
+        for (key, timestampKeys) in scan.timestamps.items()
+        if key.partition(_GROUP_SEPARATOR)[0] in _result_transactions + _step_transactions
+    )
+
+
+def _sample_pending_transactions(
+    transactionBufferPath: str,
+    start: int,
+    timestampKey: int,
+    estimator: "PendingEstimator",
+) -> Tuple[float, float, float, float]:
+    """
+    Estimate the pending result and step requests after an offset from samples of the buffer.
+
+    The pending bytes are split into equal strata and a window of ``sampleBytes`` is read
+    at a random offset in each. The requests starting in every window are counted, which
+    unlike counting the lines contained in it doesn't favor short requests, and the
+    requests of each category per byte are estimated as the ratio of the totals over all
+    windows, with the windows as the sampling units of the variance.
+
+    :param start: An offset at the start of a line, where the unindexed part of the buffer begins.
+    :param timestampKey: The timestamp key of the last processed request.
+    :return: The estimated pending results and steps, and the half widths of their
+      approximate 95% confidence intervals.
+    """
+    with open(transactionBufferPath, "rb") as transactionBuffer:
+        size = os.fstat(transactionBuffer.fileno()).st_size
+        found = _search_first_timestamp(transactionBuffer, timestampKey, start, size)
+        if found is None:
+            return (0.0, 0.0, 0.0, 0.0)
+        pendingStart = found[1]
+        pendingBytes = size - pendingStart
+        samples = max(2, estimator.samples)
+        stratum = pendingBytes / samples
+        windows: List[Tuple[int, int, int]] = []
+        for sample in range(samples):
+            offset = pendingStart + int(stratum * sample + estimator._random.random() * stratum)
+            windowBytes = min(estimator.sampleBytes, size - offset)
+            if offset == pendingStart:
+                window = b"\n"
+                transactionBuffer.seek(offset)
+            else:
+                # Include the byte before the window to tell if a line starts at its first byte.
+                transactionBuffer.seek(offset - 1)
+                window = transactionBuffer.read(1)
+            window += transactionBuffer.read(windowBytes)
+            firstStart = window.find(b"\n")
+            results, steps = (0, 0)
+            if 0 <= firstStart < windowBytes:
+                # Complete the last line that starts in the window.
+                lines = (window[firstStart + 1 :] + transactionBuffer.readline()).split(b"\n")
+                for line in lines[:-1]:
+                    transaction = _parse_transaction(line)
+                    if transaction is None:
+                        continue
+                    if transaction[0] in _result_transactions:
+                        results += 1
+                    elif transaction[0] in _step_transactions:
+                        steps += 1
+            windows.append((windowBytes, results, steps))
 
+    sampledBytes = sum(w[0] for w in windows)
+    if sampledBytes == 0:
+        return (0.0, 0.0, 0.0, 0.0)
+    # Windows only sample part of the pending bytes, so the variance is corrected for it.
+    sampledFraction = min(1.0, sampledBytes / pendingBytes)
+    meanBytes = sampledBytes / samples
+    estimates = []
+    for category in (1, 2):
+        ratio = sum(w[category] for w in windows) / sampledBytes
+        residuals = sum((w[category] - ratio * w[0]) ** 2 for w in windows) / (samples - 1)
+        variance = (1 - sampledFraction) * residuals / (samples * meanBytes**2)
+        estimates.append((pendingBytes * ratio, 1.96 * pendingBytes * math.sqrt(variance)))
+    return (estimates[0][0], estimates[1][0], estimates[0][1], estimates[1][1])
 
-def _load_transactions(transactionBufferPath: str):
-    lines = []
-    with open(transactionBufferPath, "r", encoding="ansi") as transactionBuffer:
-        lines = transactionBuffer.readlines()
 
-    return map(lambda line: json.loads(line), lines)
+def _try_scan_transactions(
+    transactionBufferPath: str,
+    offset: int,
+    guard: bytes,
+    groupBy: Tuple[str, ...],
+    maxBytes: int = 0,
+    maxSeconds: float = 0,
+):
+    # Like _scan_transactions, but returns False if the buffer no longer exists.
+    try:
+        return _scan_transactions(
+            transactionBufferPath, offset, guard, groupBy, maxBytes, maxSeconds
+        )
+    except FileNotFoundError:
+        return False
 
 
-def _sum_size_of_files_kib(transactionBufferPaths) -> int:
-    if len(transactionBufferPaths) == 0:
-        return 0
+def _future_scan_result(future):
+    try:
+        return future.result()
+    except FileNotFoundError:
+        return False
 
-    return int(math.ceil(sum(os.path.getsize(f) for f in transactionBufferPaths if os.path.isfile(f)) / 1024))
+
+_process_priority_lowered = False
+
+
+def _scan_transactions_in_worker(
+    transactionBufferPath: str,
+    offset: int,
+    guard: bytes,
+    groupBy: Tuple[str, ...],
+    maxBytes: int = 0,
+    maxSeconds: float = 0,
+) -> Optional[_ScanResult]:
+    global _process_priority_lowered
+    if not _process_priority_lowered:
+        _lower_process_priority()
+        _process_priority_lowered = True
+    return _scan_transactions(transactionBufferPath, offset, guard, groupBy, maxBytes, maxSeconds)
+
+
+def lower_thread_priority():
+    """
+    Lower the CPU and, where supported, I/O priority of the calling thread.
+
+    Meant for a thread that only scans, since the priority is not restored. Lowering
+    the priority is best effort; on platforms without per-thread priorities this does
+    nothing.
+    """
+    try:
+        if sys.platform == "win32":
+            import ctypes
+
+            # Lowers the I/O and memory priority of the thread as well as its CPU priority.
+            THREAD_MODE_BACKGROUND_BEGIN = 0x00010000
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetThreadPriority(kernel32.GetCurrentThread(), THREAD_MODE_BACKGROUND_BEGIN)
+        elif hasattr(threading, "get_native_id") and sys.platform.startswith("linux"):
+            # Linux schedules threads individually, so their nice value is their own.
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except Exception:
+        pass
+
+
+def _lower_process_priority():
+    try:
+        if sys.platform == "win32":
+            import ctypes
+
+            BELOW_NORMAL_PRIORITY_CLASS = 0x00004000
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), BELOW_NORMAL_PRIORITY_CLASS)
+        else:
+            os.nice(10)
+    except Exception:
+        # Lowering the priority is best effort; scanning at normal priority still works.
+        pass
+    _lower_process_io_priority()
+
+
+def _lower_process_io_priority():
+    try:
+        if sys.platform == "win32":
+            import ctypes
+
+            # Also lowers the CPU priority of the threads, to at most below normal.
+            PROCESS_MODE_BACKGROUND_BEGIN = 0x00100000
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), PROCESS_MODE_BACKGROUND_BEGIN)
+        else:
+            import psutil
+
+            psutil.Process().ionice(psutil.IOPRIO_CLASS_IDLE)
+    except Exception:
+        # Not every platform has I/O priorities, and psutil is optional for the inspector.
+        pass
+
+
+def _isoparse_timestamp_key(timestamp: str) -> int:
+    # dateutil is only imported for timestamps the service doesn't write, since
+    # importing it costs more than parsing the timestamps in the usual format.
+    import dateutil.parser
+
+    return _timestamp_key(dateutil.parser.isoparse(timestamp))
+
+
+def _parse_timestamp_key(timestamp: str) -> int:
+    """
+    Parse an ISO 8601 timestamp to an integer number of microseconds since the epoch.
+
+    Timestamps in the format the store and forward service writes are converted with
+    integer arithmetic on their fixed-width fields; anything else falls back to
+    ``dateutil.parser.isoparse``. Fractional seconds beyond microseconds are truncated,
+    as ``isoparse`` does.
+    """
+    if _SERVICE_TIMESTAMP.match(timestamp):
+        # Requests are written in bursts, so the date and hour are usually already known.
+        hourKey = _SERVICE_TIMESTAMP_HOUR_KEYS.get(timestamp[:13])
+        if hourKey is None:
+            hour = int(timestamp[11:13])
+            if hour > 23:
+                return _isoparse_timestamp_key(timestamp)
+            days = (
+                date(int(timestamp[:4]), int(timestamp[5:7]), int(timestamp[8:10])).toordinal()
+                - _EPOCH_ORDINAL
+            )
+            hourKey = (days * 24 + hour) * 3600
+            if len(_SERVICE_TIMESTAMP_HOUR_KEYS) >= _SERVICE_TIMESTAMP_HOUR_KEYS_LIMIT:
+                _SERVICE_TIMESTAMP_HOUR_KEYS.clear()
+            _SERVICE_TIMESTAMP_HOUR_KEYS[timestamp[:13]] = hourKey
+        minute = int(timestamp[14:16])
+        second = int(timestamp[17:19])
+        if minute > 59 or second > 59:
+            return _isoparse_timestamp_key(timestamp)
+        return (hourKey + minute * 60 + second) * 1000000 + int(timestamp[20:26])
+
+    match = _CANONICAL_TIMESTAMP.match(timestamp)
+    if match is None:
+        return _isoparse_timestamp_key(timestamp)
+
+    year, month, day, hour, minute, second, fraction, sign, offsetHours, offsetMinutes = (
+        match.groups()
+    )
+    hour = int(hour)
+    minute = int(minute)
+    second = int(second)
+    if hour > 23 or minute > 59 or second > 59:
+        # Let isoparse handle "24:00:00" and reject invalid times.
+        return _isoparse_timestamp_key(timestamp)
+
+    days = date(int(year), int(month), int(day)).toordinal() - _EPOCH_ORDINAL
+    seconds = ((days * 24 + hour) * 60 + minute) * 60 + second
+    if sign is not None:
+        offset = int(offsetHours) * 3600 + int(offsetMinutes) * 60
+        seconds = seconds - offset if sign == "+" else seconds + offset
+    microseconds = int(fraction[:6].ljust(6, "0")) if fraction else 0
+    return seconds * 1000000 + microseconds
+
+
+def _timestamp_key(timestamp: datetime) -> int:
+    """
+    Convert a timestamp to an integer number of microseconds since the epoch.
+
+    Timestamps without a time zone are treated as UTC, which orders them by wall clock
+    time exactly as comparing the naive ``datetime`` objects would.
+    """
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (timestamp - _EPOCH) // _ONE_MICROSECOND
+
+
+def _read_lines(transactionBuffer: BinaryIO, offset: int) -> Iterator[Tuple[bytes, int]]:
+    """
+    Read a buffer line by line in fixed size chunks, starting at its current position.
+
+    :return: An iterator of each line, including its line terminator, and the offset just
+      past it. The last line is returned without a terminator if it was not finished.
+    """
+    remainder = b""
+    while True:
+        chunk = transactionBuffer.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+        start = 0
+        end = chunk.find(b"\n")
+        if remainder and end >= 0:
+            line = remainder + chunk[: end + 1]
+            remainder = b""
+            offset += len(line)
+            yield (line, offset)
+            start = end + 1
+            end = chunk.find(b"\n", start)
+        while end >= 0:
+            offset += end + 1 - start
+            yield (chunk[start : end + 1], offset)
+            start = end + 1
+            end = chunk.find(b"\n", start)
+        remainder += chunk[start:]
+    if remainder:
+        yield (remainder, offset + len(remainder))
+
+
+def _parse_transaction(line: bytes) -> Optional[Tuple[str, str]]:
+    """
+    Extract the type and timestamp of a request.
+
+    :return: A tuple of the type and timestamp of the request, or ``None`` for a blank,
+      partial or corrupt line.
+    """
+    match = _TRANSACTION_SUFFIX.search(line, max(0, len(line) - _TRANSACTION_SUFFIX_WINDOW))
+    if match:
+        return (
+            match.group(2).decode("ascii", "replace"),
+            match.group(1).decode("ascii", "replace"),
+        )
+    if not line.strip():
+        return None
+
+    try:
+        transaction = json.loads(line.decode(_TRANSACTION_ENCODING))
+        return (transaction["type"], transaction["timestamp"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _request_group(line: bytes, groupBy: Tuple[str, ...]) -> List[str]:
+    """
+    Read the properties of the request data a request is grouped by.
+
+    :return: The value of each property as a string, or an empty string for a property the
+      request doesn't have.
+    """
+    try:
+        data = json.loads(line.decode(_TRANSACTION_ENCODING)).get("data")
+    except (ValueError, AttributeError):
+        data = None
+    if not isinstance(data, dict):
+        return [""] * len(groupBy)
+    return [
+        "" if data.get(p) is None else str(data[p]).replace(_GROUP_SEPARATOR, " ") for p in groupBy
+    ]
+
+
+def _quarantine_reason(line: bytes) -> str:
+    """
+    Read the reason a request was quarantined, if it records one.
+
+    Only requests mentioning one of the reason properties are decoded.
+    """
+    if not any(marker in line for marker in _QUARANTINE_REASON_MARKERS):
+        return ""
+    try:
+        request = json.loads(line.decode(_TRANSACTION_ENCODING))
+    except ValueError:
+        return ""
+    if not isinstance(request, dict):
+        return ""
+    properties = request.get("properties")
+    for container in (request, properties if isinstance(properties, dict) else {}):
+        for name in _QUARANTINE_REASON_PROPERTIES:
+            reason = container.get(name)
+            if isinstance(reason, dict):
+                reason = reason.get("message", reason.get("name"))
+            if reason:
+                return str(reason)[:_QUARANTINE_REASON_LENGTH]
+    return ""
+
+
+def _count_records(transactionBufferPath: str) -> int:
+    return _count_pattern(transactionBufferPath, b"\n", countUnterminatedLine=True)
+
+
+def _count_pattern(
+    transactionBufferPath: str, pattern: bytes, countUnterminatedLine: bool = False
+) -> int:
+    """
+    Count the occurrences of a byte pattern in a file.
+
+    :param countUnterminatedLine: Count one more occurrence if the file does not end
+      with a line terminator, to count the records of a file from its newlines.
+    """
+    (count,), unterminated = _count_patterns(transactionBufferPath, [pattern])
+    return count + 1 if countUnterminatedLine and unterminated else count
+
+
+def _count_patterns(
+    transactionBufferPath: str, patterns: Sequence[bytes]
+) -> Tuple[List[int], bool]:
+    """
+    Count the occurrences of several byte patterns in a file in a single pass.
+
+    The file is read in fixed size chunks cut after their last line terminator, so a
+    pattern that doesn't span lines is never split between chunks. The file is only open
+    while it is read, so the store and forward service can delete or truncate it.
+
+    :return: A tuple of the number of occurrences of each pattern, and whether the file
+      ends with a line without a terminator.
+    """
+    counts = [0] * len(patterns)
+    remainder = b""
+    with open(transactionBufferPath, "rb") as transactionBuffer:
+        while True:
+            chunk = transactionBuffer.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            end = chunk.rfind(b"\n") + 1
+            if not end:
+                remainder += chunk
+                continue
+            lines = remainder + chunk[:end] if remainder else chunk[:end]
+            remainder = chunk[end:]
+            for i, pattern in enumerate(patterns):
+                counts[i] += lines.count(pattern)
+    for i, pattern in enumerate(patterns):
+        counts[i] += remainder.count(pattern)
+    return (counts, bool(remainder))
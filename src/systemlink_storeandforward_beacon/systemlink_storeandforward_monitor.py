@@ -2,25 +2,46 @@
 
 import asyncio
 import atexit
+import collections
+import contextlib
+import cProfile
+import importlib
+import importlib.util
+import json
 import logging
+import math
+import numbers
 import os
+import random
 import sys
-from typing import Any, Dict, List, Tuple, Union
-from urllib.parse import quote
-import winreg
-import psutil
-from systemlink.clientconfig import get_configuration_by_id, HTTP_MASTER_CONFIGURATION_ID
-from systemlink.clients.nitag import (
-    ApiClient,
-    ApiException,
-    Tag,
-    TagListAndMergeFlag,
-    TagsApi,
-    TagUpdate,
-    TagValue,
-    TimestampedTagValue,
+import tempfile
+import threading
+import time
+from concurrent.futures import Executor
+from datetime import datetime, timezone
+from types import ModuleType
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+    Union,
 )
-from systemlink.clients.nitag.rest import RESTResponse
+from urllib.parse import quote
+
+if TYPE_CHECKING:
+    from systemlink import clientconfig
+    from systemlink.clients import nitag
+else:
+    # Salt loads every beacon when the minion starts, so the SystemLink client and the
+    # platform modules are only imported by _import_sdk() when the beacon first runs.
+    clientconfig = None
+    nitag = None
 
 # Import local libs
 # This file may be loaded out of __pycache__, so the
@@ -28,12 +49,28 @@ from systemlink.clients.nitag.rest import RESTResponse
 IMPORT_PATH = os.path.dirname(__file__)
 if IMPORT_PATH.endswith("__pycache__"):
     IMPORT_PATH = os.path.dirname(IMPORT_PATH)
-sys.path.append(IMPORT_PATH)
-try:
-    import _systemlink_storeandforward_inspector
-finally:
-    # Remove the extra search path that we added to sys.path
-    sys.path.remove(IMPORT_PATH)
+
+
+def _import_inspector() -> ModuleType:
+    # Loads the inspector from its file rather than adding the directory to sys.path.
+    name = "_systemlink_storeandforward_inspector"
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(IMPORT_PATH, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    return module
+
+
+if TYPE_CHECKING:
+    import _systemlink_storeandforward_inspector  # noqa: I100, I202
+else:
+    _systemlink_storeandforward_inspector = _import_inspector()
 
 log = logging.getLogger(__name__)
 
@@ -44,12 +81,540 @@ NI_INSTALLERS_REG_KEY_APP_DATA = "NIPUBAPPDATADIR"
 EVENT_LOOP: asyncio.AbstractEventLoop = None
 
 # The client for the SystemLink Tags API
-API_CLIENT: ApiClient = None
+API_CLIENT: "nitag.ApiClient" = None
+# The tags of the first monitored store, including the tags of the beacon itself.
 TAG_INFO: Dict[str, Dict[str, Any]] = {}
 
+# The beacon configuration options and their default values.
+DEFAULT_CONFIG: Dict[str, Any] = {
+    # Values of slow tags computed more than this many seconds ago are not published.
+    "slow_scan_max_age": 600,
+    # How many seconds the beacon waits for a running slow scan to complete before
+    # publishing the values of the previous scan.
+    "slow_scan_wait": 0,
+    # The number of worker processes that parse request buffers in parallel, or 0 to
+    # parse them on the slow scan thread.
+    "parallel_scan_workers": 0,
+    # Whether to watch the store directories for changes, when supported, instead of
+    # listing them on every beacon call.
+    "watch_store_directories": True,
+    # The longest time in seconds a listing of watched store directories is reused
+    # without listing them again, in case a change notification was missed.
+    "store_snapshot_max_age": 300,
+    # Tag values that didn't change are only written again after this many seconds.
+    # 0 writes every value on every beacon call.
+    "tag_heartbeat_interval": 600,
+    # How often in seconds the pending and quarantined request counts are recomputed.
+    # 0 recomputes them on every beacon call.
+    "slow_interval": 0,
+    # When recomputing the request counts takes longer than this many seconds, the
+    # interval between scans is doubled, up to slow_interval_max seconds. It returns
+    # to slow_interval as scans get faster again.
+    "slow_scan_budget": 30,
+    "slow_interval_max": 3600,
+    # Beacon calls and slow scans taking longer than this many seconds write a cProfile
+    # dump to profile_directory, overwriting the previous dump. 0 disables profiling.
+    "profile_threshold": 0,
+    # Defaults to the temporary directory.
+    "profile_directory": "",
+    # Where the scan state of the request buffers is saved, so that a restarted minion
+    # only parses requests added since it was saved. Defaults to a file in the minion's
+    # cache directory.
+    "index_file": "",
+    # The scan state is saved at most this often, in seconds.
+    "index_save_interval": 300,
+    # The number of recent scans the enqueue and forward rates are averaged over.
+    "rate_samples": 10,
+    # How many times a failed tag write is retried during a beacon call.
+    "publish_retries": 2,
+    # After the retries fail, the tag values stay queued and the next write is delayed
+    # by a backoff that doubles with every failure up to this many seconds.
+    "publish_backoff_max": 300,
+    # The maximum number of tags written per request.
+    "publish_batch_size": 100,
+    # When set, tag values are queued with the time they were sampled on every beacon
+    # call and only written every this many seconds, with all queued values of a tag in
+    # one request. 0 writes values with the server time on every beacon call.
+    "history_upload_interval": 0,
+    # The most values of a tag queued between uploads; older values are dropped.
+    "history_max_samples": 120,
+    # Comma separated properties of the request data, such as "workspace,programName",
+    # to break the pending requests down by. Reading them decodes every request.
+    "pending_group_by": "",
+    # Whether to publish the pending requests by type, by category, and by group with
+    # pending_group_by, as JSON tags.
+    "pending_breakdown_tags": False,
+    # The request types in each category pending requests are counted by, such as
+    # {"results": ["ResultCreateRequest", "ResultUpdateRequest"]}. Defaults to the
+    # results and steps categories.
+    "pending_categories": {},
+    # Whether to publish the most frequent failure classes, the age histogram and the
+    # number of new failure classes of the quarantined requests.
+    "quarantine_analysis": False,
+    # The number of failure classes of the quarantined requests to count.
+    "quarantine_top_k": 10,
+    # Whether to publish the number of pending files by size as a JSON tag.
+    "pending_files_histogram_tag": False,
+    # Buffers with more unscanned MiB than this are sampled instead of counted, except
+    # every pending_reconcile_interval seconds. 0 always counts every request.
+    "pending_estimate_threshold": 0,
+    # The number of 64 KiB windows sampled from each buffer.
+    "pending_estimate_samples": 32,
+    # How often in seconds the requests of sampled buffers are counted exactly.
+    "pending_reconcile_interval": 3600,
+    # The most MiB of requests, and the most seconds, a slow scan spends reading the
+    # buffers. A scan that runs out resumes where it stopped on the next slow scan, and
+    # the previous counts are published until then. 0 doesn't limit the scans.
+    "scan_max_mib": 0,
+    "scan_max_seconds": 0,
+    # Whether the slow scan thread runs at a lower CPU and I/O priority. Scans in
+    # worker processes always do.
+    "scan_low_priority": False,
+    # The store roots to monitor, each a dictionary with the "path" of a directory with
+    # the testmon and file stores, like Skyline/Data/Store, and the "prefix" the paths of
+    # its tags start with instead of the minion ID. A store without a path is the one of
+    # the installed SystemLink client. By default only that store is monitored.
+    "stores": [],
+}
+
+# The National Instruments Common Application Data Directory, read from the registry
+# once per initialization of the beacon.
+NI_COMMON_APPDATA_DIR: str = None
+
 ATEXIT_REGISTERED = False
 BEACON_INITIALIZED = False
 
+
+class _SlowScanWorker:
+    """
+    Runs the slow inspector scans on a background thread.
+
+    Only one scan runs at a time. The beacon starts a scan when none is running and
+    publishes the values of the most recently completed scan, so a slow scan never
+    blocks the salt minion's beacon loop.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._values: Optional[List[Dict[str, Any]]] = None
+        self._completed: Optional[float] = None
+        self._duration: Optional[float] = None
+
+    def start(
+        self,
+        stores: List["_MonitoredStore"],
+        snapshots: List[_systemlink_storeandforward_inspector.StoreSnapshot],
+        options: Dict[str, Any],
+    ) -> bool:
+        """
+        Start a scan unless one is already running.
+
+        :param stores: The stores to scan.
+        :param snapshots: The snapshot of the directories of each store.
+        :param options: The beacon configuration options.
+        :return: ``True`` if a scan was started.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            # A daemon thread so that a long scan doesn't delay the minion exiting.
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(stores, snapshots, options),
+                name="systemlink_storeandforward_scan",
+                daemon=True,
+            )
+            self._thread.start()
+            return True
+
+    def wait(self, timeout: float):
+        """
+        Wait for the running scan, if any, to complete.
+
+        :param timeout: The maximum number of seconds to wait.
+        """
+        thread = self._thread
+        if thread is not None and timeout > 0:
+            thread.join(timeout)
+
+    def latest(self) -> Tuple[Optional[List[Dict[str, Any]]], Optional[float]]:
+        """
+        Get the values of the most recently completed scan.
+
+        :return: A tuple with the tag values of each store by tag key and the
+            ``time.monotonic()`` time the scan completed, or ``(None, None)`` if no scan
+            has completed.
+        """
+        with self._lock:
+            return (self._values, self._completed)
+
+    @property
+    def last_duration(self) -> Optional[float]:
+        """How many seconds the most recently completed scan took, if any."""
+        return self._duration
+
+    def _run(
+        self,
+        stores: List["_MonitoredStore"],
+        snapshots: List[_systemlink_storeandforward_inspector.StoreSnapshot],
+        options: Dict[str, Any],
+    ):
+        started = time.monotonic()
+        if options["scan_low_priority"]:
+            _systemlink_storeandforward_inspector.lower_thread_priority()
+        try:
+            with _profiled(options, "scan"):
+                values = _scan_slow_tag_values(stores, snapshots, options)
+        except Exception as exc:
+            log.error("Failed to scan the store and forward buffers: %s", exc, exc_info=True)
+            return
+        with self._lock:
+            self._values = values
+            self._completed = time.monotonic()
+            self._duration = self._completed - started
+
+
+class _Schedule:
+    """
+    Decides when a group of tags is next recomputed.
+
+    The interval between runs backs off exponentially while runs take longer than their
+    budget, and recovers the same way once they fit in it again.
+    """
+
+    def __init__(self):
+        self.next_run = 0.0
+        self.interval: Optional[float] = None
+
+    def due(self, now: float) -> bool:
+        """
+        Check whether the group should be recomputed.
+
+        :param now: The current ``time.monotonic()`` time.
+        :return: ``True`` if the next run is due.
+        """
+        return now >= self.next_run
+
+    def started(
+        self,
+        now: float,
+        lastDuration: Optional[float],
+        interval: float,
+        budget: float,
+        maxInterval: float,
+    ):
+        """
+        Schedule the next run after a run started.
+
+        :param now: The ``time.monotonic()`` time the run started.
+        :param lastDuration: How many seconds the previous run took, if known.
+        :param interval: The configured interval between runs in seconds.
+        :param budget: The number of seconds a run may take before backing off.
+        :param maxInterval: The longest interval to back off to in seconds.
+        """
+        current = interval if self.interval is None else self.interval
+        if lastDuration is not None and lastDuration > budget:
+            current = min(max(current, lastDuration, 1) * 2, max(maxInterval, interval))
+        else:
+            current = max(current / 2, interval)
+        if current != self.interval and self.interval is not None:
+            log.debug(f"Recomputing store and forward request counts every {current:.0f} seconds")
+        self.interval = current
+        self.next_run = now + current
+
+
+SLOW_SCHEDULE = _Schedule()
+
+
+SLOW_SCAN_WORKER: _SlowScanWorker = None
+
+# The pool of worker processes parsing request buffers in parallel, if enabled.
+SCAN_EXECUTOR: Executor = None
+SCAN_EXECUTOR_WORKERS = 0
+
+
+class _MonitoredStore:
+    """
+    A store root monitored by the beacon, with its tags and the state kept between scans.
+
+    The tags of the beacon itself, such as its durations and the service status, are
+    only published with the first store.
+    """
+
+    def __init__(self, root: Optional[str], prefix: str):
+        """
+        Create a store without tags.
+
+        :param root: The directory with the testmon and file stores, or ``None`` for the
+            store of the installed SystemLink client.
+        :param prefix: The prefix of the paths of the tags of the store.
+        """
+        self.root = root
+        self.prefix = prefix
+        self.tags: Dict[str, Dict[str, Any]] = {}
+        # Takes the snapshots of the store directories, reusing them while nothing changed.
+        self.watcher: Optional[_systemlink_storeandforward_inspector.StoreWatcher] = None
+        self.drainRateEstimator: Optional["_DrainRateEstimator"] = None
+        # The failure classes of the quarantined requests seen by earlier slow scans.
+        self.quarantineAnalyzer: Optional[
+            _systemlink_storeandforward_inspector.QuarantineAnalyzer
+        ] = None
+
+    @property
+    def store_directory(self) -> str:
+        """The directory the store and forward requests are stored in."""
+        return os.path.join(self.root, "testmon") if self.root else _get_testmon_store_directory()
+
+    @property
+    def file_store_directory(self) -> str:
+        """The directory the store and forward files are stored in."""
+        return os.path.join(self.root, "file") if self.root else _get_files_store_directory()
+
+
+# The monitored stores, in the order they are configured.
+STORES: List[_MonitoredStore] = []
+
+
+class _BufferIndexFile:
+    """Loads the buffer index saved by a previous minion process and saves it periodically."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._saved: Optional[float] = None
+        self._dirty = False
+        self._entries = 0
+
+    def load(self, groupBy: Tuple[str, ...]) -> _systemlink_storeandforward_inspector.BufferIndex:
+        """
+        Load the saved index.
+
+        :param groupBy: The properties of the request data the index groups requests by.
+        :return: The saved index, or an empty index if none was saved with the same grouping.
+        """
+        index = _systemlink_storeandforward_inspector.BufferIndex.load(self.path, groupBy)
+        self._entries = len(index.states) + len(index.quarantineRecords)
+        log.debug(
+            f"Loaded the scan state of {self._entries} store and forward buffers from {self.path}"
+        )
+        return index
+
+    def scanned(
+        self, index: _systemlink_storeandforward_inspector.BufferIndex, saveInterval: float
+    ):
+        """
+        Save the index after a scan if it changed and wasn't saved in the last interval.
+
+        :param index: The index that was used for the scan.
+        :param saveInterval: The minimum number of seconds between saves.
+        """
+        entries = len(index.states) + len(index.quarantineRecords)
+        self._dirty = self._dirty or index.statistics.filesScanned > 0 or entries != self._entries
+        self._entries = entries
+        now = time.monotonic()
+        if not self._dirty or (self._saved is not None and now - self._saved < saveInterval):
+            return
+        self._saved = now
+        try:
+            index.save(self.path)
+        except OSError as ex:
+            log.warning(
+                "Failed to save the scan state of the store and forward buffers to "
+                f"{self.path}: {ex}"
+            )
+            return
+        self._dirty = False
+
+
+class _DrainRateEstimator:
+    """
+    Estimates how fast requests are added to and forwarded from the buffers.
+
+    Keeps the pending count and the running total of requests added at the last few
+    scans in a ring buffer, so each scan updates the rates in constant time. The number
+    of requests forwarded follows from the number added and the change in the pending
+    count.
+    """
+
+    def __init__(self, samples: int):
+        self.samples = samples
+        self._history: Deque[Tuple[float, int, int]] = collections.deque(maxlen=max(2, samples))
+        self._enqueued = 0
+
+    def add(self, now: float, pending: int, enqueued: int) -> Optional[Tuple[float, float, float]]:
+        """
+        Add the result of a scan.
+
+        :param now: The ``time.monotonic()`` time of the scan.
+        :param pending: The number of pending requests.
+        :param enqueued: The number of requests added to the buffers since the previous scan.
+        :return: The enqueue and forward rates in requests per minute and the estimated
+            seconds until no requests are pending, or -1 if the backlog isn't shrinking.
+            ``None`` until there are two scans to compare.
+        """
+        self._enqueued += enqueued
+        self._history.append((now, pending, self._enqueued))
+        oldestTime, oldestPending, oldestEnqueued = self._history[0]
+        elapsed = now - oldestTime
+        if elapsed <= 0:
+            return None
+        enqueueRate = (self._enqueued - oldestEnqueued) / elapsed
+        forwardRate = max(0.0, enqueueRate - (pending - oldestPending) / elapsed)
+        if pending == 0:
+            timeToDrain = 0.0
+        elif forwardRate > enqueueRate:
+            timeToDrain = pending / (forwardRate - enqueueRate)
+        else:
+            timeToDrain = -1.0
+        return (enqueueRate * 60, forwardRate * 60, timeToDrain)
+
+
+class _OutboxEntry:
+    """The queued values of a tag."""
+
+    __slots__ = ("type", "maxValues", "values")
+
+    def __init__(self, type: str, maxValues: int):
+        self.type = type
+        self.maxValues = max(1, maxValues)
+        self.values: List[Tuple[str, Optional[datetime]]] = []
+
+    def append(self, value: str, timestamp: Optional[datetime]):
+        self.values.append((value, timestamp))
+        del self.values[: -self.maxValues]
+
+    @property
+    def timestamped(self) -> bool:
+        return self.values[-1][1] is not None
+
+
+class _TagOutbox:
+    """
+    Queues tag values until they are written.
+
+    Only the latest value of each tag is kept, or the latest values up to a limit for
+    values with a timestamp, so the outbox stays bounded however long the server is
+    unreachable. Values that fail to write stay queued, and the next write is delayed by
+    an exponential backoff with jitter so that many minions don't retry at the same time.
+    """
+
+    # The first delay between retries in seconds.
+    RETRY_DELAY = 0.5
+
+    def __init__(self):
+        self._entries: Dict[str, _OutboxEntry] = {}
+        self._failures = 0
+        self._retryAt = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(
+        self,
+        path: str,
+        type: str,
+        value: str,
+        timestamp: Optional[datetime] = None,
+        maxValues: int = 1,
+    ):
+        """
+        Queue a value of a tag.
+
+        :param path: The path of the tag.
+        :param type: The data type of the tag.
+        :param value: The value to write.
+        :param timestamp: When the value was sampled, or ``None`` to write the value as the
+            current value at the server time, replacing any queued values.
+        :param maxValues: The most values with a timestamp to keep queued for the tag.
+        """
+        entry = self._entries.get(path)
+        if timestamp is None or entry is None or not entry.timestamped:
+            entry = self._entries[path] = _OutboxEntry(type, maxValues)
+        entry.maxValues = max(1, maxValues)
+        entry.append(value, timestamp)
+
+    async def flush(
+        self,
+        send: Callable[[List[Tuple[str, _OutboxEntry]]], Awaitable[None]],
+        batchSize: int,
+        retries: int,
+        maxBackoff: float,
+    ) -> bool:
+        """
+        Write the queued values in batches, unless a previous write failed recently.
+
+        :param send: Writes a batch of tags and their values, raising an exception if the
+            write failed and should be retried.
+        :param batchSize: The maximum number of tags in a batch.
+        :param retries: The number of times to retry a failed batch before giving up
+            until the backoff elapsed.
+        :param maxBackoff: The longest delay in seconds before writing again after a failure.
+        :return: ``True`` if nothing is left queued.
+        """
+        if not self._entries:
+            return True
+        if time.monotonic() < self._retryAt:
+            return False
+        pending = list(self._entries.items())
+        self._entries = {}
+        for start in range(0, len(pending), max(1, batchSize)):
+            batch = pending[start : start + max(1, batchSize)]
+            for attempt in range(retries + 1):
+                try:
+                    await send(batch)
+                    break
+                except Exception as exc:
+                    if attempt < retries:
+                        await asyncio.sleep(_jittered(self.RETRY_DELAY * 2**attempt))
+                        continue
+                    self._requeue(pending[start:])
+                    self._failures += 1
+                    backoff = _jittered(
+                        min(maxBackoff, self.RETRY_DELAY * 2 ** (retries + self._failures))
+                    )
+                    self._retryAt = time.monotonic() + backoff
+                    log.warning(
+                        f"Failed to write {len(self._entries)} tags, "
+                        f"retrying in {backoff:.0f} seconds: {exc}"
+                    )
+                    return False
+        self._failures = 0
+        self._retryAt = 0.0
+        return True
+
+    def _requeue(self, entries: List[Tuple[str, _OutboxEntry]]):
+        # Values queued while the batch was being written are newer. They replace the
+        # failed values, unless both have timestamps and form a history.
+        requeued = dict(entries)
+        for path, entry in self._entries.items():
+            failed = requeued.get(path)
+            if failed is not None and failed.timestamped and entry.values[0][1] is not None:
+                entry.values[:0] = failed.values
+                del entry.values[: -entry.maxValues]
+            requeued[path] = entry
+        self._entries = requeued
+
+
+def _jittered(delay: float) -> float:
+    return delay * random.uniform(0.5, 1.0)
+
+
+# The tag values waiting to be written, and when values sampled with a timestamp are
+# next uploaded.
+TAG_OUTBOX = _TagOutbox()
+NEXT_HISTORY_UPLOAD = 0.0
+
+# The scan state of the request buffers of all stores between slow scans, and the file
+# it is saved to.
+BUFFER_INDEX: _systemlink_storeandforward_inspector.BufferIndex = None
+BUFFER_INDEX_FILE: _BufferIndexFile = None
+
+# Limits the bytes and time of each slow scan, and counts how often they run out.
+SCAN_BUDGET: _systemlink_storeandforward_inspector.ScanBudget = None
+
+# The sampling settings and the time of the next exact count when estimating pending requests.
+PENDING_ESTIMATOR: _systemlink_storeandforward_inspector.PendingEstimator = None
+
 __virtualname__: str = "systemlink_storeandforward_monitor"
 
 
@@ -72,9 +637,59 @@ def validate(config: List[Dict[str, Any]]) -> Tuple[bool, str]:
         configuration is valid and ``False`` otherwise. The second item
         is a message.
     """
+    options = _get_config(config)
+    for name, value in options.items():
+        if name not in DEFAULT_CONFIG:
+            continue
+        if isinstance(DEFAULT_CONFIG[name], list):
+            message = _validate_stores(value)
+            if message:
+                return False, f"Configuration for {__virtualname__} beacon: {name} {message}"
+        elif isinstance(DEFAULT_CONFIG[name], dict):
+            message = _validate_categories(value)
+            if message:
+                return False, f"Configuration for {__virtualname__} beacon: {name} {message}"
+        elif isinstance(DEFAULT_CONFIG[name], str):
+            if not isinstance(value, str):
+                return False, f"Configuration for {__virtualname__} beacon: {name} must be a string"
+        elif not isinstance(value, numbers.Real) or value < 0:
+            return (
+                False,
+                f"Configuration for {__virtualname__} beacon: {name} must be a non-negative number",
+            )
     return True, "Valid beacon configuration"
 
 
+def _validate_stores(stores: Any) -> Optional[str]:
+    # Returns what is wrong with the stores option, if anything.
+    if not isinstance(stores, list):
+        return "must be a list"
+    prefixes = set()
+    for store in stores:
+        if not isinstance(store, dict) or not set(store) <= {"path", "prefix"}:
+            return "must be a list of dictionaries with a path and a prefix"
+        if not all(isinstance(value, str) for value in store.values()):
+            return "must have a path and a prefix that are strings"
+        # Stores without a prefix use the minion ID.
+        prefix = store.get("prefix") or None
+        if prefix in prefixes:
+            return "must have a different prefix for each store"
+        prefixes.add(prefix)
+    return None
+
+
+def _validate_categories(categories: Any) -> Optional[str]:
+    # Returns what is wrong with the pending_categories option, if anything.
+    if not isinstance(categories, dict):
+        return "must be a dictionary"
+    for category, types in categories.items():
+        if not isinstance(category, str) or not isinstance(types, list):
+            return "must be a dictionary of lists of request types by category"
+        if not all(isinstance(transactionType, str) for transactionType in types):
+            return "must have request types that are strings"
+    return None
+
+
 def beacon(config: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
     SystemLink TestMonitor store and forward health monitor beacon.
@@ -85,12 +700,9 @@ def beacon(config: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     global BEACON_INITIALIZED
 
     try:
-        if not BEACON_INITIALIZED:
-            success = _init_beacon()
-            if not success:
-                return []
-        EVENT_LOOP.run_until_complete(_update_fast_tag_values())
-        EVENT_LOOP.run_until_complete(_update_slow_tag_values())
+        options = _get_config(config)
+        with _profiled(options, "beacon"):
+            _run_beacon(options)
     except Exception as exc:
         log.error(
             'Unexpected exception in "systemlink_storeandforward_monitor beacon": %s',
@@ -103,16 +715,122 @@ def beacon(config: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     return []
 
 
-def _init_beacon() -> bool:
+def _run_beacon(options: Dict[str, Any]):
+    global TAG_INFO
+    started = time.monotonic()
+    if not BEACON_INITIALIZED:
+        success = _init_beacon(options)
+        if not success:
+            return
+    _configure_scan_executor(int(options["parallel_scan_workers"]))
+    timings: Dict[str, Any] = {}
+    with _timed(timings, "beacon.snapshot_duration"):
+        snapshots = _take_store_snapshots(options)
+    _update_fast_tag_values(snapshots, timings)
+    now = time.monotonic()
+    if SLOW_SCHEDULE.due(now) and SLOW_SCAN_WORKER.start(STORES, snapshots, options):
+        SLOW_SCHEDULE.started(
+            now,
+            SLOW_SCAN_WORKER.last_duration,
+            options["slow_interval"],
+            options["slow_scan_budget"],
+            options["slow_interval_max"],
+        )
+        SLOW_SCAN_WORKER.wait(options["slow_scan_wait"])
+    # Values are only recomputed every slow scan interval, so they age by that much
+    # between scans without being stale.
+    _update_slow_tag_values(options["slow_scan_max_age"] + (SLOW_SCHEDULE.interval or 0))
+    for key, value in timings.items():
+        TAG_INFO[key]["value"] = value
+    EVENT_LOOP.run_until_complete(_publish_tag_values(options))
+    # Published with the next beacon call.
+    TAG_INFO["beacon.duration"]["value"] = round(time.monotonic() - started, 3)
+
+
+@contextlib.contextmanager
+def _timed(values: Dict[str, Any], key: str):
+    """
+    Measure how long the body of a ``with`` statement takes.
+
+    :param values: The tag values to store the duration in, in seconds.
+    :param key: The key of the duration tag.
+    """
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        values[key] = round(time.monotonic() - started, 3)
+
+
+@contextlib.contextmanager
+def _profiled(options: Dict[str, Any], name: str):
+    """
+    Profile the body of a ``with`` statement and dump the profile if it was slow.
+
+    :param options: The beacon configuration options.
+    :param name: The name of the dump file, which is overwritten by later slow runs.
+    """
+    threshold = options["profile_threshold"]
+    if not threshold:
+        yield
+        return
+    profile = cProfile.Profile()
+    started = time.monotonic()
+    try:
+        profile.enable()
+    except ValueError:
+        # Another profiler is already active, such as the one of a slow scan on some
+        # Python versions.
+        yield
+        return
+    try:
+        yield
+    finally:
+        profile.disable()
+        elapsed = time.monotonic() - started
+        if elapsed > threshold:
+            path = os.path.join(
+                options["profile_directory"] or tempfile.gettempdir(),
+                f"{__virtualname__}.{name}.prof",
+            )
+            try:
+                profile.dump_stats(path)
+                log.info(f"{name} took {elapsed:.1f} seconds, wrote profile to {path}")
+            except OSError as ex:
+                log.warning(f"Failed to write profile to {path}: {ex}")
+
+
+def _get_config(config: List[Dict[str, Any]]) -> Dict[str, Any]:
+    options = dict(DEFAULT_CONFIG)
+    if isinstance(config, dict):
+        options.update(config)
+    else:
+        for item in config:
+            options.update(item)
+    return options
+
+
+def _init_beacon(options: Dict[str, Any]) -> bool:
     global ATEXIT_REGISTERED
     global BEACON_INITIALIZED
     global EVENT_LOOP
     global API_CLIENT
     global TAG_INFO
+    global NI_COMMON_APPDATA_DIR
+    global SLOW_SCAN_WORKER
+    global STORES
 
     if BEACON_INITIALIZED:
         return True
 
+    NI_COMMON_APPDATA_DIR = None
+    _stop_store_watchers()
+
+    if SLOW_SCAN_WORKER is None:
+        # The worker survives re-initialization so that a scan that is still running
+        # is never started twice.
+        SLOW_SCAN_WORKER = _SlowScanWorker()
+
     if not EVENT_LOOP:
         EVENT_LOOP = asyncio.get_event_loop()
 
@@ -122,8 +840,8 @@ def _init_beacon() -> bool:
         EVENT_LOOP.run_until_complete(API_CLIENT.close())
         API_CLIENT = None
 
-    configuration = get_configuration_by_id(HTTP_MASTER_CONFIGURATION_ID, "/nitag", False)
-    API_CLIENT = ApiClient(configuration=configuration)
+    _import_sdk()
+    API_CLIENT = nitag.ApiClient(configuration=_get_http_configuration())
 
     if not ATEXIT_REGISTERED:
         atexit.register(_cleanup_beacon)
@@ -136,15 +854,77 @@ def _init_beacon() -> bool:
     historyTTLDays = str(__grains__["health_monitoring_retention_duration_days"])
     maxHistoryCount = str(__grains__["health_monitoring_retention_max_history_count"])
     log.debug(f"Creating beacon tags on {hostname} ({minion_id}) for workspace {workspace}")
-    _setup_tags(TAG_INFO, minion_id)
+    STORES = [
+        _MonitoredStore(store.get("path") or None, store.get("prefix") or minion_id)
+        for store in options["stores"] or [{}]
+    ]
+    for store in STORES:
+        _setup_tags(store.tags, store.prefix, options)
+    for store in STORES[1:]:
+        for key in [k for k in store.tags if _is_beacon_tag(k)]:
+            del store.tags[key]
+    TAG_INFO = STORES[0].tags
     EVENT_LOOP.run_until_complete(
-        _create_or_update_tag_metadata(minion_id, hostname, workspace, retention, historyTTLDays, maxHistoryCount)
+        _create_or_update_tag_metadata(
+            minion_id, hostname, workspace, retention, historyTTLDays, maxHistoryCount
+        )
     )
 
     BEACON_INITIALIZED = True
     return True
 
 
+def _import_sdk():
+    global clientconfig
+    global nitag
+
+    if nitag is None:
+        clientconfig = importlib.import_module("systemlink.clientconfig")
+        nitag = importlib.import_module("systemlink.clients.nitag")
+        # RESTResponse is used to raise ApiException for failed requests.
+        importlib.import_module("systemlink.clients.nitag.rest")
+
+
+def _get_http_configuration() -> Any:
+    """
+    Return the configuration of the tag client.
+
+    It is read from the HTTP configuration the minion uses to connect to its SystemLink server.
+
+    :return: The configuration of the ``/nitag`` service.
+    """
+    return clientconfig.get_configuration_by_id(
+        clientconfig.HTTP_MASTER_CONFIGURATION_ID, "/nitag", False
+    )
+
+
+def _configure_scan_executor(workers: int):
+    global SCAN_EXECUTOR
+    global SCAN_EXECUTOR_WORKERS
+
+    if workers == SCAN_EXECUTOR_WORKERS:
+        return
+    if SCAN_EXECUTOR:
+        # A scan that is still using the old pool completes before its workers exit.
+        SCAN_EXECUTOR.shutdown(wait=False)
+        SCAN_EXECUTOR = None
+    if workers > 0:
+        SCAN_EXECUTOR = _systemlink_storeandforward_inspector.create_scan_executor(workers)
+    SCAN_EXECUTOR_WORKERS = workers
+
+
+def _stop_store_watchers():
+    for store in STORES:
+        if store.watcher:
+            store.watcher.stop()
+            store.watcher = None
+
+
+def _is_beacon_tag(key: str) -> bool:
+    # The tags of the beacon itself rather than of a store.
+    return key == "service_status" or key.startswith("beacon.")
+
+
 def _cleanup_beacon():
     global BEACON_INITIALIZED
     global API_CLIENT
@@ -162,11 +942,14 @@ def _cleanup_beacon():
         EVENT_LOOP.run_until_complete(API_CLIENT.close())
         API_CLIENT = None
         logging.disable(logging.NOTSET)
-    TAG_INFO.clear()
+    _configure_scan_executor(0)
+    _stop_store_watchers()
+    for store in STORES:
+        store.tags.clear()
     BEACON_INITIALIZED = False
 
 
-def _setup_tags(tag_info: Dict[str, Dict[str, str]], id: str):
+def _setup_tags(tag_info: Dict[str, Dict[str, str]], id: str, options: Dict[str, Any]):
     tag_info["service_status"] = {
         "path": id + ".TestMonitor.StoreAndForward.ServiceStatus",
         "type": "STRING",
@@ -203,6 +986,82 @@ def _setup_tags(tag_info: Dict[str, Dict[str, str]], id: str):
         "displayName": "{} FILES PENDING UPLOAD",
         "fast": True,
     }
+    tag_info["pending.files_size"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Pending.FilesSizeKiB",
+        "type": "DOUBLE",
+        "displayName": "{} SIZE OF FILES PENDING UPLOAD IN KiB",
+        "fast": True,
+    }
+    tag_info["pending.largest_file_size"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Pending.LargestFileSizeKiB",
+        "type": "DOUBLE",
+        "displayName": "{} LARGEST FILE PENDING UPLOAD IN KiB",
+        "fast": True,
+    }
+    tag_info["pending.oldest_file_age"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Pending.OldestFileAge",
+        "type": "DOUBLE",
+        "displayName": "{} AGE OF OLDEST FILE PENDING UPLOAD IN SECONDS",
+        "fast": True,
+    }
+    if options["pending_files_histogram_tag"]:
+        tag_info["pending.files_by_size"] = {
+            "path": id + ".TestMonitor.StoreAndForward.Pending.FilesBySize",
+            "type": "STRING",
+            "displayName": "{} FILES PENDING UPLOAD BY SIZE",
+            "fast": True,
+        }
+    if options["pending_estimate_threshold"]:
+        tag_info["pending.estimate_error"] = {
+            "path": id + ".TestMonitor.StoreAndForward.Pending.EstimateError",
+            "type": "DOUBLE",
+            "displayName": "{} MARGIN OF ERROR OF ESTIMATED PENDING REQUESTS",
+            "fast": False,
+        }
+    if options["pending_breakdown_tags"]:
+        tag_info["pending.by_type"] = {
+            "path": id + ".TestMonitor.StoreAndForward.Pending.ByType",
+            "type": "STRING",
+            "displayName": "{} PENDING REQUESTS BY TYPE",
+            "fast": False,
+        }
+        tag_info["pending.by_category"] = {
+            "path": id + ".TestMonitor.StoreAndForward.Pending.ByCategory",
+            "type": "STRING",
+            "displayName": "{} PENDING REQUESTS BY CATEGORY",
+            "fast": False,
+        }
+        if options["pending_group_by"]:
+            tag_info["pending.by_group"] = {
+                "path": id + ".TestMonitor.StoreAndForward.Pending.ByGroup",
+                "type": "STRING",
+                "displayName": "{} PENDING REQUESTS BY " + options["pending_group_by"].upper(),
+                "fast": False,
+            }
+    tag_info["pending.oldest_age"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Pending.OldestAge",
+        "type": "DOUBLE",
+        "displayName": "{} AGE OF OLDEST PENDING REQUEST IN SECONDS",
+        "fast": False,
+    }
+    tag_info["pending.enqueue_rate"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Pending.EnqueueRate",
+        "type": "DOUBLE",
+        "displayName": "{} REQUESTS ADDED PER MINUTE",
+        "fast": False,
+    }
+    tag_info["pending.forward_rate"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Pending.ForwardRate",
+        "type": "DOUBLE",
+        "displayName": "{} REQUESTS FORWARDED PER MINUTE",
+        "fast": False,
+    }
+    tag_info["pending.time_to_drain"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Pending.TimeToDrain",
+        "type": "DOUBLE",
+        "displayName": "{} ESTIMATED SECONDS UNTIL NO REQUESTS ARE PENDING",
+        "fast": False,
+    }
     tag_info["quarantine"] = {
         "path": id + ".TestMonitor.StoreAndForward.Quarantine",
         "type": "DOUBLE",
@@ -221,6 +1080,104 @@ def _setup_tags(tag_info: Dict[str, Dict[str, str]], id: str):
         "displayName": "{} QUARANTINE FILE SIZE IN KiB",
         "fast": True,
     }
+    if options["quarantine_analysis"]:
+        tag_info["quarantine.top_failures"] = {
+            "path": id + ".TestMonitor.StoreAndForward.Quarantine.TopFailures",
+            "type": "STRING",
+            "displayName": "{} MOST FREQUENT QUARANTINE FAILURES",
+            "fast": False,
+        }
+        tag_info["quarantine.age_histogram"] = {
+            "path": id + ".TestMonitor.StoreAndForward.Quarantine.AgeHistogram",
+            "type": "STRING",
+            "displayName": "{} QUARANTINED REQUESTS BY AGE",
+            "fast": False,
+        }
+        tag_info["quarantine.new_failure_classes"] = {
+            "path": id + ".TestMonitor.StoreAndForward.Quarantine.NewFailureClasses",
+            "type": "DOUBLE",
+            "displayName": "{} NEW QUARANTINE FAILURE CLASSES",
+            "fast": False,
+        }
+    tag_info["beacon.duration"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Beacon.Duration",
+        "type": "DOUBLE",
+        "displayName": "{} BEACON DURATION IN SECONDS",
+        "fast": True,
+    }
+    tag_info["beacon.snapshot_duration"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Beacon.SnapshotDuration",
+        "type": "DOUBLE",
+        "displayName": "{} BEACON STORE LISTING DURATION IN SECONDS",
+        "fast": True,
+    }
+    tag_info["beacon.service_status_duration"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Beacon.ServiceStatusDuration",
+        "type": "DOUBLE",
+        "displayName": "{} BEACON SERVICE STATUS DURATION IN SECONDS",
+        "fast": True,
+    }
+    tag_info["beacon.buffer_stats_duration"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Beacon.BufferStatsDuration",
+        "type": "DOUBLE",
+        "displayName": "{} BEACON BUFFER FILE STATISTICS DURATION IN SECONDS",
+        "fast": True,
+    }
+    tag_info["beacon.pending_files_duration"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Beacon.PendingFilesDuration",
+        "type": "DOUBLE",
+        "displayName": "{} BEACON PENDING FILES DURATION IN SECONDS",
+        "fast": True,
+    }
+    tag_info["beacon.pending_requests_duration"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Beacon.PendingRequestsDuration",
+        "type": "DOUBLE",
+        "displayName": "{} BEACON PENDING REQUESTS SCAN DURATION IN SECONDS",
+        "fast": False,
+    }
+    tag_info["beacon.quarantine_requests_duration"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Beacon.QuarantineRequestsDuration",
+        "type": "DOUBLE",
+        "displayName": "{} BEACON QUARANTINE SCAN DURATION IN SECONDS",
+        "fast": False,
+    }
+    tag_info["beacon.tag_write_duration"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Beacon.TagWriteDuration",
+        "type": "DOUBLE",
+        "displayName": "{} BEACON TAG WRITE DURATION IN SECONDS",
+        "fast": True,
+    }
+    tag_info["beacon.queued_tags"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Beacon.QueuedTags",
+        "type": "DOUBLE",
+        "displayName": "{} BEACON TAG VALUES WAITING TO BE WRITTEN",
+        "fast": True,
+    }
+    tag_info["beacon.files_scanned"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Beacon.FilesScanned",
+        "type": "DOUBLE",
+        "displayName": "{} BEACON BUFFER FILES SCANNED",
+        "fast": False,
+    }
+    tag_info["beacon.bytes_scanned"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Beacon.BytesScanned",
+        "type": "DOUBLE",
+        "displayName": "{} BEACON BYTES SCANNED",
+        "fast": False,
+    }
+    if options["scan_max_mib"] or options["scan_max_seconds"]:
+        tag_info["beacon.scan_budget_hits"] = {
+            "path": id + ".TestMonitor.StoreAndForward.Beacon.ScanBudgetHits",
+            "type": "DOUBLE",
+            "displayName": "{} BEACON SCANS THAT RAN OUT OF BUDGET",
+            "fast": False,
+        }
+    tag_info["beacon.records_parsed"] = {
+        "path": id + ".TestMonitor.StoreAndForward.Beacon.RecordsParsed",
+        "type": "DOUBLE",
+        "displayName": "{} BEACON REQUESTS PARSED",
+        "fast": False,
+    }
 
 
 async def _create_or_update_tag_metadata(
@@ -232,121 +1189,460 @@ async def _create_or_update_tag_metadata(
     maxHistoryCount: str,
 ):
     global API_CLIENT
-    global TAG_INFO
     log.debug(f"Creating tag metadata for tags on {hostname} ({id}) for workspace {workspace}")
     tags = []
-    for tag in TAG_INFO.values():
-        properties = {
-            "minionId": id,
-            "displayName": tag["displayName"].format(hostname),
-            "nitagRetention": retention,
-            "nitagHistoryTTLDays": historyTTLDays,
-            "nitagMaxHistoryCount": maxHistoryCount,
-            "hyperLink": "#tagviewer/tag/" + quote(workspace, safe="") + "/" + quote(tag["path"], safe=""),
-        }
-        tags.append(Tag(type=tag["type"], properties=properties, path=tag["path"], collect_aggregates=True))
-    tags_and_merge = TagListAndMergeFlag(tags, False)
-    tags_api = TagsApi(api_client=API_CLIENT)
+    for store in STORES:
+        # The display names of the tags of additional stores tell them apart.
+        name = hostname if store.prefix == id else f"{hostname} {store.prefix}"
+        for tag in store.tags.values():
+            properties = {
+                "minionId": id,
+                "displayName": tag["displayName"].format(name),
+                "nitagRetention": retention,
+                "nitagHistoryTTLDays": historyTTLDays,
+                "nitagMaxHistoryCount": maxHistoryCount,
+                "hyperLink": "#tagviewer/tag/"
+                + quote(workspace, safe="")
+                + "/"
+                + quote(tag["path"], safe=""),
+            }
+            tags.append(
+                nitag.Tag(
+                    type=tag["type"],
+                    properties=properties,
+                    path=tag["path"],
+                    collect_aggregates=True,
+                )
+            )
+    tags_and_merge = nitag.TagListAndMergeFlag(tags, False)
+    tags_api = nitag.TagsApi(api_client=API_CLIENT)
     response = await tags_api.create_or_update_tags(tags_and_merge, _preload_content=False)
     if response.status not in (200, 201, 202):
         data = await response.text()
-        rest_response = RESTResponse(response, data)
-        raise ApiException(http_resp=rest_response)
+        rest_response = nitag.rest.RESTResponse(response, data)
+        raise nitag.ApiException(http_resp=rest_response)
 
 
-async def _update_fast_tag_values():
-    global API_CLIENT
+def _update_fast_tag_values(
+    snapshots: List[_systemlink_storeandforward_inspector.StoreSnapshot], timings: Dict[str, Any]
+):
+    with _timed(timings, "beacon.service_status_duration"):
+        _update_service_status()
+    with _timed(timings, "beacon.buffer_stats_duration"):
+        for store, snapshot in zip(STORES, snapshots):
+            _calculate_forwarding_buffer_stats(snapshot, store.tags)
+    with _timed(timings, "beacon.pending_files_duration"):
+        for store, snapshot in zip(STORES, snapshots):
+            _calculate_pending_files(snapshot, store.tags)
+
+
+def _update_slow_tag_values(maxAge: float):
+    valuesByStore, completed = SLOW_SCAN_WORKER.latest()
+    if valuesByStore is None:
+        log.debug("Waiting for the first scan of the store and forward buffers to complete")
+        return
+    age = time.monotonic() - completed
+    if age > maxAge:
+        log.warning(
+            f"Not publishing store and forward buffer statistics computed {age:.0f} seconds ago"
+        )
+        for store, values in zip(STORES, valuesByStore):
+            for key in values:
+                store.tags.get(key, {}).pop("value", None)
+        return
+    for store, values in zip(STORES, valuesByStore):
+        for key, value in values.items():
+            # Tags enabled by options are only created when the beacon is initialized.
+            if key in store.tags:
+                store.tags[key]["value"] = value
+
+
+async def _publish_tag_values(options: Dict[str, Any]):
+    """
+    Queue the values of all tags that changed and write the queued values.
+
+    Values that didn't change since they were last queued are queued again once they
+    are older than the tag_heartbeat_interval option. With the history_upload_interval
+    option, values are queued with the current time and only written once the interval
+    elapsed.
+
+    :param options: The beacon configuration options.
+    """
     global TAG_INFO
-    _update_service_status()
-    _calculate_forwarding_buffer_stats()
-    _calculate_pending_files()
-    updates = []
-    for tag in TAG_INFO.values():
-        if tag["fast"]:
-            # A timestamp of ``None`` means use the server time.
-            update = TimestampedTagValue(value=TagValue(value=str(tag["value"]), type=tag["type"]), timestamp=None)
-            updates.append(TagUpdate(path=tag["path"], updates=[update]))
-
-    tags_api = TagsApi(api_client=API_CLIENT)
-    response = await tags_api.update_tag_current_values(updates, _preload_content=False)
-    if response.status not in (200, 202):
-        data = await response.text()
-        rest_response = RESTResponse(response, data)
-        raise ApiException(http_resp=rest_response)
+    global NEXT_HISTORY_UPLOAD
+    now = time.monotonic()
+    uploadInterval = options["history_upload_interval"]
+    timestamp = datetime.now(timezone.utc) if uploadInterval else None
+    for tag in (tag for store in STORES for tag in store.tags.values()):
+        if "value" not in tag:
+            continue
+        value = str(tag["value"])
+        if (
+            value == tag.get("published_value")
+            and now - tag["published_time"] < options["tag_heartbeat_interval"]
+        ):
+            continue
+        TAG_OUTBOX.put(
+            tag["path"], tag["type"], value, timestamp, int(options["history_max_samples"])
+        )
+        tag["published_value"] = value
+        tag["published_time"] = now
+
+    if uploadInterval:
+        if now < NEXT_HISTORY_UPLOAD:
+            TAG_INFO["beacon.queued_tags"]["value"] = len(TAG_OUTBOX)
+            return
+        NEXT_HISTORY_UPLOAD = now + uploadInterval
+
+    flushed = await TAG_OUTBOX.flush(
+        _write_tag_values,
+        int(options["publish_batch_size"]),
+        int(options["publish_retries"]),
+        options["publish_backoff_max"],
+    )
+    # Published with the next beacon call.
+    if flushed:
+        TAG_INFO["beacon.tag_write_duration"]["value"] = round(time.monotonic() - now, 3)
+    TAG_INFO["beacon.queued_tags"]["value"] = len(TAG_OUTBOX)
 
 
-async def _update_slow_tag_values():
+async def _write_tag_values(batch: List[Tuple[str, _OutboxEntry]]):
     global API_CLIENT
-    global TAG_INFO
-    _calculate_pending_requests()
-    _calculate_quarantine_requests()
-    updates = []
-    for tag in TAG_INFO.values():
-        if not tag["fast"]:
-            # A timestamp of ``None`` means use the server time.
-            update = TimestampedTagValue(value=TagValue(value=str(tag["value"]), type=tag["type"]), timestamp=None)
-            updates.append(TagUpdate(path=tag["path"], updates=[update]))
-
-    tags_api = TagsApi(api_client=API_CLIENT)
+    updates = [
+        nitag.TagUpdate(
+            path=path,
+            updates=[
+                nitag.TimestampedTagValue(
+                    value=nitag.TagValue(value=value, type=entry.type), timestamp=timestamp
+                )
+                for (value, timestamp) in entry.values
+            ],
+        )
+        for (path, entry) in batch
+    ]
+    tags_api = nitag.TagsApi(api_client=API_CLIENT)
     response = await tags_api.update_tag_current_values(updates, _preload_content=False)
     if response.status not in (200, 202):
         data = await response.text()
-        rest_response = RESTResponse(response, data)
-        raise ApiException(http_resp=rest_response)
+        if 400 <= response.status < 500 and response.status not in (408, 429):
+            # The server rejected the values, so writing them again won't succeed.
+            log.error(
+                f"Failed to write {len(updates)} tags, discarding them: {response.status} {data}"
+            )
+            return
+        rest_response = nitag.rest.RESTResponse(response, data)
+        raise nitag.ApiException(http_resp=rest_response)
 
 
 def _update_service_status():
     global TAG_INFO
     TAG_INFO["service_status"]["value"] = "unknown"
     try:
-        service = psutil.win_service_get("nisystemlinkforwarding")
-        TAG_INFO["service_status"]["value"] = service.status()
-    except psutil.NoSuchProcess:
-        TAG_INFO["service_status"]["value"] = "missing"
+        TAG_INFO["service_status"]["value"] = _read_service_status("nisystemlinkforwarding")
     except Exception as ex:
         log.error("Failed to get nisystemlinkforwarding service information. " + str(ex))
 
 
-def _calculate_forwarding_buffer_stats():
-    global TAG_INFO
-    storeDirectory = _get_testmon_store_directory()
+def _read_service_status(name: str) -> str:
+    """
+    Read the status of a service.
+
+    :param name: The name of the service.
+    :return: The status reported by the service manager, "missing" if the service is not
+        installed, or "unknown" on platforms without Windows services.
+    """
+    if sys.platform != "win32":
+        return "unknown"
+    import psutil
+
+    try:
+        return psutil.win_service_get(name).status()
+    except psutil.NoSuchProcess:
+        return "missing"
+
+
+def _take_store_snapshots(
+    options: Dict[str, Any],
+) -> List[_systemlink_storeandforward_inspector.StoreSnapshot]:
+    snapshots = []
+    for store in STORES:
+        if store.watcher is None:
+            store.watcher = _systemlink_storeandforward_inspector.StoreWatcher(
+                store.store_directory,
+                store.file_store_directory,
+                watch=bool(options["watch_store_directories"]),
+                maxUnchangedSeconds=options["store_snapshot_max_age"],
+            )
+        snapshots.append(store.watcher.snapshot())
+    return snapshots
+
+
+def _calculate_forwarding_buffer_stats(
+    snapshot: _systemlink_storeandforward_inspector.StoreSnapshot, tags: Dict[str, Dict[str, Any]]
+):
     (
         pendingFileCount,
         pendingFileSize,
-    ) = _systemlink_storeandforward_inspector.calculate_pending_request_size(storeDirectory)
+    ) = _systemlink_storeandforward_inspector.calculate_pending_request_size(snapshot)
     (
         quarantineFileCount,
         quarantineFileSize,
-    ) = _systemlink_storeandforward_inspector.calculate_quaratine_size(storeDirectory)
-    TAG_INFO["pending.buffer_file_count"]["value"] = pendingFileCount
-    TAG_INFO["pending.buffer_file_size"]["value"] = pendingFileSize
-    TAG_INFO["quarantine.buffer_file_count"]["value"] = quarantineFileCount
-    TAG_INFO["quarantine.buffer_file_size"]["value"] = quarantineFileSize
+    ) = _systemlink_storeandforward_inspector.calculate_quaratine_size(snapshot)
+    tags["pending.buffer_file_count"]["value"] = pendingFileCount
+    tags["pending.buffer_file_size"]["value"] = pendingFileSize
+    tags["quarantine.buffer_file_count"]["value"] = quarantineFileCount
+    tags["quarantine.buffer_file_size"]["value"] = quarantineFileSize
 
 
-def _calculate_pending_requests():
-    global TAG_INFO
-    storeDirectory = _get_testmon_store_directory()
-    (
-        pendingResults,
-        pendingSteps,
-    ) = _systemlink_storeandforward_inspector.calculate_pending_requests(storeDirectory)
-    TAG_INFO["pending.results"]["value"] = pendingResults
-    TAG_INFO["pending.steps"]["value"] = pendingSteps
+def _scan_slow_tag_values(
+    stores: List[_MonitoredStore],
+    snapshots: List[_systemlink_storeandforward_inspector.StoreSnapshot],
+    options: Dict[str, Any],
+) -> List[Dict[str, Any]]:
+    # Runs on the slow scan worker thread, so the values of each store are returned
+    # rather than written to its tags while the beacon may be reading them. The values
+    # of the beacon's own tags are returned with the first store.
+    global BUFFER_INDEX
+    global BUFFER_INDEX_FILE
+    indexFile = options["index_file"] or os.path.join(
+        __opts__["cachedir"], __virtualname__, "buffer_index"
+    )
+    groupBy = tuple(p.strip() for p in options["pending_group_by"].split(",") if p.strip())
+    if (
+        BUFFER_INDEX_FILE is None
+        or BUFFER_INDEX_FILE.path != indexFile
+        or BUFFER_INDEX.groupBy != groupBy
+    ):
+        BUFFER_INDEX_FILE = _BufferIndexFile(indexFile)
+        BUFFER_INDEX = BUFFER_INDEX_FILE.load(groupBy)
+
+    valuesByStore: List[Dict[str, Any]] = [{} for _ in stores]
+    values = valuesByStore[0]
+    statistics = BUFFER_INDEX.statistics = _systemlink_storeandforward_inspector.ScanStatistics()
+    BUFFER_INDEX.budget = _start_scan_budget(options)
+    with _timed(values, "beacon.pending_requests_duration"):
+        if not options["pending_estimate_threshold"]:
+            # The buffers of every store are parsed in one batch, so that the scan
+            # workers parse buffers of several stores at the same time.
+            _systemlink_storeandforward_inspector.scan_pending_requests(
+                snapshots, BUFFER_INDEX, SCAN_EXECUTOR
+            )
+        for snapshot, storeValues in zip(snapshots, valuesByStore):
+            exact = _calculate_pending_requests(snapshot, storeValues, options)
+            if options["pending_breakdown_tags"] and exact:
+                # Estimates are only for the pending result and step requests, so the
+                # breakdown is updated when all requests are counted.
+                _calculate_pending_breakdown(snapshot, storeValues, options)
+    for store, snapshot, storeValues in zip(stores, snapshots, valuesByStore):
+        # Requests parsed from the buffers were added since the previous scan, except on
+        # the first scan and when a rewritten buffer is parsed again. Only the result and
+        # step requests are counted, like the pending requests.
+        enqueued = statistics.resultsAndStepsParsedByDirectory.get(snapshot.storeDirectory, 0)
+        _calculate_drain_rates(store, storeValues, enqueued, options)
+        _calculate_oldest_pending_age(snapshot, storeValues)
+    with _timed(values, "beacon.quarantine_requests_duration"):
+        for store, snapshot, storeValues in zip(stores, snapshots, valuesByStore):
+            _calculate_quarantine_requests(snapshot, storeValues)
+            if options["quarantine_analysis"]:
+                _calculate_quarantine_analysis(store, snapshot, storeValues, options)
+    values["beacon.files_scanned"] = statistics.filesScanned
+    values["beacon.bytes_scanned"] = statistics.bytesScanned
+    values["beacon.records_parsed"] = statistics.recordsParsed
+    if BUFFER_INDEX.budget is not None:
+        values["beacon.scan_budget_hits"] = (
+            BUFFER_INDEX.budget.bytesHits + BUFFER_INDEX.budget.timeHits
+        )
+        if BUFFER_INDEX.budget.exhausted:
+            log.debug(
+                "The scan of the store and forward buffers ran out of budget "
+                "and resumes on the next scan"
+            )
+    BUFFER_INDEX_FILE.scanned(BUFFER_INDEX, options["index_save_interval"])
+    return valuesByStore
 
 
-def _calculate_quarantine_requests():
-    global TAG_INFO
-    storeDirectory = _get_testmon_store_directory()
-    quarantined = _systemlink_storeandforward_inspector.calculate_quaratine_requests(storeDirectory)
-    TAG_INFO["quarantine"]["value"] = quarantined
+def _calculate_drain_rates(
+    store: _MonitoredStore, values: Dict[str, Any], enqueued: int, options: Dict[str, Any]
+):
+    if "pending.results" not in values:
+        return
+    if (
+        store.drainRateEstimator is None
+        or store.drainRateEstimator.samples != options["rate_samples"]
+    ):
+        store.drainRateEstimator = _DrainRateEstimator(int(options["rate_samples"]))
+    rates = store.drainRateEstimator.add(
+        time.monotonic(), values["pending.results"] + values["pending.steps"], enqueued
+    )
+    if rates is not None:
+        values["pending.enqueue_rate"] = round(rates[0], 2)
+        values["pending.forward_rate"] = round(rates[1], 2)
+        values["pending.time_to_drain"] = round(rates[2])
 
 
-def _calculate_pending_files():
-    global TAG_INFO
-    storeDirectory = _get_files_store_directory()
-    files = _systemlink_storeandforward_inspector.calculate_pending_files(storeDirectory)
-    TAG_INFO["pending.files"]["value"] = files
+def _start_scan_budget(
+    options: Dict[str, Any],
+) -> Optional[_systemlink_storeandforward_inspector.ScanBudget]:
+    global SCAN_BUDGET
+    maxBytes = int(options["scan_max_mib"] * 1024 * 1024)
+    if not maxBytes and not options["scan_max_seconds"]:
+        SCAN_BUDGET = None
+        return None
+    if SCAN_BUDGET is None:
+        SCAN_BUDGET = _systemlink_storeandforward_inspector.ScanBudget()
+    # The hit counts are kept when the limits change.
+    SCAN_BUDGET.maxBytes = maxBytes
+    SCAN_BUDGET.maxSeconds = options["scan_max_seconds"]
+    SCAN_BUDGET.start()
+    return SCAN_BUDGET
+
+
+def _calculate_pending_requests(
+    snapshot: _systemlink_storeandforward_inspector.StoreSnapshot,
+    values: Dict[str, Any],
+    options: Dict[str, Any],
+) -> bool:
+    # Returns whether every request was counted.
+    global PENDING_ESTIMATOR
+    if not options["pending_estimate_threshold"]:
+        counts = _systemlink_storeandforward_inspector.calculate_pending_requests(
+            snapshot, BUFFER_INDEX, SCAN_EXECUTOR
+        )
+        if counts is None:
+            # The pending requests aren't published until the first scan within the
+            # budget completes.
+            return False
+        values["pending.results"], values["pending.steps"] = counts
+        return True
+
+    settings = (
+        int(options["pending_estimate_threshold"] * 1024 * 1024),
+        int(options["pending_estimate_samples"]),
+        options["pending_reconcile_interval"],
+    )
+    if PENDING_ESTIMATOR is None or settings != (
+        PENDING_ESTIMATOR.minimumBytes,
+        PENDING_ESTIMATOR.samples,
+        PENDING_ESTIMATOR.reconcileInterval,
+    ):
+        PENDING_ESTIMATOR = _systemlink_storeandforward_inspector.PendingEstimator(
+            minimumBytes=settings[0], samples=settings[1], reconcileInterval=settings[2]
+        )
+    estimate = _systemlink_storeandforward_inspector.estimate_pending_requests(
+        snapshot, BUFFER_INDEX, SCAN_EXECUTOR, PENDING_ESTIMATOR
+    )
+    if estimate is None:
+        return False
+    values["pending.results"] = estimate.results
+    values["pending.steps"] = estimate.steps
+    values["pending.estimate_error"] = round(math.hypot(estimate.resultsError, estimate.stepsError))
+    return estimate.exact
+
+
+def _calculate_pending_breakdown(
+    snapshot: _systemlink_storeandforward_inspector.StoreSnapshot,
+    values: Dict[str, Any],
+    options: Dict[str, Any],
+):
+    # Reuses the counts of the scan for the pending requests.
+    classifier = _systemlink_storeandforward_inspector.TransactionClassifier(
+        options["pending_categories"] or None
+    )
+    breakdown = _systemlink_storeandforward_inspector.calculate_pending_breakdown(
+        snapshot, BUFFER_INDEX, classifier=classifier
+    )
+    values["pending.by_type"] = json.dumps(breakdown.byType, sort_keys=True)
+    values["pending.by_category"] = json.dumps(breakdown.byCategory, sort_keys=True)
+    if BUFFER_INDEX.groupBy:
+        byGroup = {
+            "/".join(group): sum(counts.values()) for (group, counts) in breakdown.byGroup.items()
+        }
+        values["pending.by_group"] = json.dumps(byGroup, sort_keys=True)
+
+
+def _calculate_oldest_pending_age(
+    snapshot: _systemlink_storeandforward_inspector.StoreSnapshot, values: Dict[str, Any]
+):
+    age = _systemlink_storeandforward_inspector.calculate_oldest_pending_age(snapshot, BUFFER_INDEX)
+    values["pending.oldest_age"] = 0 if age is None else round(age)
+
+
+def _calculate_quarantine_requests(
+    snapshot: _systemlink_storeandforward_inspector.StoreSnapshot, values: Dict[str, Any]
+):
+    quarantined = _systemlink_storeandforward_inspector.calculate_quaratine_requests(
+        snapshot, BUFFER_INDEX
+    )
+    values["quarantine"] = quarantined
+
+
+def _calculate_quarantine_analysis(
+    store: _MonitoredStore,
+    snapshot: _systemlink_storeandforward_inspector.StoreSnapshot,
+    values: Dict[str, Any],
+    options: Dict[str, Any],
+):
+    analyzer = store.quarantineAnalyzer
+    if analyzer is None or analyzer.topK != options["quarantine_top_k"]:
+        analyzer = store.quarantineAnalyzer = (
+            _systemlink_storeandforward_inspector.QuarantineAnalyzer(
+                int(options["quarantine_top_k"])
+            )
+        )
+    analysis = _systemlink_storeandforward_inspector.calculate_quarantine_analysis(
+        snapshot, analyzer
+    )
+    topFailures = [
+        {"type": type, "reason": reason, "count": count, "error": error}
+        for ((type, reason), count, error) in analysis.topClasses
+    ]
+    ageHistogram = {
+        _format_age(bound): count
+        for (bound, count) in zip(analyzer.ageBuckets, analysis.ageHistogram)
+    }
+    ageHistogram["older"] = analysis.ageHistogram[-1]
+    values["quarantine.top_failures"] = json.dumps(topFailures)
+    values["quarantine.age_histogram"] = json.dumps(ageHistogram)
+    values["quarantine.new_failure_classes"] = len(analysis.newClasses)
+    for type, reason in analysis.newClasses:
+        log.warning("New class of quarantined requests of %s: %s %s", store.prefix, type, reason)
+
+
+def _format_age(seconds: float) -> str:
+    for unit, length in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= length and seconds % length == 0:
+            return "<" + str(int(seconds // length)) + unit
+    return "<" + str(int(seconds)) + "s"
+
+
+def _calculate_pending_files(
+    snapshot: _systemlink_storeandforward_inspector.StoreSnapshot, tags: Dict[str, Dict[str, Any]]
+):
+    files = _systemlink_storeandforward_inspector.calculate_pending_files(snapshot)
+    tags["pending.files"]["value"] = files
+    analysis = _systemlink_storeandforward_inspector.calculate_pending_file_analysis(snapshot)
+    tags["pending.files_size"]["value"] = int(math.ceil(analysis.totalBytes / 1024))
+    largest = analysis.largest.size if analysis.largest is not None else 0
+    tags["pending.largest_file_size"]["value"] = int(math.ceil(largest / 1024))
+    oldestAge = time.time() - analysis.oldest.mtime / 1e9 if analysis.oldest is not None else 0
+    tags["pending.oldest_file_age"]["value"] = max(0, round(oldestAge))
+    if "pending.files_by_size" in tags:
+        bySize = {
+            "<=" + _format_size(bound): count
+            for (bound, count) in zip(
+                _systemlink_storeandforward_inspector.PENDING_FILE_SIZE_BUCKETS,
+                analysis.sizeHistogram,
+            )
+        }
+        bySize["larger"] = analysis.sizeHistogram[-1]
+        tags["pending.files_by_size"]["value"] = json.dumps(bySize)
+
+
+def _format_size(size: int) -> str:
+    for unit, length in (("GiB", 2**30), ("MiB", 2**20), ("KiB", 2**10)):
+        if size >= length and size % length == 0:
+            return str(size // length) + unit
+    return str(size) + "B"
 
 
 def _get_testmon_store_directory() -> str:
@@ -361,10 +1657,23 @@ def _get_ni_common_appdata_dir() -> str:
     r"""
     Return the National Instruments Common Application Data Directory.
 
-    This looks like 'C:\ProgramData\National Instruments'
+    This looks like 'C:\ProgramData\National Instruments'. It is read from the registry
+    on Windows, and from the NIPUBAPPDATADIR environment variable on other platforms.
     :return: The National Instruments Common Application Data Directory.
     :rtype: str
     """
-    with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, NI_INSTALLERS_REG_PATH, 0, winreg.KEY_READ) as hkey:
-        (appdata_dir, _) = winreg.QueryValueEx(hkey, NI_INSTALLERS_REG_KEY_APP_DATA)
-        return appdata_dir
+    global NI_COMMON_APPDATA_DIR
+    if NI_COMMON_APPDATA_DIR is None:
+        if sys.platform == "win32":
+            import winreg
+
+            with winreg.OpenKey(
+                winreg.HKEY_LOCAL_MACHINE, NI_INSTALLERS_REG_PATH, 0, winreg.KEY_READ
+            ) as hkey:
+                NI_COMMON_APPDATA_DIR, _ = winreg.QueryValueEx(hkey, NI_INSTALLERS_REG_KEY_APP_DATA)
+        else:
+            try:
+                NI_COMMON_APPDATA_DIR = os.environ[NI_INSTALLERS_REG_KEY_APP_DATA]
+            except KeyError:
+                raise OSError(NI_INSTALLERS_REG_KEY_APP_DATA + " is not set") from None
+    return NI_COMMON_APPDATA_DIR
@@ -0,0 +1,201 @@
+"""Synthetic store and forward data for benchmarking the inspector."""
+
+import json
+import os
+import random
+import re
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Tuple
+
+_SAMPLE_BUFFER = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)),
+    "unit",
+    "testmon",
+    "8536b793-cade-4ef4-92dd-083cc04d214f.jsonl",
+)
+
+
+# The timestamp and type every request ends with.
+_REQUEST_SUFFIX = re.compile(rb'"timestamp":"[^"]*","type":"([^"]*)"}\r?\n$')
+
+# When the first synthetic request was written, and the time between requests.
+_FIRST_REQUEST_TIME = datetime(2022, 3, 10, 21, 47, 55)
+_REQUEST_INTERVAL = timedelta(milliseconds=1)
+
+
+class Corpus(NamedTuple):
+    """The layout of a generated store and the counts the inspector should report for it."""
+
+    storeDirectory: str
+    fileStoreDirectory: str
+    requests: int
+    pendingResults: int
+    pendingSteps: int
+    quarantinedRequests: int
+    pendingFiles: int
+
+
+def sample_requests() -> List[bytes]:
+    """
+    Read the requests of the sample transaction buffer used by the unit tests.
+
+    :return: The lines of the sample buffer, including their line terminators.
+    """
+    with open(_SAMPLE_BUFFER, "rb") as fp:
+        return fp.readlines()
+
+
+def write_quarantine(storeDirectory: str, sizeInBytes: int, fileCount: int = 1) -> int:
+    """
+    Fill the quarantine directory of a store with copies of the sample requests.
+
+    :param storeDirectory: The store directory to create the quarantine directory in.
+    :param sizeInBytes: The approximate total size of the quarantine buffers.
+    :param fileCount: The number of quarantine buffers to spread the requests over.
+    :return: The number of requests written.
+    """
+    quarantineDirectory = os.path.join(storeDirectory, "quarantine")
+    os.makedirs(quarantineDirectory, exist_ok=True)
+    requests = sample_requests()
+    block = b"".join(requests)
+    blocksPerFile = max(1, sizeInBytes // len(block) // fileCount)
+    for _ in range(fileCount):
+        with open(os.path.join(quarantineDirectory, str(uuid.uuid4()) + ".jsonl"), "wb") as fp:
+            for _ in range(blocksPerFile):
+                fp.write(block)
+    return blocksPerFile * fileCount * len(requests)
+
+
+def write_buffers(storeDirectory: str, sizeInBytes: int, fileCount: int) -> int:
+    """
+    Fill a store directory with transaction buffers made of copies of the sample requests.
+
+    The ``__CACHE__`` file is written with a timestamp before every sample request, so
+    every request is pending.
+
+    :param storeDirectory: The store directory to write the buffers in.
+    :param sizeInBytes: The approximate total size of the buffers.
+    :param fileCount: The number of buffers to spread the requests over.
+    :return: The number of requests written.
+    """
+    os.makedirs(storeDirectory, exist_ok=True)
+    requests = sample_requests()
+    block = b"".join(requests)
+    blocksPerFile = max(1, sizeInBytes // len(block) // fileCount)
+    for _ in range(fileCount):
+        with open(os.path.join(storeDirectory, str(uuid.uuid4()) + ".jsonl"), "wb") as fp:
+            for _ in range(blocksPerFile):
+                fp.write(block)
+    with open(os.path.join(storeDirectory, "__CACHE__"), "w") as fp:
+        json.dump({"timestamp": "2000-01-01T00:00:00.000000Z"}, fp)
+    return blocksPerFile * fileCount * len(requests)
+
+
+def generate_store(
+    rootDirectory: str,
+    buffers: int = 10,
+    requestsPerBuffer: int = 1000,
+    resultRatio: float = 0.1,
+    cachePosition: float = 0.5,
+    quarantineBuffers: int = 1,
+    requestsPerQuarantineBuffer: int = 100,
+    files: int = 0,
+    seed: int = 0,
+) -> Corpus:
+    """
+    Generate a test monitor store and a file store with requests shaped like the sample
+    requests.
+
+    Requests get increasing timestamps across buffers in the order the buffers are
+    named, as the store and forward service writes them.
+
+    :param rootDirectory: The directory to create the ``testmon`` and ``file`` store
+        directories in.
+    :param buffers: The number of transaction buffers.
+    :param requestsPerBuffer: The number of requests in each transaction buffer.
+    :param resultRatio: The fraction of requests that are result requests rather than
+        step requests.
+    :param cachePosition: The fraction of requests already forwarded, which sets the
+        timestamp written to ``__CACHE__``.
+    :param quarantineBuffers: The number of buffers in the quarantine directory.
+    :param requestsPerQuarantineBuffer: The number of requests in each quarantine buffer.
+    :param files: The number of pending ``*.file`` files in the file store.
+    :param seed: The seed for choosing request types, so runs are repeatable.
+    :return: The generated store and the counts the inspector should report for it.
+    """
+    templates = _request_templates()
+    generator = random.Random(seed)
+    storeDirectory = os.path.join(rootDirectory, "testmon")
+    fileStoreDirectory = os.path.join(rootDirectory, "file")
+    os.makedirs(storeDirectory, exist_ok=True)
+    os.makedirs(fileStoreDirectory, exist_ok=True)
+
+    requests = buffers * requestsPerBuffer
+    forwarded = int(requests * cachePosition)
+    pendingResults = 0
+    pendingSteps = 0
+    sequence = 0
+    for buffer in range(buffers):
+        lines = []
+        for _ in range(requestsPerBuffer):
+            kind = "Result" if generator.random() < resultRatio else "Step"
+            if sequence >= forwarded:
+                if kind == "Result":
+                    pendingResults += 1
+                else:
+                    pendingSteps += 1
+            lines.append(_make_request(generator.choice(templates[kind]), _request_time(sequence)))
+            sequence += 1
+        # Buffer names sort in the order they were written.
+        with open(os.path.join(storeDirectory, f"{buffer:08d}-{uuid.uuid4()}.jsonl"), "wb") as fp:
+            fp.write(b"".join(lines))
+
+    # Half an interval before the first pending request, so no request shares its timestamp.
+    lastProcessed = _request_time(forwarded) - _REQUEST_INTERVAL / 2
+    with open(os.path.join(storeDirectory, "__CACHE__"), "w") as fp:
+        json.dump({"timestamp": lastProcessed.strftime("%Y-%m-%dT%H:%M:%S.%fZ")}, fp)
+
+    quarantineDirectory = os.path.join(storeDirectory, "quarantine")
+    os.makedirs(quarantineDirectory, exist_ok=True)
+    for _ in range(quarantineBuffers):
+        lines = []
+        for _ in range(requestsPerQuarantineBuffer):
+            kind = "Result" if generator.random() < resultRatio else "Step"
+            lines.append(_make_request(generator.choice(templates[kind]), _request_time(sequence)))
+            sequence += 1
+        with open(os.path.join(quarantineDirectory, str(uuid.uuid4()) + ".jsonl"), "wb") as fp:
+            fp.write(b"".join(lines))
+
+    for _ in range(files):
+        with open(os.path.join(fileStoreDirectory, str(uuid.uuid4()) + ".file"), "wb") as fp:
+            fp.write(os.urandom(generator.randint(1, 64) * 1024))
+
+    return Corpus(
+        storeDirectory,
+        fileStoreDirectory,
+        requests,
+        pendingResults,
+        pendingSteps,
+        quarantineBuffers * requestsPerQuarantineBuffer,
+        files,
+    )
+
+
+def _request_templates() -> Dict[str, List[Tuple[bytes, bytes]]]:
+    templates = {"Result": [], "Step": []}
+    for request in sample_requests():
+        match = _REQUEST_SUFFIX.search(request)
+        kind = "Result" if match.group(1).startswith(b"Result") else "Step"
+        templates[kind].append(
+            (request[: match.start()] + b'"timestamp":"', b'","type":"' + match.group(1) + b'"}\n')
+        )
+    return templates
+
+
+def _make_request(template: Tuple[bytes, bytes], timestamp: datetime) -> bytes:
+    return template[0] + timestamp.strftime("%Y-%m-%dT%H:%M:%S.%fZ").encode("ascii") + template[1]
+
+
+def _request_time(sequence: int) -> datetime:
+    return _FIRST_REQUEST_TIME + sequence * _REQUEST_INTERVAL
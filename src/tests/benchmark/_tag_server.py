@@ -0,0 +1,175 @@
+"""
+A local stand-in for the ``/nitag`` endpoints of a SystemLink server.
+
+Only the endpoints the beacon uses are served: creating or updating tags and updating
+their current values. Requests to any other path are counted and answered with 404, so
+a change in what the beacon calls shows up in the statistics instead of going unnoticed.
+"""
+
+import asyncio
+import json
+import random
+import socket
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from aiohttp import web
+
+
+class TagServerStatistics(NamedTuple):
+    """The requests a :class:`TagServer` received since it started."""
+
+    requests: int
+    payloadBytes: int
+    failures: int
+    unknownRequests: int
+    values: int
+
+
+class TagServer:
+    """
+    Serve the tag endpoints in memory from a background thread.
+
+    Every request is delayed by ``latency`` seconds and fails with 503 Service Unavailable
+    with a probability of ``errorRate``, before its payload is recorded.
+    """
+
+    CREATE_OR_UPDATE_TAGS = "/nitag/v2/tags"
+    UPDATE_CURRENT_VALUES = "/nitag/v2/update-current-values"
+
+    def __init__(self, latency: float = 0.0, errorRate: float = 0.0, seed: Optional[int] = None):
+        """
+        :param latency: The delay in seconds before answering each request.
+        :param errorRate: The fraction of requests to fail.
+        :param seed: The seed for choosing the requests to fail, so runs are repeatable.
+        """
+        self.latency = latency
+        self.errorRate = errorRate
+        self.url: Optional[str] = None
+        # The tags by path, as last created or updated.
+        self.tags: Dict[str, Dict[str, Any]] = {}
+        # The current value of each tag by path, as the string that was written.
+        self.values: Dict[str, str] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._payloadBytes = 0
+        self._failures = 0
+        self._unknownRequests = 0
+        self._valueCount = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "TagServer":
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self) -> str:
+        """
+        Start serving on a free port of the loopback interface.
+
+        :return: The URL of the server, without the ``/nitag`` service path.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        self.url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+        self._thread = threading.Thread(
+            target=self._serve, args=(sock, started), name="TagServer", daemon=True
+        )
+        self._thread.start()
+        started.wait()
+        return self.url
+
+    def stop(self):
+        """Stop serving and wait for the server thread to exit."""
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    def statistics(self) -> TagServerStatistics:
+        """
+        Return what the server received so far.
+
+        :return: The number of requests, their total payload size in bytes, the number of
+            requests failed on purpose, the number of requests to paths that aren't
+            served, and the number of tag values written.
+        """
+        with self._lock:
+            return TagServerStatistics(
+                self._requests,
+                self._payloadBytes,
+                self._failures,
+                self._unknownRequests,
+                self._valueCount,
+            )
+
+    def _serve(self, sock: socket.socket, started: threading.Event):
+        asyncio.set_event_loop(self._loop)
+        application = web.Application()
+        application.router.add_post(self.CREATE_OR_UPDATE_TAGS, self._create_or_update_tags)
+        application.router.add_post(self.UPDATE_CURRENT_VALUES, self._update_current_values)
+        application.router.add_route("*", "/{path:.*}", self._unknown)
+        runner = web.AppRunner(application, access_log=None)
+        self._loop.run_until_complete(runner.setup())
+        self._loop.run_until_complete(web.SockSite(runner, sock).start())
+        started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.run_until_complete(runner.cleanup())
+            self._loop.close()
+
+    async def _create_or_update_tags(self, request: web.Request) -> web.Response:
+        body = await self._receive(request)
+        if body is None:
+            return web.Response(status=503, text="Simulated failure")
+        # The tags are sent either as a list or with the flag to merge their properties.
+        tags: List[Dict[str, Any]] = body["tags"] if isinstance(body, dict) else body
+        with self._lock:
+            for tag in tags:
+                self.tags[tag["path"]] = tag
+        return web.json_response({})
+
+    async def _update_current_values(self, request: web.Request) -> web.Response:
+        body = await self._receive(request)
+        if body is None:
+            return web.Response(status=503, text="Simulated failure")
+        with self._lock:
+            for update in body:
+                self._valueCount += len(update["updates"])
+                if update["updates"]:
+                    self.values[update["path"]] = update["updates"][-1]["value"]["value"]
+        return web.Response(status=202)
+
+    async def _unknown(self, request: web.Request) -> web.Response:
+        payload = await request.read()
+        with self._lock:
+            self._requests += 1
+            self._payloadBytes += len(payload)
+            self._unknownRequests += 1
+        return web.Response(status=404, text="Not served by the stand-in tag server")
+
+    async def _receive(self, request: web.Request) -> Any:
+        """
+        Read the payload of a request and decide whether it fails.
+
+        :param request: The request to receive.
+        :return: The decoded JSON payload, or ``None`` if the request fails.
+        """
+        payload = await request.read()
+        with self._lock:
+            self._requests += 1
+            self._payloadBytes += len(payload)
+            failed = self._random.random() < self.errorRate
+            if failed:
+                self._failures += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return None if failed else json.loads(payload.decode("utf-8"))
@@ -0,0 +1,246 @@
+"""
+Measure the tag traffic and latency of the beacon against a stand-in Tags server.
+
+The beacon runs in a fresh process on a generated store, with the registry and service
+lookups replaced and the tag client pointed at a local :class:`TagServer` that delays and
+fails requests as asked. Requires aiohttp and the SystemLink SDK. Run from the ``src``
+directory, for example for 30 ticks with 50 ms server latency and 10% of requests failing::
+
+    python -m tests.benchmark.benchmark_beacon --ticks 30 --latency 0.05 --error-rate 0.1
+
+With ``--stores``, the beacon monitors that many generated stores with the ``stores``
+option, each with its own tag prefix.
+
+Beacon options are passed with ``--option name=value``, where the value is read as JSON
+if it can be.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from tests.benchmark import _corpus
+
+# The grains the beacon reads when creating its tags.
+GRAINS: Dict[str, Any] = {
+    "id": "benchmark-minion",
+    "host": "benchmark-host",
+    "systemlink_workspace": "benchmark-workspace",
+    "health_monitoring_retention_type": "duration",
+    "health_monitoring_retention_duration_days": 3,
+    "health_monitoring_retention_max_history_count": 10000,
+}
+
+
+class TickMeasurement(NamedTuple):
+    """The cost of one beacon call."""
+
+    duration: float
+    requests: int
+    payloadBytes: int
+    failures: int
+    unknownRequests: int
+    values: int
+    queuedTags: Optional[int]
+
+
+class BeaconMeasurement(NamedTuple):
+    """The cost of each beacon call and what the server holds after the last one."""
+
+    ticks: List[TickMeasurement]
+    tags: Dict[str, Dict[str, Any]]
+    values: Dict[str, str]
+
+
+def measure(
+    appdataDirectory: str,
+    ticks: int,
+    config: Dict[str, Any],
+    latency: float = 0.0,
+    errorRate: float = 0.0,
+    tickInterval: float = 0.0,
+    serviceStatus: str = "running",
+    seed: Optional[int] = None,
+) -> BeaconMeasurement:
+    """
+    Run the beacon against a stand-in Tags server in the calling process.
+
+    The beacon keeps its state in module globals, so call this in a fresh process.
+
+    :param appdataDirectory: The directory returned instead of the National Instruments
+        common application data directory, with the stores in ``Skyline/Data/Store``.
+    :param ticks: The number of times to call the beacon.
+    :param config: The beacon configuration options.
+    :param latency: The delay in seconds before the server answers each request.
+    :param errorRate: The fraction of requests the server fails.
+    :param tickInterval: The time in seconds between the start of beacon calls.
+    :param serviceStatus: The status reported for the store and forward service.
+    :param seed: The seed for choosing the requests to fail.
+    :return: The cost of each beacon call and the tags and values the server holds.
+    """
+    from systemlink_storeandforward_beacon import systemlink_storeandforward_monitor as monitor
+    from tests.benchmark._tag_server import TagServer
+
+    with TagServer(latency, errorRate, seed) as server:
+        monitor._import_sdk()
+        configuration = monitor.nitag.Configuration(host=server.url + "/nitag")
+        monitor.__opts__ = {"cachedir": os.path.join(appdataDirectory, "cache")}
+        monitor.__grains__ = GRAINS
+        monitor._get_ni_common_appdata_dir = lambda: appdataDirectory
+        monitor._read_service_status = lambda name: serviceStatus
+        monitor._get_http_configuration = lambda: configuration
+
+        measurements = []
+        for _ in range(ticks):
+            before = server.statistics()
+            started = time.perf_counter()
+            monitor.beacon([config])
+            duration = time.perf_counter() - started
+            after = server.statistics()
+            queued = monitor.TAG_INFO.get("beacon.queued_tags", {}).get("value")
+            measurements.append(
+                TickMeasurement(
+                    duration, *(now - then for (now, then) in zip(after, before)), queued
+                )
+            )
+            time.sleep(max(0.0, tickInterval - duration))
+        monitor._cleanup_beacon()
+        return BeaconMeasurement(measurements, dict(server.tags), dict(server.values))
+
+
+def run(appdataDirectory: str, ticks: int, config: Dict[str, Any], **kwargs) -> BeaconMeasurement:
+    """
+    Run the beacon against a stand-in Tags server in a fresh process.
+
+    :param appdataDirectory: The directory with the stores in ``Skyline/Data/Store``.
+    :param ticks: The number of times to call the beacon.
+    :param config: The beacon configuration options.
+    :param kwargs: The other arguments of :func:`measure`.
+    :return: The cost of each beacon call and the tags and values the server holds.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=context) as executor:
+        return executor.submit(measure, appdataDirectory, ticks, config, **kwargs).result()
+
+
+def store_root(appdataDirectory: str) -> str:
+    """
+    Return the directory the beacon expects the stores in.
+
+    :param appdataDirectory: The stand-in National Instruments common application data
+        directory.
+    :return: The directory to generate the ``testmon`` and ``file`` stores in.
+    """
+    return os.path.join(appdataDirectory, "Skyline", "Data", "Store")
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _parse_option(text: str) -> Dict[str, Any]:
+    name, _, value = text.partition("=")
+    try:
+        return {name: json.loads(value)}
+    except ValueError:
+        return {name: value}
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--ticks", type=int, default=10, help="number of beacon calls")
+    parser.add_argument(
+        "--tick-interval", type=float, default=0.0, help="seconds between beacon calls"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="server delay for each request in seconds"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="fraction of requests the server fails"
+    )
+    parser.add_argument("--buffers", type=int, default=10, help="number of transaction buffers")
+    parser.add_argument("--requests", type=int, default=10000, help="requests in each buffer")
+    parser.add_argument(
+        "--quarantine-buffers", type=int, default=1, help="number of quarantine buffers"
+    )
+    parser.add_argument("--files", type=int, default=100, help="number of pending files")
+    parser.add_argument("--stores", type=int, default=1, help="number of stores")
+    parser.add_argument("--option", action="append", default=[], help="beacon option as name=value")
+    parser.add_argument(
+        "--seed", type=int, default=0, help="seed for request types and server failures"
+    )
+    args = parser.parse_args()
+
+    config: Dict[str, Any] = {}
+    for option in args.option:
+        config.update(_parse_option(option))
+
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as appdataDirectory:
+        roots = [store_root(appdataDirectory)]
+        roots.extend(
+            os.path.join(appdataDirectory, "stores", str(number))
+            for number in range(1, args.stores)
+        )
+        for root in roots:
+            corpus = _corpus.generate_store(
+                root,
+                buffers=args.buffers,
+                requestsPerBuffer=args.requests,
+                quarantineBuffers=args.quarantine_buffers,
+                files=args.files,
+                seed=args.seed,
+            )
+        if args.stores > 1:
+            config["stores"] = [{}] + [
+                {"path": root, "prefix": f"{GRAINS['id']}.Store{number}"}
+                for (number, root) in enumerate(roots[1:], start=1)
+            ]
+        print(
+            f"{len(roots)} stores, each with {corpus.requests} requests in {args.buffers} buffers, "
+            f"{corpus.pendingResults + corpus.pendingSteps} pending, {corpus.pendingFiles} files"
+        )
+        measurement = run(
+            appdataDirectory,
+            args.ticks,
+            config,
+            latency=args.latency,
+            errorRate=args.error_rate,
+            tickInterval=args.tick_interval,
+            seed=args.seed,
+        )
+
+    print(
+        f"{'tick':>5} {'ms':>9} {'requests':>9} {'KiB':>9} "
+        f"{'failed':>9} {'values':>9} {'queued':>9}"
+    )
+    for number, tick in enumerate(measurement.ticks):
+        print(
+            f"{number:>5} {tick.duration * 1000:>9.1f} {tick.requests:>9} "
+            f"{tick.payloadBytes / 1024:>9.1f} {tick.failures:>9} {tick.values:>9} "
+            f"{'n/a' if tick.queuedTags is None else tick.queuedTags:>9}"
+        )
+    # The first call creates the tags and waits for the first scan, so it is left out.
+    steady = measurement.ticks[1:] or measurement.ticks
+    durations = [tick.duration for tick in steady]
+    print(
+        "after the first call: "
+        f"{sum(tick.requests for tick in steady) / len(steady):.1f} requests and "
+        f"{sum(tick.payloadBytes for tick in steady) / len(steady) / 1024:.1f} KiB per call, "
+        f"latency p50 {_percentile(durations, 0.5) * 1000:.1f} ms, "
+        f"p95 {_percentile(durations, 0.95) * 1000:.1f} ms, max {max(durations) * 1000:.1f} ms"
+    )
+    unknown = sum(tick.unknownRequests for tick in measurement.ticks)
+    if unknown:
+        print(f"{unknown} requests to paths the stand-in server doesn't serve")
+    print(f"{len(measurement.tags)} tags created, {len(measurement.values)} with values")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Measure the cost of each inspector calculation on a generated store.
+
+Each calculation runs in a fresh process, once with an empty index as on the first
+beacon call and once more as on a later call with nothing changed. Run from the ``src``
+directory, for example for 100 buffers of 10000 requests with half of them forwarded::
+
+    python -m tests.benchmark.benchmark_inspector \
+        --buffers 100 --requests 10000 --cache-position 0.5
+
+Peak RSS is the high-water mark of the whole measuring process. Syscalls are the read
+and write calls counted by psutil, where the platform reports them.
+"""
+
+import argparse
+import multiprocessing
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from systemlink_storeandforward_beacon import _systemlink_storeandforward_inspector
+from tests.benchmark import _corpus
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# The calculations to measure, given the generated store and the index to use.
+CALCULATIONS: Dict[
+    str, Callable[[_corpus.Corpus, _systemlink_storeandforward_inspector.BufferIndex], Any]
+] = {
+    "calculate_pending_files": lambda corpus, index: (
+        _systemlink_storeandforward_inspector.calculate_pending_files(corpus.fileStoreDirectory)
+    ),
+    "calculate_pending_request_size": lambda corpus, index: (
+        _systemlink_storeandforward_inspector.calculate_pending_request_size(corpus.storeDirectory)
+    ),
+    "calculate_pending_requests": lambda corpus, index: (
+        _systemlink_storeandforward_inspector.calculate_pending_requests(
+            corpus.storeDirectory, index
+        )
+    ),
+    "calculate_quaratine_size": lambda corpus, index: (
+        _systemlink_storeandforward_inspector.calculate_quaratine_size(corpus.storeDirectory)
+    ),
+    "calculate_quaratine_requests": lambda corpus, index: (
+        _systemlink_storeandforward_inspector.calculate_quaratine_requests(
+            corpus.storeDirectory, index
+        )
+    ),
+    "calculate_quaratine_requests_by_type": lambda corpus, index: (
+        _systemlink_storeandforward_inspector.calculate_quaratine_requests_by_type(
+            corpus.storeDirectory
+        )
+    ),
+}
+
+
+def measure(name: str, corpus: _corpus.Corpus) -> Dict[str, Any]:
+    """
+    Measure a calculation in the calling process.
+
+    :param name: The name of the calculation in :data:`CALCULATIONS`.
+    :param corpus: The generated store to run it on.
+    :return: The result of the calculation, the wall and CPU time in seconds and
+        syscalls of the first and second call, and the peak RSS in bytes.
+    """
+    calculation = CALCULATIONS[name]
+    index = _systemlink_storeandforward_inspector.BufferIndex()
+    measurement = {}
+    for run in ("cold", "warm"):
+        syscalls = _syscalls()
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        measurement["result"] = calculation(corpus, index)
+        measurement[run + "_wall"] = time.perf_counter() - wall
+        measurement[run + "_cpu"] = time.process_time() - cpu
+        if syscalls is not None:
+            measurement[run + "_syscalls"] = _syscalls() - syscalls
+    measurement["peak_rss"] = _peak_rss()
+    return measurement
+
+
+def _syscalls() -> Optional[int]:
+    if psutil is None:
+        return None
+    try:
+        counters = psutil.Process().io_counters()
+    except (AttributeError, psutil.Error):
+        return None
+    return counters.read_count + counters.write_count
+
+
+def _peak_rss() -> Optional[int]:
+    if sys.platform == "win32":
+        return psutil.Process().memory_info().peak_wset if psutil is not None else None
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB and macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _format(value: Optional[float], scale: float = 1, digits: int = 1) -> str:
+    return "n/a" if value is None else f"{value * scale:.{digits}f}"
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--buffers", type=int, default=10, help="number of transaction buffers")
+    parser.add_argument("--requests", type=int, default=10000, help="requests in each buffer")
+    parser.add_argument(
+        "--result-ratio", type=float, default=0.1, help="fraction of result requests"
+    )
+    parser.add_argument(
+        "--cache-position", type=float, default=0.5, help="fraction of requests forwarded"
+    )
+    parser.add_argument(
+        "--quarantine-buffers", type=int, default=1, help="number of quarantine buffers"
+    )
+    parser.add_argument(
+        "--quarantine-requests", type=int, default=10000, help="requests in each quarantine buffer"
+    )
+    parser.add_argument("--files", type=int, default=100, help="number of pending files")
+    parser.add_argument("--seed", type=int, default=0, help="seed for choosing request types")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as rootDirectory:
+        corpus = _corpus.generate_store(
+            rootDirectory,
+            buffers=args.buffers,
+            requestsPerBuffer=args.requests,
+            resultRatio=args.result_ratio,
+            cachePosition=args.cache_position,
+            quarantineBuffers=args.quarantine_buffers,
+            requestsPerQuarantineBuffer=args.quarantine_requests,
+            files=args.files,
+            seed=args.seed,
+        )
+        print(
+            f"{corpus.requests} requests in {args.buffers} buffers, "
+            f"{corpus.pendingResults + corpus.pendingSteps} pending, "
+            f"{corpus.quarantinedRequests} quarantined, {corpus.pendingFiles} files"
+        )
+        print(
+            f"{'':38} {'cold ms':>9} {'cpu ms':>9} {'syscalls':>9} "
+            f"{'warm ms':>9} {'cpu ms':>9} {'syscalls':>9} {'peak MiB':>9}"
+        )
+        context = multiprocessing.get_context("spawn")
+        for name in CALCULATIONS:
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                m = executor.submit(measure, name, corpus).result()
+            print(
+                f"{name:38} "
+                f"{_format(m['cold_wall'], 1000):>9} {_format(m['cold_cpu'], 1000):>9} "
+                f"{_format(m.get('cold_syscalls'), digits=0):>9} "
+                f"{_format(m['warm_wall'], 1000):>9} {_format(m['warm_cpu'], 1000):>9} "
+                f"{_format(m.get('warm_syscalls'), digits=0):>9} "
+                f"{_format(m['peak_rss'], 2**-20):>9}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Measure how parsing many transaction buffers scales with the number of worker processes.
+
+Run from the ``src`` directory, for example for 2000 buffers totalling 1 GiB::
+
+    python -m tests.benchmark.benchmark_parallel_scan --files 2000 --size-mib 1024
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from systemlink_storeandforward_beacon import _systemlink_storeandforward_inspector
+from tests.benchmark import _corpus
+
+
+def _measure(storeDirectory: str, workers: int) -> float:
+    index = _systemlink_storeandforward_inspector.BufferIndex()
+    if workers == 0:
+        start = time.perf_counter()
+        _systemlink_storeandforward_inspector.calculate_pending_requests(storeDirectory, index)
+        return time.perf_counter() - start
+
+    with _systemlink_storeandforward_inspector.create_scan_executor(workers) as executor:
+        # Start the worker processes before measuring.
+        list(executor.map(abs, range(workers)))
+        start = time.perf_counter()
+        _systemlink_storeandforward_inspector.calculate_pending_requests(
+            storeDirectory, index, executor
+        )
+        return time.perf_counter() - start
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mib", type=int, default=256, help="total size of the buffers")
+    parser.add_argument("--files", type=int, default=200, help="number of buffers")
+    parser.add_argument(
+        "--max-workers", type=int, default=os.cpu_count(), help="largest pool to measure"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as storeDirectory:
+        requests = _corpus.write_buffers(storeDirectory, args.size_mib * 2**20, args.files)
+        print(f"{requests} requests in {args.size_mib} MiB over {args.files} files")
+        serial = _measure(storeDirectory, 0)
+        print(f"{'serial':>10}: {serial:8.3f} s")
+        workers = 1
+        while workers <= args.max_workers:
+            elapsed = _measure(storeDirectory, workers)
+            print(
+                f"{workers:>3} worker{'s' if workers > 1 else ' '}: "
+                f"{elapsed:8.3f} s {serial / elapsed:6.2f}x"
+            )
+            workers *= 2
+
+
+if __name__ == "__main__":
+    main()
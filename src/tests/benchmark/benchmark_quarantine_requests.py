@@ -0,0 +1,76 @@
+"""
+Compare quarantine request counting throughput against the original implementation.
+
+Run from the ``src`` directory, for example to count a 4 GiB quarantine::
+
+    python -m tests.benchmark.benchmark_quarantine_requests --size-mib 4096
+"""
+
+import argparse
+import glob
+import json
+import os
+import tempfile
+import time
+
+from systemlink_storeandforward_beacon import _systemlink_storeandforward_inspector
+from tests.benchmark import _corpus
+
+
+def _legacy_calculate_quaratine_requests(storeDirectory: str) -> int:
+    # The implementation before requests were counted on the raw bytes: decode every
+    # line and parse it as JSON.
+    quarantined = 0
+    for path in glob.glob(os.path.join(storeDirectory, "quarantine", "*.jsonl")):
+        with open(
+            path, "r", encoding=_systemlink_storeandforward_inspector._TRANSACTION_ENCODING
+        ) as fp:
+            lines = fp.readlines()
+        quarantined += len(list(map(lambda line: json.loads(line), lines)))
+    return quarantined
+
+
+def _measure(name: str, function, storeDirectory: str, sizeInBytes: int, expected: int):
+    start = time.perf_counter()
+    result = function(storeDirectory)
+    elapsed = time.perf_counter() - start
+    assert result == expected, f"{name} counted {result} requests, expected {expected}"
+    print(f"{name:>12}: {elapsed:8.3f} s {sizeInBytes / elapsed / 2**20:10.1f} MiB/s")
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mib", type=int, default=256, help="total size of the quarantine")
+    parser.add_argument("--files", type=int, default=4, help="number of quarantine buffers")
+    parser.add_argument(
+        "--skip-legacy", action="store_true", help="only measure the current implementation"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as storeDirectory:
+        expected = _corpus.write_quarantine(storeDirectory, args.size_mib * 2**20, args.files)
+        sizeInBytes = sum(
+            os.path.getsize(p)
+            for p in glob.glob(os.path.join(storeDirectory, "quarantine", "*.jsonl"))
+        )
+        print(f"{expected} requests in {sizeInBytes / 2**20:.0f} MiB over {args.files} files")
+        if not args.skip_legacy:
+            _measure(
+                "legacy",
+                _legacy_calculate_quaratine_requests,
+                storeDirectory,
+                sizeInBytes,
+                expected,
+            )
+        _measure(
+            "mmap",
+            _systemlink_storeandforward_inspector.calculate_quaratine_requests,
+            storeDirectory,
+            sizeInBytes,
+            expected,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+End-to-end tests of the beacon against the stand-in Tags server.
+
+The beacon tests are skipped when the SystemLink SDK isn't installed. Run from the ``src``
+directory with::
+
+    python -m pytest tests/benchmark/test_beacon_end_to_end.py
+"""
+
+import asyncio
+import importlib.util
+import json
+from typing import Any, List, Tuple
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+import aiohttp  # noqa: E402, I100, I202
+
+from tests.benchmark import _corpus  # noqa: E402
+from tests.benchmark import benchmark_beacon  # noqa: E402
+from tests.benchmark._tag_server import TagServer  # noqa: E402
+
+requires_sdk = pytest.mark.skipif(
+    importlib.util.find_spec("systemlink") is None, reason="requires the SystemLink SDK"
+)
+
+
+def test_tagsAndValues_tagServer_recordsTagsAndValues():
+    tags = {"tags": [{"path": "minion.A", "type": "DOUBLE"}], "merge": False}
+    updates = [{"path": "minion.A", "updates": [{"value": {"type": "DOUBLE", "value": "1"}}]}]
+
+    with TagServer() as server:
+        statuses = _post(
+            server.url,
+            [
+                (TagServer.CREATE_OR_UPDATE_TAGS, tags),
+                (TagServer.UPDATE_CURRENT_VALUES, updates),
+                ("/nitag/v1", {}),
+            ],
+        )
+        statistics = server.statistics()
+
+    assert statuses == [200, 202, 404]
+    assert server.tags == {"minion.A": tags["tags"][0]}
+    assert server.values == {"minion.A": "1"}
+    assert statistics.requests == 3
+    assert statistics.unknownRequests == 1
+    assert statistics.values == 1
+    assert statistics.payloadBytes == len(json.dumps(tags)) + len(json.dumps(updates)) + len("{}")
+
+
+def test_errorRate_tagServer_failsRequestsWithoutRecordingThem():
+    updates = [{"path": "minion.A", "updates": [{"value": {"type": "DOUBLE", "value": "1"}}]}]
+
+    with TagServer(errorRate=1.0) as server:
+        statuses = _post(server.url, [(TagServer.UPDATE_CURRENT_VALUES, updates)] * 2)
+        statistics = server.statistics()
+
+    assert statuses == [503, 503]
+    assert server.values == {}
+    assert statistics.failures == 2
+    assert statistics.values == 0
+
+
+@requires_sdk
+def test_healthyServer_runBeacon_createsTagsAndWritesValues(tmp_path):
+    corpus = _corpus.generate_store(
+        benchmark_beacon.store_root(str(tmp_path)), buffers=2, requestsPerBuffer=200
+    )
+
+    measurement = benchmark_beacon.run(str(tmp_path), 3, {"slow_scan_wait": 10})
+
+    prefix = benchmark_beacon.GRAINS["id"] + ".TestMonitor.StoreAndForward."
+    assert sum(tick.failures + tick.unknownRequests for tick in measurement.ticks) == 0
+    assert set(measurement.values) == set(measurement.tags)
+    assert measurement.values[prefix + "ServiceStatus"] == "running"
+    assert measurement.values[prefix + "Pending.Results"] == str(corpus.pendingResults)
+    assert measurement.values[prefix + "Pending.Steps"] == str(corpus.pendingSteps)
+    assert measurement.ticks[-1].queuedTags == 0
+
+
+@requires_sdk
+def test_failingServer_runBeacon_retriesUntilWritten(tmp_path):
+    corpus = _corpus.generate_store(
+        benchmark_beacon.store_root(str(tmp_path)), buffers=2, requestsPerBuffer=200
+    )
+
+    measurement = benchmark_beacon.run(
+        str(tmp_path),
+        10,
+        {"slow_scan_wait": 10, "publish_retries": 3},
+        errorRate=0.3,
+        seed=0,
+    )
+
+    prefix = benchmark_beacon.GRAINS["id"] + ".TestMonitor.StoreAndForward."
+    assert sum(tick.failures for tick in measurement.ticks) > 0
+    assert measurement.values[prefix + "Pending.Results"] == str(corpus.pendingResults)
+    assert measurement.values[prefix + "Pending.Steps"] == str(corpus.pendingSteps)
+
+
+def _post(url: str, requests: List[Tuple[str, Any]]) -> List[int]:
+    async def post_all():
+        statuses = []
+        async with aiohttp.ClientSession() as session:
+            for path, body in requests:
+                async with session.post(url + path, data=json.dumps(body)) as response:
+                    statuses.append(response.status)
+        return statuses
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(post_all())
+    finally:
+        loop.close()
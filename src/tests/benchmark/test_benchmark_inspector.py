@@ -0,0 +1,61 @@
+"""
+Benchmarks of the inspector calculations for pytest-benchmark.
+
+Skipped when pytest-benchmark isn't installed. Run from the ``src`` directory with::
+
+    python -m pytest tests/benchmark --benchmark-only
+"""
+
+import pytest
+
+from systemlink_storeandforward_beacon import _systemlink_storeandforward_inspector
+from tests.benchmark import _corpus
+from tests.benchmark.benchmark_inspector import CALCULATIONS
+
+pytest.importorskip("pytest_benchmark")
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    return _corpus.generate_store(
+        str(tmp_path_factory.mktemp("store")),
+        buffers=10,
+        requestsPerBuffer=2000,
+        quarantineBuffers=2,
+        requestsPerQuarantineBuffer=2000,
+        files=50,
+    )
+
+
+def _expected(name: str, corpus: _corpus.Corpus):
+    if name == "calculate_pending_files":
+        return corpus.pendingFiles
+    if name == "calculate_pending_requests":
+        return (corpus.pendingResults, corpus.pendingSteps)
+    if name == "calculate_quaratine_requests":
+        return corpus.quarantinedRequests
+    return None
+
+
+@pytest.mark.parametrize("name", list(CALCULATIONS))
+def test_emptyIndex_calculate_benchmark(benchmark, corpus, name):
+    def run():
+        return CALCULATIONS[name](corpus, _systemlink_storeandforward_inspector.BufferIndex())
+
+    result = benchmark(run)
+
+    expected = _expected(name, corpus)
+    if expected is not None:
+        assert result == expected
+
+
+@pytest.mark.parametrize("name", list(CALCULATIONS))
+def test_unchangedStore_calculate_benchmark(benchmark, corpus, name):
+    index = _systemlink_storeandforward_inspector.BufferIndex()
+    CALCULATIONS[name](corpus, index)
+
+    result = benchmark(CALCULATIONS[name], corpus, index)
+
+    expected = _expected(name, corpus)
+    if expected is not None:
+        assert result == expected
@@ -1,9 +1,16 @@
-from datetime import datetime, timedelta
+import glob
 import json
 import os
+import shutil
 import tempfile
-from typing import List, Tuple
+import time
 import uuid
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+
+import dateutil.parser
+import pytest
 
 from systemlink_storeandforward_beacon import _systemlink_storeandforward_inspector
 
@@ -44,7 +51,7 @@ def test_someRequestsPending_calculatePendingRequestSize_returnsCountAndSize():
         _write_sample_transaction_buffer(tempDir, requests)
         _write_cache_file(tempDir, now)
 
-        (count, size) = _systemlink_storeandforward_inspector.calculate_pending_request_size(tempDir)
+        count, size = _systemlink_storeandforward_inspector.calculate_pending_request_size(tempDir)
 
         assert count == 1
         assert size > 0
@@ -117,6 +124,537 @@ def test_realRequestTransactionsBuffer_calculatePendingRequests_returnsPending()
     assert result == (3, 26)
 
 
+def test_requestsAppended_calculatePendingRequests_countsAppendedRequests():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        now = datetime.now()
+        bufferPath = _write_sample_transaction_buffer(
+            tempDir, [(now + timedelta(minutes=1), "ResultCreateRequest")]
+        )
+        _write_cache_file(tempDir, now)
+        first = _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+        offset = index.states[bufferPath].offset
+
+        _append_sample_transactions(bufferPath, [(now + timedelta(minutes=2), "StepCreateRequest")])
+        second = _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+
+        assert first == (1, 0)
+        assert second == (1, 1)
+        assert index.states[bufferPath].offset > offset
+
+
+def test_requestsAppended_calculatePendingRequests_countsOnlyAppendedBytesInStatistics():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        now = datetime.now()
+        bufferPath = _write_sample_transaction_buffer(
+            tempDir, [(now + timedelta(minutes=1), "ResultCreateRequest")]
+        )
+        _write_cache_file(tempDir, now)
+        _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+        firstSize = os.path.getsize(bufferPath)
+        first = index.statistics
+
+        index.statistics = _systemlink_storeandforward_inspector.ScanStatistics()
+        _append_sample_transactions(
+            bufferPath,
+            [
+                (now + timedelta(minutes=2), "StepCreateRequest"),
+                (now + timedelta(minutes=3), "StepUpdateRequest"),
+            ],
+        )
+        _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+        second = index.statistics
+
+        assert (first.filesScanned, first.bytesScanned, first.recordsParsed) == (1, firstSize, 1)
+        assert (second.filesScanned, second.bytesScanned, second.recordsParsed) == (
+            1,
+            os.path.getsize(bufferPath) - firstSize,
+            2,
+        )
+
+
+def test_twoStores_scanPendingRequests_countsEachStoreWithoutParsingAgain():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        now = datetime.now()
+        storeDirectories = [os.path.join(tempDir, "a"), os.path.join(tempDir, "b")]
+        for storeDirectory, types in zip(
+            storeDirectories, (["ResultCreateRequest"], ["StepCreateRequest", "StepUpdateRequest"])
+        ):
+            os.makedirs(storeDirectory)
+            _write_sample_transaction_buffer(
+                storeDirectory, [(now + timedelta(minutes=i + 1), t) for (i, t) in enumerate(types)]
+            )
+            _write_cache_file(storeDirectory, now)
+        snapshots = [
+            _systemlink_storeandforward_inspector.StoreSnapshot.take(d) for d in storeDirectories
+        ]
+
+        _systemlink_storeandforward_inspector.scan_pending_requests(snapshots, index)
+        scanned = index.statistics
+        index.statistics = _systemlink_storeandforward_inspector.ScanStatistics()
+        counts = [
+            _systemlink_storeandforward_inspector.calculate_pending_requests(s, index)
+            for s in snapshots
+        ]
+
+        assert counts == [(1, 0), (0, 2)]
+        assert scanned.recordsParsedByDirectory == {storeDirectories[0]: 1, storeDirectories[1]: 2}
+        assert index.statistics.filesScanned == 0
+
+
+def test_cacheTimestampMovesForward_calculatePendingRequests_usesIndexedTimestamps():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        now = datetime.now()
+        requests = [
+            (now + timedelta(minutes=1), "ResultCreateRequest"),
+            (now + timedelta(minutes=2), "StepCreateRequest"),
+            (now + timedelta(minutes=3), "StepUpdateRequest"),
+        ]
+        bufferPath = _write_sample_transaction_buffer(tempDir, requests)
+        _write_cache_file(tempDir, now)
+        first = _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+        state = index.states[bufferPath]
+
+        os.remove(os.path.join(tempDir, "__CACHE__"))
+        _write_cache_file(tempDir, now + timedelta(minutes=2))
+        second = _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+
+        assert first == (1, 2)
+        assert second == (0, 2)
+        assert index.states[bufferPath] is state
+
+
+def test_bufferTruncated_calculatePendingRequests_rescansBuffer():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        now = datetime.now()
+        requests = [
+            (now + timedelta(minutes=1), "ResultCreateRequest"),
+            (now + timedelta(minutes=2), "ResultUpdateRequest"),
+        ]
+        bufferPath = _write_sample_transaction_buffer(tempDir, requests)
+        _write_cache_file(tempDir, now)
+        first = _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+
+        with open(bufferPath, "w") as fp:
+            fp.write(_format_sample_transaction(now + timedelta(minutes=3), "StepCreateRequest"))
+        second = _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+
+        assert first == (2, 0)
+        assert second == (0, 1)
+
+
+def test_bufferReplacedWithSameSize_calculatePendingRequests_rescansBuffer():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        now = datetime.now()
+        bufferPath = _write_sample_transaction_buffer(
+            tempDir, [(now + timedelta(minutes=1), "ResultCreateRequest")]
+        )
+        _write_cache_file(tempDir, now)
+        first = _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+
+        replacementPath = bufferPath + ".tmp"
+        with open(replacementPath, "w") as fp:
+            fp.write(_format_sample_transaction(now + timedelta(minutes=1), "StepCreateRequest"))
+        os.replace(replacementPath, bufferPath)
+        second = _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+
+        assert first == (1, 0)
+        assert second == (0, 1)
+
+
+def test_partialLastLine_calculatePendingRequests_countsLineOnceComplete():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        now = datetime.now()
+        bufferPath = _write_sample_transaction_buffer(
+            tempDir, [(now + timedelta(minutes=1), "ResultCreateRequest")]
+        )
+        _write_cache_file(tempDir, now)
+        line = _format_sample_transaction(now + timedelta(minutes=2), "ResultUpdateRequest")
+        with open(bufferPath, "a") as fp:
+            fp.write(line[:10])
+        first = _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+
+        with open(bufferPath, "a") as fp:
+            fp.write(line[10:])
+        second = _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+
+        assert first == (1, 0)
+        assert second == (2, 0)
+
+
+def test_savedIndex_calculatePendingRequests_resumesFromSavedOffsets():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        storeDirectory = os.path.join(tempDir, "store")
+        indexPath = os.path.join(tempDir, "cache", "index")
+        os.makedirs(storeDirectory)
+        now = datetime.now()
+        bufferPath = _write_sample_transaction_buffer(
+            storeDirectory,
+            [
+                (now - timedelta(minutes=1), "ResultCreateRequest"),
+                (now + timedelta(minutes=1), "StepCreateRequest"),
+            ],
+        )
+        _write_cache_file(storeDirectory, now)
+        _systemlink_storeandforward_inspector.calculate_pending_requests(
+            storeDirectory, _systemlink_storeandforward_inspector.BufferIndex()
+        )
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        _systemlink_storeandforward_inspector.calculate_pending_requests(storeDirectory, index)
+        _systemlink_storeandforward_inspector.calculate_quaratine_requests(storeDirectory, index)
+        index.save(indexPath)
+        savedSize = os.path.getsize(bufferPath)
+
+        _append_sample_transactions(
+            bufferPath, [(now + timedelta(minutes=2), "ResultUpdateRequest")]
+        )
+        loaded = _systemlink_storeandforward_inspector.BufferIndex.load(indexPath)
+        result = _systemlink_storeandforward_inspector.calculate_pending_requests(
+            storeDirectory, loaded
+        )
+
+        assert result == (1, 1)
+        assert loaded.statistics.bytesScanned == os.path.getsize(bufferPath) - savedSize
+        assert os.listdir(os.path.dirname(indexPath)) == ["index"]
+
+
+def test_savedIndexOfRewrittenBuffer_calculatePendingRequests_rescansBuffer():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        indexPath = os.path.join(tempDir, "index")
+        storeDirectory = os.path.join(tempDir, "store")
+        os.makedirs(storeDirectory)
+        now = datetime.now()
+        bufferPath = _write_sample_transaction_buffer(
+            storeDirectory, [(now + timedelta(minutes=1), "StepCreateRequest")]
+        )
+        _write_cache_file(storeDirectory, now)
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        _systemlink_storeandforward_inspector.calculate_pending_requests(storeDirectory, index)
+        index.save(indexPath)
+
+        with open(bufferPath, "w") as fp:
+            fp.write(_format_sample_transaction(now + timedelta(minutes=1), "ResultCreateRequest"))
+            fp.write(_format_sample_transaction(now + timedelta(minutes=2), "ResultUpdateRequest"))
+        loaded = _systemlink_storeandforward_inspector.BufferIndex.load(indexPath)
+        result = _systemlink_storeandforward_inspector.calculate_pending_requests(
+            storeDirectory, loaded
+        )
+
+        assert result == (2, 0)
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        b"",
+        b"SystemLinkStoreAndForwardIndex\n{",
+        b"SystemLinkStoreAndForwardIndex\n{}\n",
+        b"not an index\n",
+    ],
+)
+def test_damagedIndexFile_load_returnsEmptyIndex(content):
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        indexPath = os.path.join(tempDir, "index")
+        with open(indexPath, "wb") as fp:
+            fp.write(content)
+
+        index = _systemlink_storeandforward_inspector.BufferIndex.load(indexPath)
+
+        assert index.states == {}
+        assert index.quarantineRecords == {}
+
+
+def test_indexWithCorruptedKeys_load_returnsEmptyIndex():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        indexPath = os.path.join(tempDir, "index")
+        bufferPath = _write_sample_transaction_buffer(
+            tempDir, [(datetime.now(), "StepCreateRequest")]
+        )
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        index.scan(
+            _systemlink_storeandforward_inspector.FileInfo.from_stat(
+                bufferPath, os.stat(bufferPath)
+            )
+        )
+        index.save(indexPath)
+        with open(indexPath, "r+b") as fp:
+            fp.seek(-1, os.SEEK_END)
+            last = fp.read(1)
+            fp.seek(-1, os.SEEK_END)
+            fp.write(bytes([last[0] ^ 0xFF]))
+
+        loaded = _systemlink_storeandforward_inspector.BufferIndex.load(indexPath)
+
+        assert len(index.states) == 1
+        assert loaded.states == {}
+
+
+def test_missingIndexFile_load_returnsEmptyIndex():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        index = _systemlink_storeandforward_inspector.BufferIndex.load(
+            os.path.join(tempDir, "index")
+        )
+
+        assert index.states == {}
+
+
+def test_bufferDeleted_calculatePendingRequests_forgetsBuffer():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        now = datetime.now()
+        bufferPath = _write_sample_transaction_buffer(
+            tempDir, [(now + timedelta(minutes=1), "ResultCreateRequest")]
+        )
+        _write_cache_file(tempDir, now)
+        _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+
+        os.remove(bufferPath)
+        result = _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+
+        assert result == (0, 0)
+        assert bufferPath not in index.states
+
+
+def test_smallReadChunks_calculatePendingRequests_returnsPending(monkeypatch):
+    monkeypatch.setattr(_systemlink_storeandforward_inspector, "_CHUNK_SIZE", 7)
+    storeDirectory = os.path.join(os.path.dirname(__file__), "testmon")
+    result = _systemlink_storeandforward_inspector.calculate_pending_requests(
+        storeDirectory, _systemlink_storeandforward_inspector.BufferIndex()
+    )
+
+    assert result == (3, 26)
+
+
+def test_requestsWithNestedProperties_calculatePendingRequests_usesRequestProperties():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        now = datetime.now()
+        past = datetime.isoformat(now - timedelta(minutes=1))
+        future = datetime.isoformat(now + timedelta(minutes=1))
+        lines = [
+            json.dumps(
+                {
+                    "data": {"timestamp": future, "type": "StepCreateRequest"},
+                    "timestamp": past,
+                    "type": "X",
+                }
+            ),
+            json.dumps(
+                {"type": "ResultCreateRequest", "timestamp": future, "data": {"timestamp": past}}
+            ),
+        ]
+        with open(os.path.join(tempDir, str(uuid.uuid1()) + ".jsonl"), "x") as fp:
+            fp.write("\n".join(lines) + "\n")
+        _write_cache_file(tempDir, now)
+
+        result = _systemlink_storeandforward_inspector.calculate_pending_requests(
+            tempDir, _systemlink_storeandforward_inspector.BufferIndex()
+        )
+
+        assert result == (1, 0)
+
+
+def test_manyBuffers_calculatePendingRequestsInParallel_returnsSameAsSerial(monkeypatch):
+    monkeypatch.setattr(_systemlink_storeandforward_inspector, "_PARALLEL_SCAN_MIN_BYTES", 0)
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        sampleDirectory = os.path.join(os.path.dirname(__file__), "testmon")
+        for name in ["__CACHE__", "8536b793-cade-4ef4-92dd-083cc04d214f.jsonl"]:
+            shutil.copy(os.path.join(sampleDirectory, name), tempDir)
+        for i in range(3):
+            shutil.copy(
+                os.path.join(sampleDirectory, "8536b793-cade-4ef4-92dd-083cc04d214f.jsonl"),
+                os.path.join(tempDir, f"{i}.jsonl"),
+            )
+
+        with _systemlink_storeandforward_inspector.create_scan_executor(2) as executor:
+            parallel = _systemlink_storeandforward_inspector.calculate_pending_requests(
+                tempDir, _systemlink_storeandforward_inspector.BufferIndex(), executor
+            )
+        serial = _systemlink_storeandforward_inspector.calculate_pending_requests(
+            tempDir, _systemlink_storeandforward_inspector.BufferIndex()
+        )
+
+        assert parallel == (12, 104)
+        assert parallel == serial
+
+
+@pytest.mark.parametrize("warmIndex", [False, True])
+@pytest.mark.parametrize("processed", [0, 1, 499, 998, 999])
+def test_sortedBuffers_calculateOldestPendingAge_returnsAgeOfFirstPendingRequest(
+    warmIndex, processed
+):
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        start = datetime(2022, 3, 10, tzinfo=timezone.utc)
+        timestamps = [start + timedelta(seconds=i) for i in range(1000)]
+        types = [
+            "ResultCreateRequest",
+            "StepCreateRequest",
+            "StepUpdateRequest",
+            "ResultUpdateRequest",
+        ]
+        requests = [(t, types[i % len(types)]) for (i, t) in enumerate(timestamps)]
+        _write_sample_transaction_buffer(tempDir, requests[:300])
+        _write_sample_transaction_buffer(tempDir, requests[300:])
+        _write_cache_file(tempDir, timestamps[processed] - timedelta(milliseconds=1))
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        if warmIndex:
+            _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+        now = timestamps[-1].timestamp() + 60
+
+        result = _systemlink_storeandforward_inspector.calculate_oldest_pending_age(
+            tempDir, index, now
+        )
+
+        assert result == pytest.approx(now - timestamps[processed].timestamp())
+        assert bool(index.states) == warmIndex
+
+
+def test_noPendingRequests_calculateOldestPendingAge_returnsNone():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        now = datetime.now()
+        _write_sample_transaction_buffer(
+            tempDir, [(now - timedelta(minutes=1), "StepCreateRequest")]
+        )
+        _write_cache_file(tempDir, now)
+
+        result = _systemlink_storeandforward_inspector.calculate_oldest_pending_age(
+            tempDir, _systemlink_storeandforward_inspector.BufferIndex()
+        )
+
+        assert result is None
+
+
+def test_bufferModifiedBeforeLastProcessed_calculateOldestPendingAge_skipsBuffer():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        now = datetime.now(timezone.utc)
+        bufferPath = _write_sample_transaction_buffer(
+            tempDir, [(now + timedelta(minutes=1), "StepCreateRequest")]
+        )
+        lastWritten = (now - timedelta(minutes=2)).timestamp()
+        os.utime(bufferPath, (lastWritten, lastWritten))
+        _write_cache_file(tempDir, now)
+
+        result = _systemlink_storeandforward_inspector.calculate_oldest_pending_age(
+            tempDir, _systemlink_storeandforward_inspector.BufferIndex()
+        )
+
+        assert result is None
+
+
+def test_mixOfRequestTypes_calculatePendingBreakdown_countsEveryTypeAndBuffer():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        now = datetime.now()
+        buffer1 = _write_sample_transaction_buffer(
+            tempDir,
+            [
+                (now - timedelta(minutes=1), "ResultCreateRequest"),
+                (now + timedelta(minutes=1), "ResultCreateRequest"),
+                (now + timedelta(minutes=2), "FileUploadRequest"),
+            ],
+        )
+        buffer2 = _write_sample_transaction_buffer(
+            tempDir,
+            [
+                (now + timedelta(minutes=3), "StepCreateRequest"),
+                (now + timedelta(minutes=4), "StepUpdateRequest"),
+            ],
+        )
+        _write_cache_file(tempDir, now)
+        classifier = _systemlink_storeandforward_inspector.TransactionClassifier(
+            {
+                "creates": ["ResultCreateRequest", "StepCreateRequest"],
+                "updates": ["StepUpdateRequest"],
+            }
+        )
+
+        result = _systemlink_storeandforward_inspector.calculate_pending_breakdown(
+            tempDir, _systemlink_storeandforward_inspector.BufferIndex(), classifier=classifier
+        )
+
+        assert result.byType == {
+            "ResultCreateRequest": 1,
+            "FileUploadRequest": 1,
+            "StepCreateRequest": 1,
+            "StepUpdateRequest": 1,
+        }
+        assert result.byCategory == {"creates": 2, "updates": 1}
+        assert result.byBuffer == {
+            buffer1: (os.path.getsize(buffer1), {"ResultCreateRequest": 1, "FileUploadRequest": 1}),
+            buffer2: (os.path.getsize(buffer2), {"StepCreateRequest": 1, "StepUpdateRequest": 1}),
+        }
+        assert result.byGroup == {}
+
+
+def test_indexGroupingByProperties_calculatePendingBreakdown_countsEachGroup():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        now = datetime.now()
+        lines = [
+            {
+                "data": {"workspace": "ws1", "programName": "a.seq"},
+                "timestamp": now + timedelta(minutes=1),
+            },
+            {
+                "data": {"workspace": "ws1", "programName": "b.seq"},
+                "timestamp": now + timedelta(minutes=2),
+            },
+            {
+                "data": {"workspace": "ws1", "programName": "b.seq"},
+                "timestamp": now + timedelta(minutes=3),
+            },
+            {
+                "data": {"workspace": "ws2", "programName": "a.seq"},
+                "timestamp": now - timedelta(minutes=1),
+            },
+        ]
+        with open(os.path.join(tempDir, "buffer.jsonl"), "w") as fp:
+            for line in lines:
+                line["timestamp"] = line["timestamp"].isoformat()
+                line["type"] = "ResultCreateRequest"
+                fp.write(json.dumps(line, separators=(",", ":")) + "\n")
+            fp.write(_format_sample_transaction(now + timedelta(minutes=4), "StepCreateRequest"))
+        _write_cache_file(tempDir, now)
+        index = _systemlink_storeandforward_inspector.BufferIndex(["workspace", "programName"])
+
+        result = _systemlink_storeandforward_inspector.calculate_pending_breakdown(tempDir, index)
+        pending = _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+
+        assert result.byGroup == {
+            ("ws1", "a.seq"): {"ResultCreateRequest": 1},
+            ("ws1", "b.seq"): {"ResultCreateRequest": 2},
+            ("", ""): {"StepCreateRequest": 1},
+        }
+        assert result.byCategory == {"results": 3, "steps": 1}
+        assert pending == (3, 1)
+
+
+def test_indexSavedWithOtherGrouping_load_returnsEmptyIndex():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        indexPath = os.path.join(tempDir, "index")
+        bufferPath = _write_sample_transaction_buffer(
+            tempDir, [(datetime.now(), "StepCreateRequest")]
+        )
+        index = _systemlink_storeandforward_inspector.BufferIndex(["workspace"])
+        index.scan(
+            _systemlink_storeandforward_inspector.FileInfo.from_stat(
+                bufferPath, os.stat(bufferPath)
+            )
+        )
+        index.save(indexPath)
+
+        sameGrouping = _systemlink_storeandforward_inspector.BufferIndex.load(
+            indexPath, ["workspace"]
+        )
+        otherGrouping = _systemlink_storeandforward_inspector.BufferIndex.load(indexPath)
+
+        assert len(sameGrouping.states) == 1
+        assert otherGrouping.states == {}
+
+
 def test_missingQuarantineDirectory_calculateQuaratineSize_returnsZero():
     with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
         result = _systemlink_storeandforward_inspector.calculate_quaratine_size(tempDir)
@@ -183,23 +721,834 @@ def test_realRequestTransactionsBuffer_calculateQuaratineRequests_returnsQuarant
     assert result == 62
 
 
+def test_lastLineWithoutNewline_calculateQuaratineRequests_countsLastLine():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        quarantineDirectory = os.path.join(tempDir, "quarantine")
+        os.mkdir(quarantineDirectory)
+        now = datetime.now()
+        with open(os.path.join(quarantineDirectory, str(uuid.uuid1()) + ".jsonl"), "x") as fp:
+            fp.write(_format_sample_transaction(now, "ResultCreateRequest"))
+            fp.write(_format_sample_transaction(now, "ResultUpdateRequest").rstrip("\n"))
+
+        result = _systemlink_storeandforward_inspector.calculate_quaratine_requests(tempDir)
+
+        assert result == 2
+
+
+def test_emptyQuarantineBuffer_calculateQuaratineRequests_returnsZero():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        quarantineDirectory = os.path.join(tempDir, "quarantine")
+        os.mkdir(quarantineDirectory)
+        _write_sample_transaction_buffer(quarantineDirectory, [])
+
+        result = _systemlink_storeandforward_inspector.calculate_quaratine_requests(tempDir)
+
+        assert result == 0
+
+
+def test_realRequestTransactionsBuffer_calculateQuaratineRequestsByType_returnsQuarantinedByType():
+    storeDirectory = os.path.join(os.path.dirname(__file__), "testmon")
+    result = _systemlink_storeandforward_inspector.calculate_quaratine_requests_by_type(
+        storeDirectory
+    )
+
+    assert result == {
+        "ResultCreateRequest": 3,
+        "ResultUpdateRequest": 3,
+        "StepCreateRequest": 46,
+        "StepUpdateRequest": 10,
+    }
+
+
+@pytest.mark.parametrize("chunkSize", [7, 64, 1024 * 1024])
+def test_requestsAcrossChunks_calculateQuaratineRequestsByType_countsEachRequestOnce(
+    monkeypatch, chunkSize
+):
+    monkeypatch.setattr(_systemlink_storeandforward_inspector, "_CHUNK_SIZE", chunkSize)
+    storeDirectory = os.path.join(os.path.dirname(__file__), "testmon")
+
+    result = _systemlink_storeandforward_inspector.calculate_quaratine_requests_by_type(
+        storeDirectory
+    )
+    (records,) = [
+        _systemlink_storeandforward_inspector._count_records(path)
+        for path in _systemlink_storeandforward_inspector.StoreSnapshot.take(
+            storeDirectory
+        ).quarantine.paths
+    ]
+
+    assert sum(result.values()) == records == 62
+    assert result["StepCreateRequest"] == 46
+
+
+def test_realRequestTransactionsBuffer_storeSnapshot_listsStoreDirectories():
+    storeDirectory = os.path.join(os.path.dirname(__file__), "testmon")
+    snapshot = _systemlink_storeandforward_inspector.StoreSnapshot.take(storeDirectory)
+
+    assert [os.path.basename(p) for p in snapshot.buffers.paths] == [
+        "8536b793-cade-4ef4-92dd-083cc04d214f.jsonl"
+    ]
+    assert [os.path.basename(p) for p in snapshot.quarantine.paths] == [
+        "7e0d7780-aa48-45b5-8944-adb754c12583.jsonl"
+    ]
+    assert snapshot.cacheFile.path == os.path.join(storeDirectory, "__CACHE__")
+    assert not snapshot.files.exists
+
+
+def test_storeSnapshot_calculateSizes_doesNotListOrStatAgain(monkeypatch):
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        storeDirectory = os.path.join(tempDir, "testmon")
+        fileStoreDirectory = os.path.join(tempDir, "file")
+        os.makedirs(os.path.join(storeDirectory, "quarantine"))
+        os.mkdir(fileStoreDirectory)
+        now = datetime.now()
+        _write_sample_transaction_buffer(storeDirectory, [(now, "ResultCreateRequest")])
+        _write_sample_transaction_buffer(
+            os.path.join(storeDirectory, "quarantine"), [(now, "StepCreateRequest")]
+        )
+        _write_sample_pending_file(fileStoreDirectory)
+        snapshot = _systemlink_storeandforward_inspector.StoreSnapshot.take(
+            storeDirectory, fileStoreDirectory
+        )
+
+        def fail(*args, **kwargs):
+            raise AssertionError("The directories should not be read again")
+
+        monkeypatch.setattr(os, "scandir", fail)
+        monkeypatch.setattr(os, "stat", fail)
+        pendingSize = _systemlink_storeandforward_inspector.calculate_pending_request_size(snapshot)
+        quarantineSize = _systemlink_storeandforward_inspector.calculate_quaratine_size(snapshot)
+        pendingFiles = _systemlink_storeandforward_inspector.calculate_pending_files(snapshot)
+        monkeypatch.undo()
+
+        assert pendingSize == (1, 1)
+        assert quarantineSize == (1, 1)
+        assert pendingFiles == 1
+
+
+def test_storeSnapshot_calculatePendingRequests_returnsPending():
+    storeDirectory = os.path.join(os.path.dirname(__file__), "testmon")
+    snapshot = _systemlink_storeandforward_inspector.StoreSnapshot.take(storeDirectory)
+
+    result = _systemlink_storeandforward_inspector.calculate_pending_requests(
+        snapshot, _systemlink_storeandforward_inspector.BufferIndex()
+    )
+
+    assert result == (3, 26)
+
+
+def test_unchangedSnapshot_calculatePendingRequests_returnsCachedResult(monkeypatch):
+    storeDirectory = os.path.join(os.path.dirname(__file__), "testmon")
+    index = _systemlink_storeandforward_inspector.BufferIndex()
+    first = _systemlink_storeandforward_inspector.calculate_pending_requests(
+        _systemlink_storeandforward_inspector.StoreSnapshot.take(storeDirectory), index
+    )
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The store should not be read again")
+
+    monkeypatch.setattr(
+        _systemlink_storeandforward_inspector, "_read_last_processed_timestamp", fail
+    )
+    second = _systemlink_storeandforward_inspector.calculate_pending_requests(
+        _systemlink_storeandforward_inspector.StoreSnapshot.take(storeDirectory), index
+    )
+
+    assert first == (3, 26)
+    assert second == first
+
+
+def test_unchangedQuarantine_calculateQuaratineRequests_doesNotCountAgain(monkeypatch):
+    storeDirectory = os.path.join(os.path.dirname(__file__), "testmon")
+    index = _systemlink_storeandforward_inspector.BufferIndex()
+    first = _systemlink_storeandforward_inspector.calculate_quaratine_requests(
+        storeDirectory, index
+    )
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The quarantine should not be read again")
+
+    monkeypatch.setattr(_systemlink_storeandforward_inspector, "_count_records", fail)
+    second = _systemlink_storeandforward_inspector.calculate_quaratine_requests(
+        storeDirectory, index
+    )
+
+    assert first == 62
+    assert second == 62
+
+
+def test_nothingChanged_storeWatcherSnapshot_reusesSnapshot():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        _write_sample_transaction_buffer(tempDir, [(datetime.now(), "ResultCreateRequest")])
+        watcher = _systemlink_storeandforward_inspector.StoreWatcher(tempDir, watch=False)
+
+        first = watcher.snapshot()
+        second = watcher.snapshot()
+
+        assert second is first
+
+
+def test_bufferAppended_storeWatcherSnapshot_takesNewSnapshot():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        bufferPath = _write_sample_transaction_buffer(
+            tempDir, [(datetime.now(), "ResultCreateRequest")]
+        )
+        watcher = _systemlink_storeandforward_inspector.StoreWatcher(tempDir, watch=False)
+
+        first = watcher.snapshot()
+        _append_sample_transactions(bufferPath, [(datetime.now(), "ResultUpdateRequest")])
+        second = watcher.snapshot()
+
+        assert second is not first
+        assert second.buffers.files[0].size > first.buffers.files[0].size
+
+
+def test_watchedDirectory_storeWatcherSnapshot_takesNewSnapshotOnlyAfterChange():
+    pytest.importorskip("watchdog")
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        bufferPath = _write_sample_transaction_buffer(
+            tempDir, [(datetime.now(), "ResultCreateRequest")]
+        )
+        watcher = _systemlink_storeandforward_inspector.StoreWatcher(tempDir)
+        try:
+            first = watcher.snapshot()
+            watching = watcher.watching
+            second = watcher.snapshot()
+            _append_sample_transactions(bufferPath, [(datetime.now(), "ResultUpdateRequest")])
+            deadline = time.monotonic() + 5
+            third = watcher.snapshot()
+            while third is first and time.monotonic() < deadline:
+                time.sleep(0.05)
+                third = watcher.snapshot()
+        finally:
+            watcher.stop()
+
+        assert watching
+        assert second is first
+        assert third is not first
+
+
+def test_storeFilesRead_storeWatcherSnapshot_reusesSnapshotWithoutListing(monkeypatch):
+    pytest.importorskip("watchdog")
+    take = _systemlink_storeandforward_inspector.StoreSnapshot.take
+    listings = []
+
+    def counting_take(*args):
+        listings.append(args)
+        return take(*args)
+
+    monkeypatch.setattr(_systemlink_storeandforward_inspector.StoreSnapshot, "take", counting_take)
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        bufferPath = _write_sample_transaction_buffer(
+            tempDir, [(datetime.now(), "ResultCreateRequest")]
+        )
+        _write_cache_file(tempDir, datetime.now())
+        watcher = _systemlink_storeandforward_inspector.StoreWatcher(tempDir)
+        try:
+            first = watcher.snapshot()
+            watching = watcher.watching
+            for path in (bufferPath, os.path.join(tempDir, "__CACHE__")):
+                with open(path) as fp:
+                    fp.read()
+            time.sleep(0.5)
+            second = watcher.snapshot()
+        finally:
+            watcher.stop()
+
+        assert watching
+        assert second is first
+        assert len(listings) == 1
+
+
+@pytest.mark.parametrize(
+    "timestamp",
+    [
+        "2022-03-10T21:47:55.789362Z",
+        "2022-03-10T21:47:55Z",
+        "2022-03-10T21:47:55.7Z",
+        "2022-03-10T21:47:55.699Z",
+        "2022-03-10T21:47:55.6990000Z",
+        "2022-03-10T21:47:55.9999999Z",
+        "2022-03-10T21:47:55.789362",
+        "2022-03-10T21:47:55.789362+05:30",
+        "2022-03-10T21:47:55.789362-08:00",
+        "2022-03-10T21:47:55.789362+00:00",
+        "2022-03-10T21:47:55.789362+0530",
+        "2022-03-10T24:00:00Z",
+        "2022-03-10 21:47:55",
+        "20220310T214755Z",
+        "2022-03-10",
+        "1969-12-31T23:59:59.999999Z",
+        "2024-02-29T12:00:00.000001Z",
+    ],
+)
+def test_timestamp_parseTimestampKey_matchesIsoparse(timestamp):
+    expected = dateutil.parser.isoparse(timestamp)
+    if expected.tzinfo is None:
+        expected = expected.replace(tzinfo=timezone.utc)
+    expectedKey = (expected - datetime(1970, 1, 1, tzinfo=timezone.utc)) // timedelta(
+        microseconds=1
+    )
+
+    result = _systemlink_storeandforward_inspector._parse_timestamp_key(timestamp)
+
+    assert result == expectedKey
+
+
+@pytest.mark.parametrize(
+    "earlier,later",
+    [
+        # Offsets are compared by instant, not by wall clock time.
+        ("2022-03-10T21:00:00+05:30", "2022-03-10T16:00:00Z"),
+        ("2022-03-10T15:59:59.999999Z", "2022-03-10T21:30:00+05:30"),
+        # US spring forward: 01:59:59.999999 PST is one microsecond before 03:00:00 PDT.
+        ("2022-03-13T01:59:59.999999-08:00", "2022-03-13T03:00:00-07:00"),
+        # US fall back: 01:30 PDT happens before 01:00 PST.
+        ("2022-11-06T01:30:00-07:00", "2022-11-06T01:00:00-08:00"),
+        # Timestamps without an offset are ordered by wall clock time.
+        ("2022-11-06T01:30:00", "2022-11-06T01:30:00.000001"),
+        ("2022-03-10T21:47:55.1Z", "2022-03-10T21:47:55.10001Z"),
+        ("2022-12-31T23:59:59.999999Z", "2023-01-01T00:00:00Z"),
+    ],
+)
+def test_orderedTimestamps_parseTimestampKey_keepsOrder(earlier, later):
+    earlierKey = _systemlink_storeandforward_inspector._parse_timestamp_key(earlier)
+    laterKey = _systemlink_storeandforward_inspector._parse_timestamp_key(later)
+
+    assert earlierKey < laterKey
+
+
+@pytest.mark.parametrize(
+    "timestamp",
+    [
+        "2022-02-30T00:00:00.000000Z",
+        "2022-03-10T21:60:00.000000Z",
+        "2022-03-10T25:00:00Z",
+        "not a timestamp",
+    ],
+)
+def test_invalidTimestamp_parseTimestampKey_raisesValueError(timestamp):
+    with pytest.raises(ValueError):
+        _systemlink_storeandforward_inspector._parse_timestamp_key(timestamp)
+
+
+def test_pendingFiles_calculatePendingFileAnalysis_returnsSizesAndAges():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        paths = []
+        for size, age in [(10, 60), (100 * 1024, 3600), (2 * 1024 * 1024, 600)]:
+            path = os.path.join(tempDir, str(uuid.uuid1()) + ".file")
+            with open(path, "wb") as fp:
+                fp.truncate(size)
+            os.utime(path, (time.time() - age, time.time() - age))
+            paths.append(path)
+
+        analysis = _systemlink_storeandforward_inspector.calculate_pending_file_analysis(tempDir)
+
+        assert analysis.files == 3
+        assert analysis.totalBytes == 10 + 100 * 1024 + 2 * 1024 * 1024
+        assert analysis.largest.path == paths[2]
+        assert analysis.oldest.path == paths[1]
+        assert analysis.sizeHistogram == [1, 1, 1, 0, 0, 0]
+
+
+def test_noPendingFiles_calculatePendingFileAnalysis_returnsEmptyAnalysis():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        analysis = _systemlink_storeandforward_inspector.calculate_pending_file_analysis(tempDir)
+
+        assert analysis == (0, 0, None, None, [0, 0, 0, 0, 0, 0])
+
+
+def test_fileStoreUnchanged_storeSnapshotTake_reusesFileListing(monkeypatch):
+    storeDirectory = os.path.join(os.path.dirname(__file__), "testmon")
+    with tempfile.TemporaryDirectory(prefix="test_") as fileStoreDirectory:
+        _write_sample_pending_file(fileStoreDirectory)
+        os.utime(fileStoreDirectory, (time.time() - 60, time.time() - 60))
+        first = _systemlink_storeandforward_inspector.StoreSnapshot.take(
+            storeDirectory, fileStoreDirectory
+        )
+        firstAnalysis = _systemlink_storeandforward_inspector.calculate_pending_file_analysis(first)
+        scandir = os.scandir
+
+        def scandir_store_only(path):
+            assert path != fileStoreDirectory, "The file store should not be listed again"
+            return scandir(path)
+
+        monkeypatch.setattr(os, "scandir", scandir_store_only)
+        second = _systemlink_storeandforward_inspector.StoreSnapshot.take(
+            storeDirectory, fileStoreDirectory, first
+        )
+
+        assert second.files is first.files
+        assert (
+            _systemlink_storeandforward_inspector.calculate_pending_file_analysis(second)
+            is firstAnalysis
+        )
+
+
+def test_fileWrittenTo_storeSnapshotTake_updatesFileWithoutListing(monkeypatch):
+    storeDirectory = os.path.join(os.path.dirname(__file__), "testmon")
+    with tempfile.TemporaryDirectory(prefix="test_") as fileStoreDirectory:
+        _write_sample_pending_file(fileStoreDirectory)
+        os.utime(fileStoreDirectory, (time.time() - 60, time.time() - 60))
+        first = _systemlink_storeandforward_inspector.StoreSnapshot.take(
+            storeDirectory, fileStoreDirectory
+        )
+        path = first.files.files[0].path
+        os.utime(path, (time.time() - 60, time.time() - 60))
+        with open(path, "a") as fp:
+            fp.write("more")
+        scandir = os.scandir
+
+        def scandir_store_only(path):
+            assert path != fileStoreDirectory, "The file store should not be listed again"
+            return scandir(path)
+
+        monkeypatch.setattr(os, "scandir", scandir_store_only)
+        second = _systemlink_storeandforward_inspector.StoreSnapshot.take(
+            storeDirectory, fileStoreDirectory, first
+        )
+
+        assert second.files.files[0].size == first.files.files[0].size + 4
+        assert second.files.files[0].mtime > first.files.files[0].mtime
+        assert (
+            _systemlink_storeandforward_inspector.calculate_pending_file_analysis(second).totalBytes
+            == 9
+        )
+
+
+def test_fileWrittenLongAgo_storeSnapshotTake_reusesFileWithoutStat(monkeypatch):
+    storeDirectory = os.path.join(os.path.dirname(__file__), "testmon")
+    with tempfile.TemporaryDirectory(prefix="test_") as fileStoreDirectory:
+        _write_sample_pending_file(fileStoreDirectory)
+        (path,) = glob.glob(os.path.join(fileStoreDirectory, "*.file"))
+        os.utime(path, (time.time() - 60, time.time() - 60))
+        os.utime(fileStoreDirectory, (time.time() - 60, time.time() - 60))
+        first = _systemlink_storeandforward_inspector.StoreSnapshot.take(
+            storeDirectory, fileStoreDirectory
+        )
+        stat = os.stat
+
+        def stat_directories_only(path, *args, **kwargs):
+            assert not str(path).endswith(
+                ".file"
+            ), "Files written long ago should not be stat-ed again"
+            return stat(path, *args, **kwargs)
+
+        monkeypatch.setattr(os, "stat", stat_directories_only)
+        second = _systemlink_storeandforward_inspector.StoreSnapshot.take(
+            storeDirectory, fileStoreDirectory, first
+        )
+
+        assert second.files is first.files
+
+
+def test_fileAdded_storeSnapshotTake_listsFileStoreAgain():
+    storeDirectory = os.path.join(os.path.dirname(__file__), "testmon")
+    with tempfile.TemporaryDirectory(prefix="test_") as fileStoreDirectory:
+        _write_sample_pending_file(fileStoreDirectory)
+        os.utime(fileStoreDirectory, (time.time() - 60, time.time() - 60))
+        first = _systemlink_storeandforward_inspector.StoreSnapshot.take(
+            storeDirectory, fileStoreDirectory
+        )
+
+        _write_sample_pending_file(fileStoreDirectory)
+        second = _systemlink_storeandforward_inspector.StoreSnapshot.take(
+            storeDirectory, fileStoreDirectory, first
+        )
+
+        assert len(first.files.files) == 1
+        assert len(second.files.files) == 2
+
+
+def test_fileAddedRecently_storeSnapshotTake_listsFileStoreAgain():
+    storeDirectory = os.path.join(os.path.dirname(__file__), "testmon")
+    with tempfile.TemporaryDirectory(prefix="test_") as fileStoreDirectory:
+        _write_sample_pending_file(fileStoreDirectory)
+        first = _systemlink_storeandforward_inspector.StoreSnapshot.take(
+            storeDirectory, fileStoreDirectory
+        )
+
+        second = _systemlink_storeandforward_inspector.StoreSnapshot.take(
+            storeDirectory, fileStoreDirectory, first
+        )
+
+        assert second.files is not first.files
+
+
+def test_largeBuffer_estimatePendingRequests_estimatesWithinErrorBound():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        results, steps = _write_large_store(tempDir)
+        estimator = _systemlink_storeandforward_inspector.PendingEstimator(
+            minimumBytes=0, samples=16, sampleBytes=4096, seed=0
+        )
+
+        estimate = _systemlink_storeandforward_inspector.estimate_pending_requests(
+            tempDir, _systemlink_storeandforward_inspector.BufferIndex(), estimator=estimator
+        )
+
+        assert not estimate.exact
+        assert 0 < estimate.resultsError < results / 2
+        assert abs(estimate.results - results) <= estimate.resultsError
+        assert abs(estimate.steps - steps) <= estimate.stepsError
+
+
+def test_smallBuffer_estimatePendingRequests_countsExactly():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        results, steps = _write_large_store(tempDir)
+        estimator = _systemlink_storeandforward_inspector.PendingEstimator(minimumBytes=1024 * 1024)
+
+        estimate = _systemlink_storeandforward_inspector.estimate_pending_requests(
+            tempDir, _systemlink_storeandforward_inspector.BufferIndex(), estimator=estimator
+        )
+
+        assert estimate == (results, steps, 0, 0, True)
+
+
+def test_reconcileDue_estimatePendingRequests_countsExactlyAndIndexes():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        results, steps = _write_large_store(tempDir)
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        estimator = _systemlink_storeandforward_inspector.PendingEstimator(
+            minimumBytes=0, samples=16, sampleBytes=4096, reconcileInterval=0, seed=0
+        )
+
+        first = _systemlink_storeandforward_inspector.estimate_pending_requests(
+            tempDir, index, estimator=estimator
+        )
+        second = _systemlink_storeandforward_inspector.estimate_pending_requests(
+            tempDir, index, estimator=estimator
+        )
+
+        assert not first.exact
+        assert second == (results, steps, 0, 0, True)
+        assert index.statistics.recordsParsed == 6000
+
+
+def test_byteBudget_estimatePendingRequests_returnsOnlyCompleteCounts():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        results, steps = _write_large_store(tempDir)
+        bufferPath = _systemlink_storeandforward_inspector.StoreSnapshot.take(
+            tempDir
+        ).buffers.paths[0]
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        index.budget = _systemlink_storeandforward_inspector.ScanBudget(
+            maxBytes=os.path.getsize(bufferPath) // 3
+        )
+        estimator = _systemlink_storeandforward_inspector.PendingEstimator(minimumBytes=1024 * 1024)
+
+        estimates = []
+        for _ in range(4):
+            index.budget.start()
+            estimates.append(
+                _systemlink_storeandforward_inspector.estimate_pending_requests(
+                    tempDir, index, estimator=estimator
+                )
+            )
+        _append_sample_transactions(
+            bufferPath, [(datetime(2021, 1, 2, tzinfo=timezone.utc), "ResultCreateRequest")] * 3000
+        )
+        index.budget.start()
+        estimates.append(
+            _systemlink_storeandforward_inspector.estimate_pending_requests(
+                tempDir, index, estimator=estimator
+            )
+        )
+
+        assert estimates[:3] == [None, None, None]
+        assert estimates[3] == (results, steps, 0, 0, True)
+        assert estimates[4] == estimates[3]
+
+
+def test_byteBudget_calculatePendingRequests_resumesOnLaterRuns():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        results, steps = _write_large_store(tempDir)
+        size = os.path.getsize(
+            _systemlink_storeandforward_inspector.StoreSnapshot.take(tempDir).buffers.paths[0]
+        )
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        index.budget = _systemlink_storeandforward_inspector.ScanBudget(maxBytes=size // 3)
+
+        counts = []
+        for _ in range(4):
+            index.budget.start()
+            counts.append(
+                _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+            )
+
+        assert counts[:3] == [None, None, None]
+        assert counts[3] == (results, steps)
+        assert index.budget.bytesHits == 3
+        assert index.statistics.bytesScanned == size
+
+
+def test_budgetRunsOut_calculatePendingRequests_returnsLastCompleteCounts():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        bufferPath = _write_sample_transaction_buffer(
+            tempDir, [(start + timedelta(seconds=1), "ResultCreateRequest")]
+        )
+        _write_cache_file(tempDir, start)
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        first = _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+        _append_sample_transactions(
+            bufferPath,
+            [(start + timedelta(seconds=2 + i), "StepCreateRequest") for i in range(1000)],
+        )
+        index.budget = _systemlink_storeandforward_inspector.ScanBudget(maxSeconds=1e-9)
+
+        index.budget.start()
+        second = _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+        index.budget = None
+        third = _systemlink_storeandforward_inspector.calculate_pending_requests(tempDir, index)
+
+        assert first == (1, 0)
+        assert second == (1, 0)
+        assert third == (1, 1000)
+
+
+def test_rewrittenBufferSkipped_indexScanAll_dropsOldState():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        bufferPath = _write_sample_transaction_buffer(tempDir, [(start, "ResultCreateRequest")])
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        index.scan_all(
+            _systemlink_storeandforward_inspector.StoreSnapshot.take(tempDir).buffers.files
+        )
+        os.remove(bufferPath)
+        with open(bufferPath, "x") as fp:
+            fp.write(_format_sample_transaction(start, "StepCreateRequest"))
+        largePath = _write_sample_transaction_buffer(tempDir, [(start, "StepCreateRequest")] * 100)
+        files = sorted(
+            _systemlink_storeandforward_inspector.StoreSnapshot.take(tempDir).buffers.files,
+            key=lambda f: f.path != largePath,
+        )
+        index.budget = _systemlink_storeandforward_inspector.ScanBudget(maxBytes=100)
+
+        index.budget.start()
+        states = index.scan_all(files)
+
+        assert index.incomplete
+        assert [state.offset < os.path.getsize(largePath) for state in states] == [True]
+        assert bufferPath not in index.states
+
+
+def test_timeBudget_indexScanAll_stopsAndCountsHit():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        _write_large_store(tempDir)
+        snapshot = _systemlink_storeandforward_inspector.StoreSnapshot.take(tempDir)
+        index = _systemlink_storeandforward_inspector.BufferIndex()
+        index.budget = _systemlink_storeandforward_inspector.ScanBudget(maxSeconds=1e-9)
+
+        index.budget.start()
+        (state,) = index.scan_all(snapshot.buffers.files)
+
+        assert index.incomplete
+        assert 0 < state.offset < snapshot.buffers.files[0].size
+        assert (index.budget.bytesHits, index.budget.timeHits) == (0, 1)
+
+
+@pytest.mark.parametrize(
+    "scanned",
+    [[5, 6, 9], [9, 5, 6], [2, 7, 3]],
+)
+def test_scannedRequests_bufferScanStateMerge_keepsTimestampsSorted(scanned):
+    state = _systemlink_storeandforward_inspector._BufferScanState(0, 0, 0)
+    state.merge(
+        _systemlink_storeandforward_inspector._ScanResult(
+            10, b"a", {"StepCreateRequest": array("q", [1, 4])}
+        )
+    )
+
+    state.merge(
+        _systemlink_storeandforward_inspector._ScanResult(
+            20, b"b", {"StepCreateRequest": array("q", scanned)}
+        )
+    )
+
+    assert list(state.timestamps["StepCreateRequest"]) == sorted([1, 4] + scanned)
+    assert (state.offset, state.guard) == (20, b"b")
+
+
+def test_moreItemsThanCapacity_spaceSavingTop_countsFrequentItems():
+    counter = _systemlink_storeandforward_inspector.SpaceSaving(3)
+    for item in ["a"] * 10 + ["b", "c", "d", "e"] * 2 + ["f"] * 6:
+        counter.add(item)
+
+    top = counter.top()
+
+    assert len(top) == 3
+    assert top[0] == ("a", 10, 0)
+    item, count, error = top[1]
+    assert item == "f"
+    assert count - error <= 6 <= count
+
+
+def test_realRequestTransactionsBuffer_calculateQuarantineAnalysis_returnsClassesAndAges():
+    storeDirectory = os.path.join(os.path.dirname(__file__), "testmon")
+    analyzer = _systemlink_storeandforward_inspector.QuarantineAnalyzer(topK=10)
+
+    analysis = _systemlink_storeandforward_inspector.calculate_quarantine_analysis(
+        storeDirectory, analyzer
+    )
+
+    assert analysis.requests == 62
+    assert {c: count for (c, count, _) in analysis.topClasses} == {
+        ("StepCreateRequest", ""): 46,
+        ("StepUpdateRequest", ""): 10,
+        ("ResultCreateRequest", ""): 3,
+        ("ResultUpdateRequest", ""): 3,
+    }
+    assert analysis.ageHistogram == [0, 0, 0, 0, 0, 62]
+    assert analysis.newClasses == []
+
+
+def test_requestsWithReasons_calculateQuarantineAnalysis_classifiesByReasonAndAge():
+    now = datetime.now(timezone.utc)
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        quarantineDirectory = os.path.join(tempDir, "quarantine")
+        os.mkdir(quarantineDirectory)
+        with open(os.path.join(quarantineDirectory, str(uuid.uuid1()) + ".jsonl"), "x") as fp:
+            for age, reason in [(60, "Not found"), (7200, "Not found"), (7200, None)]:
+                request = {
+                    "timestamp": (now - timedelta(seconds=age)).isoformat(),
+                    "type": "ResultUpdateRequest",
+                }
+                if reason:
+                    request["properties"] = {"error": {"message": reason}}
+                fp.write(json.dumps(request) + "\n")
+
+        analysis = _systemlink_storeandforward_inspector.calculate_quarantine_analysis(
+            tempDir, _systemlink_storeandforward_inspector.QuarantineAnalyzer(), now.timestamp()
+        )
+
+        assert analysis.topClasses == [
+            (("ResultUpdateRequest", "Not found"), 2, 0),
+            (("ResultUpdateRequest", ""), 1, 0),
+        ]
+        assert analysis.ageHistogram == [1, 2, 0, 0, 0, 0]
+
+
+def test_timePassedWithoutChanges_calculateQuarantineAnalysis_agesRequests():
+    now = datetime.now(timezone.utc)
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        quarantineDirectory = os.path.join(tempDir, "quarantine")
+        os.mkdir(quarantineDirectory)
+        _write_sample_transaction_buffer(
+            quarantineDirectory,
+            [
+                (now - timedelta(seconds=60), "ResultCreateRequest"),
+                (now - timedelta(hours=2), "StepCreateRequest"),
+            ],
+        )
+        analyzer = _systemlink_storeandforward_inspector.QuarantineAnalyzer()
+
+        first = _systemlink_storeandforward_inspector.calculate_quarantine_analysis(
+            tempDir, analyzer, now.timestamp()
+        )
+        second = _systemlink_storeandforward_inspector.calculate_quarantine_analysis(
+            tempDir, analyzer, (now + timedelta(days=2)).timestamp()
+        )
+
+        assert first.ageHistogram == [1, 1, 0, 0, 0, 0]
+        assert second.ageHistogram == [0, 0, 0, 2, 0, 0]
+        assert second.topClasses == first.topClasses
+
+
+def test_requestsOverManyBins_calculateQuarantineAnalysis_keepsBinsOfLastBucketOnly():
+    now = datetime.now(timezone.utc)
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        quarantineDirectory = os.path.join(tempDir, "quarantine")
+        os.mkdir(quarantineDirectory)
+        _write_sample_transaction_buffer(
+            quarantineDirectory,
+            [(now - timedelta(seconds=7 * i), "ResultCreateRequest") for i in range(1000)],
+        )
+        analyzer = _systemlink_storeandforward_inspector.QuarantineAnalyzer(
+            ageBuckets=(60, 600), ageResolution=6
+        )
+
+        analysis = _systemlink_storeandforward_inspector.calculate_quarantine_analysis(
+            tempDir, analyzer, now.timestamp()
+        )
+
+        assert len(analyzer._bins) <= 600 // 10 + 1
+        assert sum(analysis.ageHistogram) == 1000
+        assert abs(analysis.ageHistogram[1] - (600 - 60) / 7) <= 2
+
+
+def test_failureClassAppeared_calculateQuarantineAnalysis_returnsNewClass():
+    with tempfile.TemporaryDirectory(prefix="test_") as tempDir:
+        quarantineDirectory = os.path.join(tempDir, "quarantine")
+        os.mkdir(quarantineDirectory)
+        bufferPath = _write_sample_transaction_buffer(
+            quarantineDirectory, [(datetime.now(), "ResultCreateRequest")]
+        )
+        analyzer = _systemlink_storeandforward_inspector.QuarantineAnalyzer()
+
+        first = _systemlink_storeandforward_inspector.calculate_quarantine_analysis(
+            tempDir, analyzer
+        )
+        _append_sample_transactions(
+            bufferPath,
+            [(datetime.now(), "ResultCreateRequest"), (datetime.now(), "StepCreateRequest")],
+        )
+        second = _systemlink_storeandforward_inspector.calculate_quarantine_analysis(
+            tempDir, analyzer
+        )
+        third = _systemlink_storeandforward_inspector.calculate_quarantine_analysis(
+            tempDir, analyzer
+        )
+
+        assert first.newClasses == []
+        assert second.newClasses == [("StepCreateRequest", "")]
+        assert third.requests == 3
+        assert third.newClasses == []
+
+
 def _write_sample_pending_file(directory: str):
     filename = str(uuid.uuid1()) + ".file"
     with open(os.path.join(directory, filename), "x") as fp:
         fp.write("empty")
 
 
-def _write_sample_transaction_buffer(directory: str, requests: List[Tuple[datetime, str]]):
-    lines = map(
-        lambda tuple: json.dumps({"timestamp": datetime.isoformat(tuple[0]), "type": tuple[1]}, indent=None) + "\n",
-        requests,
-    )
-    filename = str(uuid.uuid1()) + ".jsonl"
-    with open(os.path.join(directory, filename), "x") as fp:
+def _write_sample_transaction_buffer(directory: str, requests: List[Tuple[datetime, str]]) -> str:
+    lines = map(lambda tuple: _format_sample_transaction(*tuple), requests)
+    path = os.path.join(directory, str(uuid.uuid1()) + ".jsonl")
+    with open(path, "x") as fp:
         fp.writelines(lines)
+    return path
+
+
+def _append_sample_transactions(path: str, requests: List[Tuple[datetime, str]]):
+    with open(path, "a") as fp:
+        fp.writelines(map(lambda tuple: _format_sample_transaction(*tuple), requests))
+
+
+def _format_sample_transaction(timestamp: datetime, type: str) -> str:
+    return (
+        json.dumps({"timestamp": datetime.isoformat(timestamp), "type": type}, indent=None) + "\n"
+    )
 
 
 def _write_cache_file(directory: str, timestamp: datetime):
     contents = json.dumps({"timestamp": datetime.isoformat(timestamp)}, indent=None)
     with open(os.path.join(directory, "__CACHE__"), "x") as fp:
         fp.write(contents)
+
+
+def _write_large_store(directory: str) -> Tuple[int, int]:
+    # Writes 6000 requests a second apart of which the last 4000 are pending, a fifth of
+    # them results, and returns the pending results and steps.
+    start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    types = [
+        "ResultUpdateRequest",
+        "StepCreateRequest",
+        "StepUpdateRequest",
+        "StepCreateRequest",
+        "StepUpdateRequest",
+    ]
+    _write_sample_transaction_buffer(
+        directory, [(start + timedelta(seconds=i), types[i % len(types)]) for i in range(6000)]
+    )
+    _write_cache_file(directory, start + timedelta(seconds=1999.5))
+    return (800, 3200)
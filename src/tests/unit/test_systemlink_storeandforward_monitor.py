@@ -0,0 +1,610 @@
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from systemlink_storeandforward_beacon import systemlink_storeandforward_monitor
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="-X importtime requires Python 3.7")
+def test_importMonitor_importTime_defersSdkAndPlatformModules():
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            "import " + systemlink_storeandforward_monitor.__name__,
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=True,
+        env=environment,
+        universal_newlines=True,
+    ).stderr
+    imported = {
+        line.split("|")[2].strip()
+        for line in output.splitlines()
+        if line.startswith("import time:")
+    }
+
+    assert "systemlink_storeandforward_beacon.systemlink_storeandforward_monitor" in imported
+    deferred = {"systemlink", "psutil", "winreg", "dateutil", "multiprocessing"}
+    assert {module for module in imported if module.split(".")[0] in deferred} == set()
+
+
+@pytest.mark.skipif(sys.version_info < (3, 7), reason="Worker initializers require Python 3.7")
+def test_spawnedScanWorkers_createScanExecutor_importInspectorFromItsFile():
+    script = "\n".join(
+        [
+            "import multiprocessing, sys",
+            "from systemlink_storeandforward_beacon import systemlink_storeandforward_monitor",
+            "inspector = systemlink_storeandforward_monitor._systemlink_storeandforward_inspector",
+            "multiprocessing.set_start_method('spawn')",
+            "path = list(sys.path)",
+            "with inspector.create_scan_executor(1) as executor:",
+            "    scan = executor.submit(",
+            "        inspector._scan_transactions_in_worker, sys.argv[1], 0, b'', ()",
+            "    ).result()",
+            "print(sum(map(len, scan.timestamps.values())), sys.path == path)",
+        ]
+    )
+    bufferPath = os.path.join(
+        os.path.dirname(__file__), "testmon", "8536b793-cade-4ef4-92dd-083cc04d214f.jsonl"
+    )
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+
+    output = subprocess.run(
+        [sys.executable, "-c", script, bufferPath],
+        stdout=subprocess.PIPE,
+        check=True,
+        env=environment,
+        universal_newlines=True,
+    ).stdout
+
+    scan = (
+        systemlink_storeandforward_monitor._systemlink_storeandforward_inspector._scan_transactions(
+            bufferPath, 0, b"", ()
+        )
+    )
+    assert output.split() == [str(sum(map(len, scan.timestamps.values()))), "True"]
+
+
+def test_importMonitor_sysPath_isUnchanged():
+    path = list(sys.path)
+
+    systemlink_storeandforward_monitor._import_inspector()
+
+    assert sys.path == path
+
+
+def test_notWindows_readServiceStatus_returnsUnknown(monkeypatch):
+    monkeypatch.setattr(sys, "platform", "linux")
+
+    assert (
+        systemlink_storeandforward_monitor._read_service_status("nisystemlinkforwarding")
+        == "unknown"
+    )
+
+
+def test_notWindows_getNiCommonAppdataDir_readsEnvironment(monkeypatch):
+    monkeypatch.setattr(sys, "platform", "linux")
+    monkeypatch.setattr(systemlink_storeandforward_monitor, "NI_COMMON_APPDATA_DIR", None)
+    monkeypatch.setenv("NIPUBAPPDATADIR", os.path.join("var", "ni"))
+
+    storeDirectory = systemlink_storeandforward_monitor._get_testmon_store_directory()
+
+    assert storeDirectory == os.path.join("var", "ni", "Skyline", "Data", "Store", "testmon")
+
+
+def test_scanRunning_slowScanWorkerStart_runsOneScanAtATime(monkeypatch):
+    scan = _ScanStub(monkeypatch, [{"a": 1}])
+    worker = systemlink_storeandforward_monitor._SlowScanWorker()
+
+    started = [_start_scan(worker), _start_scan(worker)]
+    scan.release.set()
+    worker.wait(10)
+
+    assert started == [True, False]
+    assert scan.calls == 1
+    assert worker.latest()[0] == {"a": 1}
+
+
+def test_scanRunning_slowScanWorkerLatest_returnsPreviousValues(monkeypatch):
+    scan = _ScanStub(monkeypatch, [{"a": 1}, {"a": 2}])
+    worker = systemlink_storeandforward_monitor._SlowScanWorker()
+    scan.release.set()
+    _start_scan(worker)
+    worker.wait(10)
+    previous = worker.latest()
+    scan.release.clear()
+
+    _start_scan(worker)
+    duringScan = worker.latest()
+    scan.release.set()
+    worker.wait(10)
+
+    assert previous[0] == {"a": 1}
+    assert duringScan == previous
+    assert worker.latest()[0] == {"a": 2}
+
+
+def test_scanFails_slowScanWorker_keepsPreviousValuesAndScansAgain(monkeypatch):
+    scan = _ScanStub(monkeypatch, [{"a": 1}, OSError("unreadable"), {"a": 3}])
+    worker = systemlink_storeandforward_monitor._SlowScanWorker()
+    scan.release.set()
+    started = []
+    values = []
+
+    for _ in range(3):
+        started.append(_start_scan(worker))
+        worker.wait(10)
+        values.append(worker.latest()[0])
+
+    assert started == [True, True, True]
+    assert values == [{"a": 1}, {"a": 1}, {"a": 3}]
+
+
+def test_unchangedValues_publishTagValues_writesOnlyChangedTags(monkeypatch):
+    tags = _tags(a=1, b=2)
+    written = _stub_tag_writes(monkeypatch, tags)
+
+    _publish(_options())
+    tags["b"]["value"] = 3
+    _publish(_options())
+    _publish(_options())
+
+    assert written == [
+        {"minion.a": [("1", None)], "minion.b": [("2", None)]},
+        {"minion.b": [("3", None)]},
+    ]
+
+
+def test_heartbeatElapsed_publishTagValues_writesUnchangedValue(monkeypatch):
+    tags = _tags(a=1, b=2)
+    written = _stub_tag_writes(monkeypatch, tags)
+
+    _publish(_options(tag_heartbeat_interval=600))
+    tags["a"]["published_time"] -= 601
+    _publish(_options(tag_heartbeat_interval=600))
+
+    assert written == [
+        {"minion.a": [("1", None)], "minion.b": [("2", None)]},
+        {"minion.a": [("1", None)]},
+    ]
+
+
+def test_noHeartbeatInterval_publishTagValues_writesEveryValue(monkeypatch):
+    tags = _tags(a=1)
+    written = _stub_tag_writes(monkeypatch, tags)
+
+    _publish(_options(tag_heartbeat_interval=0))
+    _publish(_options(tag_heartbeat_interval=0))
+
+    assert written == [{"minion.a": [("1", None)]}] * 2
+
+
+def test_runsOverBudget_scheduleStarted_backsOffAndRecovers():
+    schedule = systemlink_storeandforward_monitor._Schedule()
+
+    schedule.started(0, None, interval=10, budget=5, maxInterval=100)
+    intervals = [schedule.interval]
+    for duration in (20, 20, 20, 1, 1, 1, 1):
+        schedule.started(0, duration, interval=10, budget=5, maxInterval=100)
+        intervals.append(schedule.interval)
+
+    assert intervals == [10, 40, 80, 100, 50, 25, 12.5, 10]
+    assert not schedule.due(9.9)
+    assert schedule.due(10)
+
+
+def test_backlogShrinking_drainRateEstimatorAdd_returnsRatesAndTimeToDrain():
+    estimator = systemlink_storeandforward_monitor._DrainRateEstimator(3)
+
+    first = estimator.add(0, 100, 0)
+    second = estimator.add(60, 70, 10)
+
+    assert first is None
+    assert second == (10, 40, 70 / (40 / 60 - 10 / 60))
+
+
+def test_backlogGrowing_drainRateEstimatorAdd_returnsNoTimeToDrain():
+    estimator = systemlink_storeandforward_monitor._DrainRateEstimator(3)
+
+    estimator.add(0, 100, 0)
+    _, _, timeToDrain = estimator.add(60, 120, 30)
+
+    assert timeToDrain == -1
+
+
+def test_sendFailsOnce_tagOutboxFlush_retriesAndWrites(monkeypatch):
+    monkeypatch.setattr(systemlink_storeandforward_monitor._TagOutbox, "RETRY_DELAY", 0)
+    outbox = systemlink_storeandforward_monitor._TagOutbox()
+    outbox.put("a", "DOUBLE", "1")
+    outbox.put("a", "DOUBLE", "2")
+    outbox.put("b", "DOUBLE", "3")
+    sent: List[List[Tuple[str, List[str]]]] = []
+
+    async def send(batch):
+        if not sent:
+            sent.append([])
+            raise OSError("unreachable")
+        sent.append([(path, [value for (value, _) in entry.values]) for (path, entry) in batch])
+
+    flushed = _run(outbox.flush(send, batchSize=10, retries=1, maxBackoff=60))
+
+    assert flushed
+    assert sent[1:] == [[("a", ["2"]), ("b", ["3"])]]
+    assert len(outbox) == 0
+
+
+def test_sendFails_tagOutboxFlush_keepsLatestValueAndBacksOff(monkeypatch):
+    monkeypatch.setattr(systemlink_storeandforward_monitor._TagOutbox, "RETRY_DELAY", 0.001)
+    outbox = systemlink_storeandforward_monitor._TagOutbox()
+    outbox.put("a", "DOUBLE", "1")
+
+    async def fail(batch):
+        raise OSError("unreachable")
+
+    async def flush_twice():
+        flushed = await outbox.flush(fail, batchSize=10, retries=0, maxBackoff=60)
+        outbox.put("a", "DOUBLE", "2")
+        return (flushed, await outbox.flush(fail, batchSize=10, retries=0, maxBackoff=60))
+
+    flushed, flushedAgain = _run(flush_twice())
+
+    assert not flushed
+    assert not flushedAgain
+    assert [entry.values for entry in outbox._entries.values()] == [[("2", None)]]
+
+
+def test_timestampedSendFails_tagOutboxFlush_keepsValuesAndBacksOff(monkeypatch):
+    monkeypatch.setattr(systemlink_storeandforward_monitor._TagOutbox, "RETRY_DELAY", 0.001)
+    outbox = systemlink_storeandforward_monitor._TagOutbox()
+    first = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    second = datetime(2021, 1, 1, 0, 1, tzinfo=timezone.utc)
+    outbox.put("a", "DOUBLE", "1", first, maxValues=10)
+
+    async def fail(batch):
+        raise OSError("unreachable")
+
+    async def flush_twice():
+        flushed = await outbox.flush(fail, batchSize=10, retries=0, maxBackoff=60)
+        outbox.put("a", "DOUBLE", "2", second, maxValues=10)
+        return (flushed, await outbox.flush(fail, batchSize=10, retries=0, maxBackoff=60))
+
+    flushed, flushedAgain = _run(flush_twice())
+
+    assert not flushed
+    assert not flushedAgain
+    assert [entry.values for entry in outbox._entries.values()] == [[("1", first), ("2", second)]]
+
+
+def test_historyUploadInterval_publishTagValues_uploadsSampledValuesTogether(monkeypatch):
+    monkeypatch.setattr(systemlink_storeandforward_monitor, "NEXT_HISTORY_UPLOAD", 0.0)
+    tags = _tags(a=1)
+    written = _stub_tag_writes(monkeypatch, tags)
+    options = _options(history_upload_interval=60)
+
+    _publish(options)
+    for value in (2, 3):
+        tags["a"]["value"] = value
+        _publish(options)
+    requestsBeforeUpload = len(written)
+    monkeypatch.setattr(systemlink_storeandforward_monitor, "NEXT_HISTORY_UPLOAD", 0.0)
+    _publish(options)
+
+    timestamps = [timestamp for request in written for (_, timestamp) in request["minion.a"]]
+    assert requestsBeforeUpload == 1
+    assert [[value for (value, _) in request["minion.a"]] for request in written] == [
+        ["1"],
+        ["2", "3"],
+    ]
+    assert None not in timestamps
+    assert timestamps == sorted(timestamps)
+
+
+def test_uploadFails_publishTagValues_keepsSampledValuesForNextUpload(monkeypatch):
+    monkeypatch.setattr(systemlink_storeandforward_monitor._TagOutbox, "RETRY_DELAY", 0)
+    monkeypatch.setattr(systemlink_storeandforward_monitor, "NEXT_HISTORY_UPLOAD", 0.0)
+    tags = _tags(a=1)
+    written = _stub_tag_writes(monkeypatch, tags, failures=1)
+    options = _options(history_upload_interval=60, publish_retries=0)
+
+    _publish(options)
+    queued = [
+        value
+        for (value, _) in systemlink_storeandforward_monitor.TAG_OUTBOX._entries["minion.a"].values
+    ]
+    tags["a"]["value"] = 2
+    monkeypatch.setattr(systemlink_storeandforward_monitor, "NEXT_HISTORY_UPLOAD", 0.0)
+    _publish(options)
+
+    assert queued == ["1"]
+    assert [[value for (value, _) in request["minion.a"]] for request in written] == [["1", "2"]]
+
+
+@pytest.mark.parametrize(
+    "seconds,label",
+    [(3600, "<1h"), (6 * 3600, "<6h"), (86400, "<1d"), (90, "<90s"), (120, "<2m")],
+)
+def test_ageBucket_formatAge_returnsLargestWholeUnit(seconds, label):
+    assert systemlink_storeandforward_monitor._format_age(seconds) == label
+
+
+@pytest.mark.parametrize(
+    "size,label",
+    [(64 * 1024, "64KiB"), (1024 * 1024, "1MiB"), (2**30, "1GiB"), (1000, "1000B")],
+)
+def test_sizeBucket_formatSize_returnsLargestWholeUnit(size, label):
+    assert systemlink_storeandforward_monitor._format_size(size) == label
+
+
+@pytest.mark.parametrize(
+    "stores",
+    [
+        "store",
+        ["store"],
+        [{"root": "store"}],
+        [{"path": 1}],
+        [{}, {"path": "store"}],
+        [{"path": "a", "prefix": "minion.B"}, {"path": "b", "prefix": "minion.B"}],
+    ],
+)
+def test_invalidStores_validate_returnsFalse(stores):
+    valid, _ = systemlink_storeandforward_monitor.validate([{"stores": stores}])
+
+    assert not valid
+
+
+def test_storesWithDifferentPrefixes_validate_returnsTrue():
+    stores = [{}, {"path": "store", "prefix": "minion.B"}]
+
+    valid, _ = systemlink_storeandforward_monitor.validate([{"stores": stores}])
+
+    assert valid
+
+
+@pytest.mark.parametrize(
+    "categories",
+    [
+        ["results"],
+        {"results": "ResultCreateRequest"},
+        {"results": [1]},
+    ],
+)
+def test_invalidCategories_validate_returnsFalse(categories):
+    valid, _ = systemlink_storeandforward_monitor.validate([{"pending_categories": categories}])
+
+    assert not valid
+
+
+def test_categoriesOfTypes_validate_returnsTrue():
+    categories = {"created": ["ResultCreateRequest", "StepCreateRequest"], "files": []}
+
+    valid, _ = systemlink_storeandforward_monitor.validate([{"pending_categories": categories}])
+
+    assert valid
+
+
+def test_twoStores_scanSlowTagValues_returnsValuesOfEachStore(tmp_path, monkeypatch):
+    for name in ("BUFFER_INDEX", "BUFFER_INDEX_FILE", "SCAN_BUDGET", "SCAN_EXECUTOR"):
+        monkeypatch.setattr(systemlink_storeandforward_monitor, name, None)
+    sampleDirectory = os.path.join(os.path.dirname(__file__), "testmon")
+    shutil.copytree(sampleDirectory, str(tmp_path / "a" / "testmon"))
+    shutil.copytree(
+        sampleDirectory,
+        str(tmp_path / "b" / "testmon"),
+        ignore=shutil.ignore_patterns("quarantine"),
+    )
+    stores = [
+        systemlink_storeandforward_monitor._MonitoredStore(str(tmp_path / "a"), "minion"),
+        systemlink_storeandforward_monitor._MonitoredStore(str(tmp_path / "b"), "minion.B"),
+    ]
+    snapshots = [
+        systemlink_storeandforward_monitor._systemlink_storeandforward_inspector.StoreSnapshot.take(
+            store.store_directory, store.file_store_directory
+        )
+        for store in stores
+    ]
+    options = dict(
+        systemlink_storeandforward_monitor.DEFAULT_CONFIG, index_file=str(tmp_path / "index")
+    )
+
+    values = systemlink_storeandforward_monitor._scan_slow_tag_values(stores, snapshots, options)
+
+    assert [(v["pending.results"], v["pending.steps"], v["quarantine"]) for v in values] == [
+        (3, 26, 62),
+        (3, 26, 0),
+    ]
+    assert values[0]["beacon.files_scanned"] == 3
+    assert [key for key in values[1] if key.startswith("beacon.")] == []
+    assert len(systemlink_storeandforward_monitor.BUFFER_INDEX.states) == 2
+
+
+def test_otherRequestTypesAdded_scanSlowTagValues_ratesCountOnlyResultsAndSteps(
+    tmp_path, monkeypatch
+):
+    for name in ("BUFFER_INDEX", "BUFFER_INDEX_FILE", "SCAN_BUDGET", "SCAN_EXECUTOR"):
+        monkeypatch.setattr(systemlink_storeandforward_monitor, name, None)
+    (tmp_path / "testmon").mkdir()
+    (tmp_path / "testmon" / "__CACHE__").write_text(
+        json.dumps({"timestamp": "2022-01-01T00:00:00Z"})
+    )
+    bufferPath = str(tmp_path / "testmon" / "buffer.jsonl")
+    store = systemlink_storeandforward_monitor._MonitoredStore(str(tmp_path), "minion")
+    options = _options(index_file=str(tmp_path / "index"))
+    added = (
+        ["ResultUpdateRequest"] * 10 + ["StepCreateRequest"] * 5 + ["TestPlanUpdateRequest"] * 20
+    )
+    values = []
+
+    for types in (["ResultCreateRequest", "StepCreateRequest"], added):
+        _append_sample_requests(bufferPath, types)
+        inspector = systemlink_storeandforward_monitor._systemlink_storeandforward_inspector
+        snapshot = inspector.StoreSnapshot.take(store.store_directory, store.file_store_directory)
+        values.append(
+            systemlink_storeandforward_monitor._scan_slow_tag_values([store], [snapshot], options)[
+                0
+            ]
+        )
+
+    assert values[1]["pending.results"] + values[1]["pending.steps"] == 17
+    assert values[1]["pending.enqueue_rate"] > 0
+    assert values[1]["pending.forward_rate"] == 0
+    assert values[1]["pending.time_to_drain"] == -1
+
+
+def test_pendingCategories_scanSlowTagValues_publishesPendingRequestsByCategory(
+    tmp_path, monkeypatch
+):
+    for name in ("BUFFER_INDEX", "BUFFER_INDEX_FILE", "SCAN_BUDGET", "SCAN_EXECUTOR"):
+        monkeypatch.setattr(systemlink_storeandforward_monitor, name, None)
+    (tmp_path / "testmon").mkdir()
+    (tmp_path / "testmon" / "__CACHE__").write_text(
+        json.dumps({"timestamp": "2022-01-01T00:00:00Z"})
+    )
+    _append_sample_requests(
+        str(tmp_path / "testmon" / "buffer.jsonl"),
+        ["ResultCreateRequest"] * 2 + ["StepCreateRequest"] * 3 + ["StepUpdateRequest"] * 4,
+    )
+    store = systemlink_storeandforward_monitor._MonitoredStore(str(tmp_path), "minion")
+    snapshot = (
+        systemlink_storeandforward_monitor._systemlink_storeandforward_inspector.StoreSnapshot.take(
+            store.store_directory, store.file_store_directory
+        )
+    )
+    options = _options(
+        index_file=str(tmp_path / "index"),
+        pending_breakdown_tags=True,
+        pending_categories={"created": ["ResultCreateRequest", "StepCreateRequest"]},
+    )
+
+    values = systemlink_storeandforward_monitor._scan_slow_tag_values([store], [snapshot], options)[
+        0
+    ]
+
+    assert json.loads(values["pending.by_category"]) == {"created": 5}
+    assert json.loads(values["pending.by_type"]) == {
+        "ResultCreateRequest": 2,
+        "StepCreateRequest": 3,
+        "StepUpdateRequest": 4,
+    }
+
+
+def test_budgetRunsOutOnFirstScan_scanSlowTagValues_leavesPendingRequestsUnpublished(
+    tmp_path, monkeypatch
+):
+    for name in ("BUFFER_INDEX", "BUFFER_INDEX_FILE", "SCAN_BUDGET", "SCAN_EXECUTOR"):
+        monkeypatch.setattr(systemlink_storeandforward_monitor, name, None)
+    shutil.copytree(os.path.join(os.path.dirname(__file__), "testmon"), str(tmp_path / "testmon"))
+    store = systemlink_storeandforward_monitor._MonitoredStore(str(tmp_path), "minion")
+    snapshot = (
+        systemlink_storeandforward_monitor._systemlink_storeandforward_inspector.StoreSnapshot.take(
+            store.store_directory, store.file_store_directory
+        )
+    )
+
+    values = systemlink_storeandforward_monitor._scan_slow_tag_values(
+        [store], [snapshot], _options(index_file=str(tmp_path / "index"), scan_max_mib=1e-6)
+    )[0]
+
+    assert "pending.results" not in values
+    assert "pending.steps" not in values
+    assert "pending.enqueue_rate" not in values
+    assert values["quarantine"] == 62
+
+
+def _options(**options) -> Dict[str, Any]:
+    return dict(systemlink_storeandforward_monitor.DEFAULT_CONFIG, **options)
+
+
+def _start_scan(worker) -> bool:
+    return worker.start([], [], _options())
+
+
+class _ScanStub:
+    """Replaces the slow scan, returning or raising the next result once released."""
+
+    def __init__(self, monkeypatch, results: List[Any]):
+        self.results = list(results)
+        self.calls = 0
+        self.release = threading.Event()
+        monkeypatch.setattr(systemlink_storeandforward_monitor, "_scan_slow_tag_values", self)
+
+    def __call__(self, *args):
+        self.calls += 1
+        self.release.wait(10)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def _tags(**values) -> Dict[str, Dict[str, Any]]:
+    return {
+        key: {"path": "minion." + key, "type": "INT", "value": value}
+        for (key, value) in values.items()
+    }
+
+
+def _publish(options: Dict[str, Any]):
+    _run(systemlink_storeandforward_monitor._publish_tag_values(options))
+
+
+def _stub_tag_writes(
+    monkeypatch, tags: Dict[str, Dict[str, Any]], failures: int = 0
+) -> List[Dict[str, List[Tuple[str, Any]]]]:
+    # Replaces writing the tags, returning the values of the given tags written by each
+    # request. The first writes fail.
+    tagInfo = dict(tags)
+    for key in ("beacon.tag_write_duration", "beacon.queued_tags"):
+        tagInfo[key] = {"path": "minion." + key, "type": "DOUBLE"}
+    monkeypatch.setattr(systemlink_storeandforward_monitor, "TAG_INFO", tagInfo)
+    store = systemlink_storeandforward_monitor._MonitoredStore(None, "minion")
+    store.tags = tagInfo
+    monkeypatch.setattr(systemlink_storeandforward_monitor, "STORES", [store])
+    monkeypatch.setattr(
+        systemlink_storeandforward_monitor,
+        "TAG_OUTBOX",
+        systemlink_storeandforward_monitor._TagOutbox(),
+    )
+    written = []
+
+    async def write(batch):
+        nonlocal failures
+        if failures:
+            failures -= 1
+            raise OSError("unreachable")
+        paths = {tag["path"] for tag in tags.values()}
+        values = {path: list(entry.values) for (path, entry) in batch if path in paths}
+        if values:
+            written.append(values)
+
+    monkeypatch.setattr(systemlink_storeandforward_monitor, "_write_tag_values", write)
+    return written
+
+
+def _append_sample_requests(path: str, types: List[str]):
+    with open(path, "a") as fp:
+        for transactionType in types:
+            fp.write(
+                json.dumps({"timestamp": "2022-03-10T21:48:27.805164Z", "type": transactionType})
+                + "\n"
+            )
+
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()